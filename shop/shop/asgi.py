@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'shop.settings')
 
 application = get_asgi_application()
+
+# Prebuilt catalogue snapshot (manage.py build_catalogue_snapshot) spares cold workers the catalogue queries
+from store.snapshot import load_snapshot  # noqa: E402
+
+load_snapshot()
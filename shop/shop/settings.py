@@ -43,6 +43,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'store.metrics.InstrumentationMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -55,7 +56,8 @@ ROOT_URLCONF = 'shop.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates that also times rendering for /metrics/
+        'BACKEND': 'store.metrics.DjangoTemplates',
         'DIRS': [
             BASE_DIR / 'templates'
         ],
@@ -85,6 +87,49 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+
+# Shared by all workers and management commands: catalogue version bumps from imports and
+# signals must reach every process. A per-process backend (locmem) leaves other workers stale
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000
+        }
+    }
+}
+
+# Tests run on their own in-memory cache and never touch the on-disk cache above
+TEST_RUNNER = 'store.test_runner.StoreTestRunner'
+
+# Fragments of store templates: categories menu, home page catalogue, product cards
+STORE_CACHE_TIMEOUT = 60 * 60
+# Full pages for anonymous visitors: home, category and product pages
+STORE_PAGE_CACHE_TIMEOUT = 10 * 60
+STORE_CACHE_STATS = True
+# Search ranks every full-text match by default; an integer ranks only the first N matches
+# (faster broad queries, but relevance is approximate past N)
+STORE_SEARCH_MAX_CANDIDATES = None
+# Catalogue snapshot loaded by workers at startup; rechecked against the database every N seconds
+STORE_SNAPSHOT_PATH = BASE_DIR / 'catalogue.snapshot'
+STORE_SNAPSHOT_CHECK_INTERVAL = 30
+# Per-view histograms on /metrics/ (staff or INTERNAL_IPS); share of requests logging their slowest queries
+STORE_METRICS_SAMPLE_RATE = 0.0
+STORE_METRICS_SLOW_QUERIES = 5
+INTERNAL_IPS = ['127.0.0.1']
+# Write-behind buffer for favourites clicks: flushed every N changes or after the interval (seconds).
+# The buffer lives in process memory, so it is only for single-worker deployments (one gunicorn/uvicorn
+# worker, threads are fine): the buffer holds a lock on STORE_FAVOURITES_LOCK_PATH and a second process
+# enabling it raises ImproperlyConfigured. Clicks still buffered are lost if the worker is killed (SIGKILL).
+STORE_FAVOURITES_WRITE_BEHIND = False
+STORE_FAVOURITES_BATCH_SIZE = 500
+STORE_FAVOURITES_FLUSH_INTERVAL = 2.0
+STORE_FAVOURITES_LOCK_PATH = BASE_DIR / 'favourites.lock'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -297,3 +342,11 @@ DJANGORESIZED_DEFAULT_NORMALIZE_ROTATION = True
 
 STRIPE_PUBLISH_KEY = 'pk_test_51KniXYAxRYRPHE83bbfdE4ksfdYA2pF8frneghPJUbP2CDE8tiFwzAnS92DVnkvC2hlzGIA0gEShDwXzK3HcRnxe009WCAo7Dc'
 STRIPE_SECRET_KEY = 'sk_test_51KniXYAxRYRPHE83AnQt699xPMqf2yp8jmPl1qY1WhdG5AW7mFyKqLrGjsakvGO5KWb6VQBhCrXW0w3pq2ChmlGp0027FjhCDL'
+# Stripe connection pool size (also threads waiting on Stripe when httpx is not installed)
+STRIPE_MAX_CONCURRENT_REQUESTS = 32
+# Signing secret of the Stripe webhook endpoint (payment events)
+STRIPE_WEBHOOK_SECRET = 'whsec_test'
+STRIPE_TIMEOUT = 10
+STRIPE_MAX_RETRIES = 2
+# Checkout session reused for repeated clicks on the same cart
+STRIPE_SESSION_CACHE_TIMEOUT = 60 * 60
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'shop.settings')
 
 application = get_wsgi_application()
+
+# Prebuilt catalogue snapshot (manage.py build_catalogue_snapshot) spares cold workers the catalogue queries
+from store.snapshot import load_snapshot  # noqa: E402
+
+load_snapshot()
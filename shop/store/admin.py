@@ -1,7 +1,8 @@
 from django.contrib import admin
 from django.utils.safestring import mark_safe
 
-from .models import Category, Product, Gallery
+from .images import PREVIEW_FORMAT, RENDITIONS, get_formats, rendition_url
+from .models import Category, Product, Gallery, PaymentEvent
 
 
 # Register your models here.
@@ -32,14 +33,19 @@ class ProductAdmin(admin.ModelAdmin):
     prepopulated_fields = {'slug': ('title', )}
 
     def get_photo(self, obj):
-        if obj.images:
-            try:
-                return mark_safe(f'<img src="{obj.images.first().photo.url}" width=75>')
-            except:
-                return '-'
-        else:
-            return '-'
+        if obj.has_renditions and PREVIEW_FORMAT in get_formats():
+            url = rendition_url(obj.primary_image.name, RENDITIONS['thumb'], PREVIEW_FORMAT)
+            return mark_safe(f'<img src="{url}" width=75>')
+        if obj.primary_image:
+            return mark_safe(f'<img src="{obj.primary_image.url}" width=75>')
+        return '-'
     get_photo.short_description = 'Миниатюра'
 
+class PaymentEventAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'type', 'stripe_id', 'created_at', 'processed_at', 'error')
+    list_display_links = ('pk', 'type')
+    list_filter = ('type', 'error')
+
 admin.site.register(Category, CategoryAdmin)
 admin.site.register(Product, ProductAdmin)
+admin.site.register(PaymentEvent, PaymentEventAdmin)
@@ -0,0 +1,301 @@
+import math
+import platform
+import random
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+from itertools import islice
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .cache import bump_versions
+from .facets import rebuild_facets
+from .models import (Category, Customer, FavouriteProducts, Gallery, Order, OrderProduct, Product, Review,
+                     SyntheticRun, to_money)
+from .recommendations import reset_product_ids
+from .search import rebuild_index
+from .signals import mute_signals
+from .utils import SORT_FIELDS, recount_reviews
+
+PREFIX = 'synthetic'
+DATASET = {
+    'categories': 50,
+    'products': 100_000,
+    'images': 500_000,
+    'users': 1_000,
+    'favourites': 1_000_000,
+    'reviews': 1_000_000,
+    'order_lines': 1_000_000,
+}
+WORDS = ['золото', 'серебро', 'кольцо', 'цепочка', 'браслет', 'часы', 'серьги', 'кулон', 'платина', 'жемчуг',
+         'классический', 'тонкий', 'массивный', 'женский', 'мужской', 'подарочный']
+COLOURS = ['Золото', 'Серебро', 'Платина', 'Белое золото', 'Розовое золото', 'Сталь']
+LINES_PER_ORDER = 5
+DELETE_CHUNK = 1000
+SCENARIOS = ['home', 'category_sort', 'product_detail', 'cart_add', 'checkout']
+
+
+def bulk_insert(model, objects, batch_size):
+    # Генератор режется на пачки: миллион строк не держится в памяти целиком
+    objects = iter(objects)
+    count = 0
+    while batch := list(islice(objects, batch_size)):
+        model.objects.bulk_create(batch)
+        count += len(batch)
+    return count
+
+
+def get_step(size):
+    # Шаг обхода, взаимно простой с числом товаров: пары (пользователь, товар) не повторяются
+    if size < 1:
+        return 1
+    step = 7919
+    while math.gcd(step, size) != 1:
+        step += 2
+    return step % size or 1
+
+
+def generate_dataset(categories=50, products=100_000, images=500_000, users=1_000, favourites=1_000_000,
+                     reviews=1_000_000, order_lines=1_000_000, seed=0, batch_size=5_000, log=None):
+    if min(categories, products, users) < 1:
+        raise ValueError('Нужны хотя бы одна категория, один товар и один пользователь')
+    rng = random.Random(seed)
+    log = log or (lambda message: None)
+    run = f'{PREFIX}-{seed}-{timezone.now():%Y%m%d%H%M%S}'
+    counts = {}
+    with transaction.atomic():
+        # Прогон записывается: удаляются только его строки, а не всё, что начинается с synthetic-
+        SyntheticRun.objects.create(name=run)
+        category_list = Category.objects.bulk_create(
+            [Category(title=f'{rng.choice(WORDS).capitalize()} {i}', slug=f'{run}-{i}', image='categories/test.png')
+             for i in range(categories)]
+        )
+        counts['categories'] = len(category_list)
+
+        per_product, extra = divmod(images, products) if products else (0, 0)
+        counts['products'] = bulk_insert(Product, (
+            Product(title=' '.join(rng.sample(WORDS, 3)).capitalize(), description=' '.join(rng.sample(WORDS, 8)),
+                    price=rng.randint(10, 5000), size=rng.randint(10, 100), colour=rng.choice(COLOURS),
+                    quantity=1_000, category=category_list[i % categories], slug=f'{run}-{i}',
+                    primary_image=f'products/{run}-{i}-0.jpg' if per_product + (i < extra) else '')
+            for i in range(products)
+        ), batch_size)
+        product_rows = list(Product.objects.filter(slug__startswith=f'{run}-').order_by('pk').values_list('pk',
+                                                                                                        'price'))
+        product_ids = [pk for pk, price in product_rows]
+        log(f'Категорий {categories}, товаров {len(product_ids)}')
+
+        counts['images'] = bulk_insert(Gallery, (
+            Gallery(product_id=pk, photo=f'products/{run}-{i}-{j}.jpg')
+            for i, pk in enumerate(product_ids) for j in range(per_product + (i < extra))
+        ), batch_size)
+        log(f'Фото в галереях {counts["images"]}')
+
+        user_list = User.objects.bulk_create(
+            [User(username=f'{run}-{i}', password='!') for i in range(users)], batch_size=batch_size
+        )
+        user_ids = [user.pk for user in user_list]
+        counts['users'] = len(user_ids)
+
+        step = get_step(len(product_ids))
+        offsets = [rng.randrange(len(product_ids)) for user_id in user_ids]
+        counts['favourites'] = bulk_insert(FavouriteProducts, (
+            FavouriteProducts(user_id=user_ids[i % users],
+                              product_id=product_ids[(offsets[i % users] + i // users * step) % len(product_ids)])
+            for i in range(min(favourites, users * len(product_ids)))
+        ), batch_size)
+        log(f'Избранное {counts["favourites"]}')
+
+        counts['reviews'] = bulk_insert(Review, (
+            Review(author_id=rng.choice(user_ids), product_id=rng.choice(product_ids),
+                   text=' '.join(rng.sample(WORDS, 6)).capitalize())
+            for i in range(reviews)
+        ), batch_size)
+        recount_reviews(Product.objects.filter(slug__startswith=f'{run}-'))
+        log(f'Отзывы {counts["reviews"]}')
+
+        # Закрытые заказы по LINES_PER_ORDER разных товаров с ценами и итогами, как после оплаты
+        customers = Customer.objects.bulk_create(
+            [Customer(user_id=user_id, name=f'Покупатель {user_id}', email='') for user_id in user_ids],
+            batch_size=batch_size
+        )
+        baskets = []
+        for i in range(math.ceil(order_lines / LINES_PER_ORDER)):
+            start = rng.randrange(len(product_rows))
+            size = min(LINES_PER_ORDER, order_lines - i * LINES_PER_ORDER, len(product_rows))
+            baskets.append([(product_rows[(start + j) % len(product_rows)], rng.randint(1, 3)) for j in range(size)])
+        orders = []
+        for i, basket in enumerate(baskets):
+            orders.append(Order(customer=customers[i % users], is_completed=True,
+                                total_quantity=sum(quantity for row, quantity in basket),
+                                total_price=sum(to_money(row[1]) * quantity for row, quantity in basket)))
+        for start in range(0, len(orders), batch_size):
+            Order.objects.bulk_create(orders[start:start + batch_size])
+        counts['order_lines'] = bulk_insert(OrderProduct, (
+            OrderProduct(order=order, product_id=row[0], quantity=quantity, price=to_money(row[1]))
+            for order, basket in zip(orders, baskets) for row, quantity in basket
+        ), batch_size)
+        log(f'Заказы {len(orders)}, строки заказов {counts["order_lines"]}')
+
+        # bulk_create обходит сигналы: поиск, фильтры и кэши обновляются явно
+        rebuild_index()
+        rebuild_facets()
+    reset_product_ids()
+    bump_versions('catalogue', 'categories')
+    return counts
+
+
+def delete_in_chunks(queryset, chunk_size=DELETE_CHUNK):
+    # Сборщик Django держит удаляемые строки в памяти, поэтому удаление идёт пачками по первичному ключу
+    deleted = 0
+    while pks := list(queryset.order_by('pk').values_list('pk', flat=True)[:chunk_size]):
+        deleted += queryset.model.objects.filter(pk__in=pks).delete()[0]
+    return deleted
+
+
+def delete_dataset():
+    # Удаляются только строки записанных прогонов. Сигналы на каждую строку (индекс, фильтры, главное фото,
+    # кэш) приглушены: поиск и кэш каталога обновляются один раз в конце
+    deleted = 0
+    with transaction.atomic(), mute_signals():
+        for run in SyntheticRun.objects.all():
+            users = User.objects.filter(username__startswith=f'{run.name}-')
+            categories = Category.objects.filter(slug__startswith=f'{run.name}-')
+            deleted += delete_in_chunks(OrderProduct.objects.filter(order__customer__user__in=users))
+            deleted += delete_in_chunks(Order.objects.filter(customer__user__in=users))
+            deleted += delete_in_chunks(Product.objects.filter(category__in=categories))
+            deleted += delete_in_chunks(users)
+            deleted += categories.delete()[0]
+            run.delete()
+        rebuild_index()
+    reset_product_ids()
+    bump_versions('catalogue', 'categories')
+    return deleted
+
+
+def get_dataset_size():
+    return {
+        'categories': Category.objects.count(),
+        'products': Product.objects.count(),
+        'images': Gallery.objects.count(),
+        'users': User.objects.count(),
+        'favourites': FavouriteProducts.objects.count(),
+        'reviews': Review.objects.count(),
+        'order_lines': OrderProduct.objects.count(),
+    }
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[max(0, math.ceil(len(values) * share) - 1)]
+
+
+@contextmanager
+def benchmark_cache():
+    # Холодные замеры очищают кэш: это отдельный кэш того же типа, общий кэш воркеров и токены версий не трогаются.
+    # Сетевые кэши (memcached, redis) подменяются локальным, чтобы clear() не сбросил весь сервер
+    backend = settings.CACHES['default']['BACKEND']
+    with tempfile.TemporaryDirectory(prefix='store-bench-') as location:
+        if not backend.endswith('FileBasedCache'):
+            backend, location = 'django.core.cache.backends.locmem.LocMemCache', 'store-benchmarks'
+        with override_settings(CACHES={'default': {'BACKEND': backend, 'LOCATION': location}}):
+            cache.clear()
+            yield
+
+
+class ScenarioRunner:
+    # Запросы идут через тестовый клиент в настоящие представления от имени вошедшего покупателя:
+    # гостевой кэш страниц не подменяет собой работу представления
+    def __init__(self, seed=0):
+        self.rng = random.Random(seed)
+        self.categories = list(Category.objects.exclude(slug__isnull=True).values_list('slug', flat=True))
+        products = list(Product.objects.filter(quantity__gt=0).order_by('pk').values_list('pk', 'slug'))
+        self.products = self.rng.sample(products, min(len(products), 500))
+        self.user = User.objects.create_user(username=f'{PREFIX}-bench-{time.time_ns()}')
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def home(self):
+        return self.client.get(reverse('product_list'))
+
+    def category_sort(self):
+        return self.client.get(reverse('category', kwargs={'slug': self.rng.choice(self.categories)}),
+                               {'sort': self.rng.choice(sorted(SORT_FIELDS))})
+
+    def product_detail(self):
+        return self.client.get(reverse('product', kwargs={'slug': self.rng.choice(self.products)[1]}))
+
+    def cart_add(self):
+        return self.client.get(reverse('to_cart', kwargs={'product_id': self.rng.choice(self.products)[0],
+                                                          'action': 'add'}))
+
+    def checkout(self):
+        return self.client.get(reverse('checkout'))
+
+    def measure(self, name, repeat, warmup=3, cold=False):
+        request = getattr(self, name)
+        for i in range(warmup):
+            request()
+        timings, queries = [], []
+        for i in range(repeat):
+            if cold:
+                cache.clear()
+            with CaptureQueriesContext(connection) as ctx:
+                started = time.perf_counter()
+                response = request()
+                timings.append((time.perf_counter() - started) * 1000)
+            # Журнал запросов очищается следующим запросом, поэтому длина берётся сразу
+            queries.append(len(ctx.captured_queries))
+            if response.status_code >= 400:
+                raise RuntimeError(f'{name}: ответ {response.status_code}')
+        return {
+            'requests': repeat,
+            'p50_ms': round(statistics.median(timings), 3),
+            'p95_ms': round(percentile(timings, 0.95), 3),
+            'queries': statistics.median_low(queries),
+            'max_queries': max(queries),
+        }
+
+
+def run_scenarios(names=SCENARIOS, repeat=50, warmup=3, cold=False, seed=0):
+    # Корзина и склад меняются по ходу замера, поэтому всё откатывается.
+    # Тестовый клиент ходит на хост testserver, как в тестах
+    with transaction.atomic(), override_settings(ALLOWED_HOSTS=['testserver']), benchmark_cache():
+        runner = ScenarioRunner(seed)
+        results = {name: runner.measure(name, repeat, warmup, cold) for name in names}
+        transaction.set_rollback(True)
+    return {
+        'created_at': timezone.now().isoformat(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'dataset': get_dataset_size(),
+        'repeat': repeat,
+        'cold': cold,
+        'scenarios': results,
+    }
+
+
+def compare_results(baseline, results, threshold=0.2):
+    # Регрессия - рост задержки больше порога или любой лишний запрос к базе
+    rows = []
+    for name, current in results['scenarios'].items():
+        previous = baseline['scenarios'].get(name)
+        if previous is None:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'queries'):
+            old, new = previous[metric], current[metric]
+            change = (new - old) / old if old else 0.0
+            regression = new > old if metric == 'queries' else change > threshold
+            rows.append({'scenario': name, 'metric': metric, 'baseline': old, 'current': new,
+                         'change': round(change, 4), 'regression': regression})
+    return rows
@@ -0,0 +1,146 @@
+import atexit
+import threading
+import time
+from collections import Counter
+from functools import wraps
+from hashlib import md5
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+FRAGMENTS = ['categories', 'catalogue', 'product_card', 'page']
+# Счётчики копятся в памяти процесса и уходят в общий кэш раз в STATS_FLUSH_EVERY обращений.
+# Статистика приблизительная: в файловом кэше add/incr - это чтение и запись, одновременные сбросы
+# нескольких процессов могут потерять часть прибавок
+STATS_FLUSH_EVERY = 1000
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def get_timeout():
+    return getattr(settings, 'STORE_CACHE_TIMEOUT', 60 * 60)
+
+
+def version_key(scope):
+    return f'store:version:{scope}'
+
+
+def new_version():
+    # Время смены версии идёт в начале токена - по нему считается Last-Modified страниц
+    return f'{int(time.time())}-{uuid4().hex}'
+
+
+def version_time(version):
+    try:
+        return int(version.split('-', 1)[0])
+    except ValueError:
+        return 0
+
+
+def get_versions(*scopes):
+    # Версия - случайный токен: если ключ версии вытеснен, старые фрагменты просто перестают находиться
+    keys = [version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    missing = {key: new_version() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def bump_versions(*scopes):
+    cache.set_many({version_key(scope): new_version() for scope in scopes}, None)
+
+
+def record(name, hit):
+    if not getattr(settings, 'STORE_CACHE_STATS', True):
+        return
+    with _stats_lock:
+        _stats[f'store:stats:{name}:{"hits" if hit else "misses"}'] += 1
+        full = sum(_stats.values()) >= STATS_FLUSH_EVERY
+    if full:
+        flush_stats()
+
+
+def flush_stats():
+    # Не больше двух записей в кэш на счётчик за сброс, а не на каждое чтение фрагмента
+    with _stats_lock:
+        counts = dict(_stats)
+        _stats.clear()
+    for key, count in counts.items():
+        if not cache.add(key, count, None):
+            try:
+                cache.incr(key, count)
+            except ValueError:
+                cache.set(key, count, None)
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def get_stats():
+    flush_stats()
+    keys = [f'store:stats:{name}:{kind}' for name in FRAGMENTS for kind in ('hits', 'misses')]
+    values = cache.get_many(keys)
+    return {
+        name: {kind: values.get(f'store:stats:{name}:{kind}', 0) for kind in ('hits', 'misses')}
+        for name in FRAGMENTS
+    }
+
+
+atexit.register(flush_stats)
+
+
+def cached(name, scopes, build, *parts):
+    key = ':'.join(['store:fragment', name, *get_versions(*scopes), *map(str, parts)])
+    value = cache.get(key)
+    record(name, value is not None)
+    if value is None:
+        value = build()
+        cache.set(key, value, get_timeout())
+    return value
+
+
+def cache_anonymous_page(get_scopes, get_last_modified):
+    # Страницы каталога для гостей целиком берутся из кэша, повторный запрос с ETag получает 304
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+
+            query = md5(request.GET.urlencode().encode()).hexdigest()
+            versions = get_versions('categories', *get_scopes(**kwargs))
+            key = ':'.join(['store:page', request.path, *versions, query])
+            entry = cache.get(key)
+            record('page', entry is not None)
+            if entry is None:
+                response = view(request, *args, **kwargs)
+                if hasattr(response, 'render'):
+                    response.render()
+                if response.status_code != 200:
+                    return response
+                entry = {
+                    'content': response.content,
+                    'content_type': response['Content-Type'],
+                    'etag': f'"{md5(key.encode()).hexdigest()}"',
+                    # Переименование категории или новый отзыв не трогают updated_at товаров, но меняют версию
+                    'last_modified': max(int(get_last_modified(**kwargs).timestamp()), *map(version_time, versions))
+                }
+                cache.set(key, entry, getattr(settings, 'STORE_PAGE_CACHE_TIMEOUT', 10 * 60))
+
+            response = get_conditional_response(request, etag=entry['etag'], last_modified=entry['last_modified'])
+            if response is None:
+                response = HttpResponse(entry['content'], content_type=entry['content_type'])
+            response['ETag'] = entry['etag']
+            response['Last-Modified'] = http_date(entry['last_modified'])
+            return response
+        return wrapper
+    return decorator
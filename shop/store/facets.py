@@ -0,0 +1,119 @@
+from django.core.exceptions import BadRequest
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q
+
+from .models import CategoryFacet, Product
+
+PRICE_BUCKETS = [0, 50, 100, 200, 500, 1000]
+SIZE_STEP = 10
+
+
+def price_bucket(price):
+    return max(bucket for bucket in PRICE_BUCKETS if bucket <= max(price, 0))
+
+
+def size_bucket(size):
+    return size // SIZE_STEP * SIZE_STEP
+
+
+def price_label(bucket):
+    index = PRICE_BUCKETS.index(bucket)
+    if index + 1 < len(PRICE_BUCKETS):
+        return f'${bucket} - ${PRICE_BUCKETS[index + 1]}'
+    return f'от ${bucket}'
+
+
+def size_label(bucket):
+    return f'{bucket} - {bucket + SIZE_STEP - 1}'
+
+
+def get_facet_values(product):
+    # product - словарь или объект с полями category_id, colour, size, price
+    get = product.get if isinstance(product, dict) else lambda name: getattr(product, name)
+    return {
+        (get('category_id'), 'colour', get('colour')),
+        (get('category_id'), 'size', str(size_bucket(get('size')))),
+        (get('category_id'), 'price', str(price_bucket(get('price')))),
+    }
+
+
+def change_facets(values, delta):
+    for category_id, facet, value in values:
+        facets = CategoryFacet.objects.filter(category_id=category_id, facet=facet, value=value)
+        if facets.update(count=F('count') + delta) or delta < 0:
+            continue
+        try:
+            with transaction.atomic():
+                CategoryFacet.objects.create(category_id=category_id, facet=facet, value=value, count=delta)
+        except IntegrityError:
+            facets.update(count=F('count') + delta)
+
+
+def update_facets(old, new):
+    # Счётчики меняются только у тех значений, которые у товара изменились
+    old = get_facet_values(old) if old else set()
+    new = get_facet_values(new) if new else set()
+    change_facets(old - new, -1)
+    change_facets(new - old, 1)
+
+
+def rebuild_facets():
+    counts = {}
+    for product in Product.objects.values('category_id', 'colour', 'size', 'price').annotate(count=Count('pk')):
+        for key in get_facet_values(product):
+            counts[key] = counts.get(key, 0) + product['count']
+    with transaction.atomic():
+        CategoryFacet.objects.all().delete()
+        CategoryFacet.objects.bulk_create([
+            CategoryFacet(category_id=category_id, facet=facet, value=value, count=count)
+            for (category_id, facet, value), count in counts.items()
+        ])
+    return len(counts)
+
+
+def get_selected(params):
+    selected = {facet: params.getlist(facet) for facet, title in CategoryFacet.FACETS}
+    try:
+        for facet in ('size', 'price'):
+            selected[facet] = [int(value) for value in selected[facet]]
+    except ValueError:
+        raise BadRequest('Неверное значение фильтра')
+    if any(bucket not in PRICE_BUCKETS for bucket in selected['price']):
+        raise BadRequest('Неверное значение фильтра')
+    return selected
+
+
+def filter_products(queryset, selected):
+    if selected['colour']:
+        queryset = queryset.filter(colour__in=selected['colour'])
+    if selected['size']:
+        condition = Q()
+        for bucket in selected['size']:
+            condition |= Q(size__gte=bucket, size__lt=bucket + SIZE_STEP)
+        queryset = queryset.filter(condition)
+    if selected['price']:
+        condition = Q()
+        for bucket in selected['price']:
+            index = PRICE_BUCKETS.index(bucket)
+            bounds = Q(price__gte=bucket) if bucket else Q()
+            if index + 1 < len(PRICE_BUCKETS):
+                bounds &= Q(price__lt=PRICE_BUCKETS[index + 1])
+            condition |= bounds
+        queryset = queryset.filter(condition)
+    return queryset
+
+
+def get_facets(category, selected):
+    labels = {'size': size_label, 'price': price_label}
+    facets = {facet: {'name': facet, 'title': title, 'values': []} for facet, title in CategoryFacet.FACETS}
+    for item in category.facets.filter(count__gt=0):
+        value = int(item.value) if item.facet in labels else item.value
+        facets[item.facet]['values'].append({
+            'value': value,
+            'label': labels[item.facet](value) if item.facet in labels else value,
+            'count': item.count,
+            'checked': value in selected[item.facet]
+        })
+    for facet in facets.values():
+        facet['values'].sort(key=lambda item: item['value'])
+    return [facet for facet in facets.values() if facet['values']]
@@ -0,0 +1,186 @@
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+
+from .models import FavouriteProducts, Product
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+_buffer = None
+_buffer_lock = threading.Lock()
+_worker_lock = None
+
+
+def write_favourites(changes):
+    # changes: {user_id: {product_id: True/False}} - вставка и удаление пачкой, по запросу на каждое
+    added = [(user_id, product_id) for user_id, products in changes.items()
+             for product_id, state in products.items() if state]
+    removed = {}
+    for user_id, products in changes.items():
+        product_ids = [product_id for product_id, state in products.items() if not state]
+        if product_ids:
+            removed[user_id] = product_ids
+
+    with transaction.atomic():
+        if removed:
+            condition = Q()
+            for user_id, product_ids in removed.items():
+                condition |= Q(user_id=user_id, product_id__in=product_ids)
+            FavouriteProducts.objects.filter(condition).delete()
+        if added:
+            # Товар мог быть удалён, пока изменение ждало в буфере
+            existing = set(Product.objects.filter(pk__in={pk for user_id, pk in added}).values_list('pk', flat=True))
+            FavouriteProducts.objects.bulk_create(
+                [FavouriteProducts(user_id=user_id, product_id=pk) for user_id, pk in added if pk in existing],
+                ignore_conflicts=True
+            )
+    return len(added) + sum(len(product_ids) for product_ids in removed.values())
+
+
+class FavouritesBuffer:
+    # Клики копятся в памяти процесса: серия нажатий на одно сердечко превращается в одну запись,
+    # а запись идёт пачкой по размеру буфера или по таймеру
+    def __init__(self, batch_size=500, interval=2.0):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.pending = {}
+        self.flushing = {}
+        self.size = 0
+        self.timer = None
+
+    def get_state(self, user_id, product_id):
+        with self.lock:
+            for changes in (self.pending, self.flushing):
+                if product_id in changes.get(user_id, {}):
+                    return changes[user_id][product_id]
+        return None
+
+    def set(self, user_id, product_id, state):
+        with self.lock:
+            products = self.pending.setdefault(user_id, {})
+            if product_id not in products:
+                self.size += 1
+            products[product_id] = state
+            full = self.size >= self.batch_size
+            if not full and self.timer is None:
+                self.timer = threading.Timer(self.interval, self.flush_in_background)
+                self.timer.daemon = True
+                self.timer.start()
+        if full:
+            self.flush()
+        return state
+
+    def apply(self, user_id, product_ids):
+        # Ещё не записанные изменения пользователя поверх прочитанного из базы
+        with self.lock:
+            for changes in (self.flushing, self.pending):
+                for product_id, state in changes.get(user_id, {}).items():
+                    if state:
+                        product_ids.add(product_id)
+                    else:
+                        product_ids.discard(product_id)
+        return product_ids
+
+    def flush(self):
+        # Пока пачка пишется, она остаётся видна чтению через flushing
+        with self.flush_lock:
+            with self.lock:
+                if self.timer is not None:
+                    self.timer.cancel()
+                    self.timer = None
+                self.flushing, self.pending, self.size = self.pending, {}, 0
+            try:
+                return write_favourites(self.flushing) if self.flushing else 0
+            finally:
+                with self.lock:
+                    self.flushing = {}
+
+    def flush_in_background(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Не удалось записать избранное из буфера')
+        finally:
+            close_old_connections()
+
+
+def lock_worker(path):
+    # Буфер живёт в памяти процесса: другой воркер не видит его кликов и читает устаревшую базу.
+    # Поэтому буфер держит блокировку файла, и второй процесс с включённым буфером получает ошибку
+    if fcntl is None:
+        return None
+    lock = open(path, 'a')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        raise ImproperlyConfigured('STORE_FAVOURITES_WRITE_BEHIND работает только с одним процессом-воркером: '
+                                   f'буфер избранного уже открыт другим процессом ({path})')
+    return lock
+
+
+def get_buffer():
+    # Буфер включается настройкой STORE_FAVOURITES_WRITE_BEHIND, иначе запись сразу в базу
+    global _buffer, _worker_lock
+    if not getattr(settings, 'STORE_FAVOURITES_WRITE_BEHIND', False):
+        return None
+    with _buffer_lock:
+        if _buffer is None:
+            _worker_lock = lock_worker(getattr(settings, 'STORE_FAVOURITES_LOCK_PATH',
+                                               settings.BASE_DIR / 'favourites.lock'))
+            _buffer = FavouritesBuffer(getattr(settings, 'STORE_FAVOURITES_BATCH_SIZE', 500),
+                                       getattr(settings, 'STORE_FAVOURITES_FLUSH_INTERVAL', 2.0))
+            atexit.register(_buffer.flush)
+    return _buffer
+
+
+def reset_buffer():
+    global _buffer, _worker_lock
+    if _buffer is not None:
+        _buffer.flush()
+        atexit.unregister(_buffer.flush)
+    if _worker_lock is not None:
+        _worker_lock.close()
+    _buffer = _worker_lock = None
+
+
+def set_favourite(user_id, product_id, state):
+    # Известное конечное состояние - ровно один запрос: INSERT ... ON CONFLICT DO NOTHING или DELETE
+    buffer = get_buffer()
+    if buffer is not None:
+        return buffer.set(user_id, product_id, state)
+    if state:
+        FavouriteProducts.objects.bulk_create([FavouriteProducts(user_id=user_id, product_id=product_id)],
+                                              ignore_conflicts=True)
+    else:
+        FavouriteProducts.objects.filter(user_id=user_id, product_id=product_id).delete()
+    return state
+
+
+def toggle_favourite(user_id, product_id):
+    buffer = get_buffer()
+    if buffer is not None:
+        state = buffer.get_state(user_id, product_id)
+        if state is None:
+            state = FavouriteProducts.objects.filter(user_id=user_id, product_id=product_id).exists()
+        return buffer.set(user_id, product_id, not state)
+    # Без чтения: удаление, а если удалять нечего - вставка; уникальный индекс не даст дубля
+    if FavouriteProducts.objects.filter(user_id=user_id, product_id=product_id).delete()[0]:
+        return False
+    return set_favourite(user_id, product_id, True)
+
+
+def apply_pending(user_id, product_ids):
+    buffer = get_buffer()
+    return product_ids if buffer is None else buffer.apply(user_id, product_ids)
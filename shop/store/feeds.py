@@ -0,0 +1,269 @@
+import csv
+import json
+import logging
+import math
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils.text import slugify
+
+from .cache import bump_versions
+from .facets import rebuild_facets
+from .images import mark_renditions_ready, render_photo
+from .models import Category, Gallery, Product
+from .recommendations import reset_product_ids
+from .search import index_products
+from .utils import refresh_primary_images
+
+FIELDS = ['slug', 'title', 'description', 'price', 'size', 'colour', 'quantity', 'category', 'category_slug',
+          'images']
+PRODUCT_UPDATE_FIELDS = ['title', 'description', 'price', 'size', 'colour', 'quantity', 'category', 'updated_at']
+IMAGE_SEPARATOR = '|'
+# Транслитерация как у prepopulated_fields в админке: слаги остаются латиницей
+TRANSLIT = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'yo', 'ж': 'zh', 'з': 'z', 'и': 'i',
+    'й': 'j', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't',
+    'у': 'u', 'ф': 'f', 'х': 'h', 'ц': 'c', 'ч': 'ch', 'ш': 'sh', 'щ': 'sh', 'ъ': '', 'ы': 'y', 'ь': '',
+    'э': 'e', 'ю': 'yu', 'я': 'ya',
+})
+
+logger = logging.getLogger(__name__)
+
+
+def make_slug(text):
+    max_length = Product._meta.get_field('slug').max_length
+    return slugify(text.lower().translate(TRANSLIT))[:max_length].strip('-')
+
+
+def get_format(path, fmt=None):
+    return fmt or ('jsonl' if str(path).endswith(('.jsonl', '.ndjson')) else 'csv')
+
+
+def read_rows(file, fmt):
+    # Файл читается построчно: память не зависит от размера фида
+    if fmt == 'csv':
+        yield from csv.DictReader(file)
+        return
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+def parse_row(row):
+    title = (row.get('title') or '').strip()
+    category = (row.get('category') or '').strip()
+    if not title or not category:
+        raise ValueError('нет названия или категории')
+    images = row.get('images') or []
+    if isinstance(images, str):
+        images = [name.strip() for name in images.split(IMAGE_SEPARATOR) if name.strip()]
+    defaults = {field: Product._meta.get_field(field).default for field in ('description', 'size', 'colour')}
+    slug = (row.get('slug') or '').strip() or make_slug(title)
+    category_slug = (row.get('category_slug') or '').strip() or make_slug(category)
+    if not slug or not category_slug:
+        raise ValueError('не удалось составить слаг')
+    price = float(row['price'])
+    if not math.isfinite(price):
+        raise ValueError(f'неверная цена {row["price"]}')
+    return {
+        'slug': slug,
+        'title': title,
+        'description': row.get('description') or defaults['description'],
+        'price': price,
+        'size': int(row.get('size') or defaults['size']),
+        'colour': row.get('colour') or defaults['colour'],
+        'quantity': int(row.get('quantity') or 0),
+        'category': category,
+        'category_slug': category_slug,
+        'images': images,
+    }
+
+
+def store_image(name, images_dir):
+    # Без каталога поставщика в фиде уже имена файлов в хранилище
+    if images_dir is None:
+        return name
+    # Абсолютный путь или ../ в фиде не должны вынести в публичный MEDIA файлы вне каталога поставщика
+    root = os.path.realpath(images_dir)
+    path = os.path.realpath(os.path.join(root, name))
+    if os.path.commonpath([root, path]) != root:
+        raise PermissionError(f'путь вне каталога фото: {name}')
+    target = f'products/{os.path.basename(path)}'
+    if default_storage.exists(target):
+        return target
+    with open(path, 'rb') as file:
+        return default_storage.save(target, File(file))
+
+
+class RenditionPool:
+    # Размеры фото считаются в процессах параллельно с импортом следующих пачек
+    def __init__(self, workers):
+        self.workers = workers
+        self.executor = None
+        self.futures = {}
+
+    def submit(self, names):
+        # workers=0 - размеры считаются прямо в процессе импорта
+        if self.workers == 0:
+            return sum(self.render(name) for name in names)
+        if self.executor is None:
+            # Процессы запускаются форком при первой задаче и не должны унаследовать соединение с БД
+            if not connection.in_atomic_block:
+                connection.close()
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        for name in names:
+            self.futures[self.executor.submit(render_photo, name)] = name
+        return 0
+
+    def render(self, name):
+        try:
+            render_photo(name)
+        except Exception:
+            logger.exception('Не удалось создать размеры для %s', name)
+            return False
+        mark_renditions_ready([name])
+        return True
+
+    def collect(self, wait=False):
+        ready = []
+        for future in [future for future in self.futures if wait or future.done()]:
+            name = self.futures.pop(future)
+            try:
+                future.result()
+                ready.append(name)
+            except Exception:
+                logger.exception('Не удалось создать размеры для %s', name)
+        if ready:
+            mark_renditions_ready(ready)
+        return len(ready)
+
+    def close(self):
+        ready = self.collect(wait=True)
+        if self.executor is not None:
+            self.executor.shutdown()
+        return ready
+
+
+def import_batch(items, categories, images_dir, stats):
+    # Категории из этого импорта уже известны, в базу идут только новые.
+    # Названия существующих категорий фид не меняет: их правят в админке
+    new = {item['category_slug']: item['category'] for item in items if item['category_slug'] not in categories}
+    if new:
+        categories.update(Category.objects.filter(slug__in=new).values_list('slug', 'pk'))
+        missing = {slug: title for slug, title in new.items() if slug not in categories}
+        if missing:
+            Category.objects.bulk_create([Category(title=title, slug=slug) for slug, title in missing.items()],
+                                         ignore_conflicts=True)
+            created = dict(Category.objects.filter(slug__in=missing).values_list('slug', 'pk'))
+            categories.update(created)
+            stats['categories'] += len(created)
+
+    Product.objects.bulk_create(
+        [Product(category_id=categories[item['category_slug']],
+                 **{field: item[field] for field in FIELDS if field not in ('category', 'category_slug', 'images')})
+         for item in items],
+        update_conflicts=True, unique_fields=['slug'], update_fields=PRODUCT_UPDATE_FIELDS
+    )
+    stats['products'] += len(items)
+    # При upsert bulk_create не возвращает id, поэтому они дочитываются одним запросом
+    product_ids = dict(Product.objects.filter(slug__in=[item['slug'] for item in items]).values_list('slug', 'pk'))
+
+    # Фото из фида добавляются к галерее, уже загруженные не дублируются
+    wanted = set()
+    for item in items:
+        for name in item['images']:
+            try:
+                wanted.add((product_ids[item['slug']], store_image(name, images_dir)))
+            except OSError as error:
+                stats['missing_images'] += 1
+                logger.warning('Фото %s товара %s не загружено: %s', name, item['slug'], error)
+    existing = set(Gallery.objects.filter(product_id__in=product_ids.values()).values_list('product_id', 'photo'))
+    photos = sorted(wanted - existing)
+    Gallery.objects.bulk_create([Gallery(product_id=pk, photo=name) for pk, name in photos])
+    stats['images'] += len(photos)
+
+    products = Product.objects.filter(pk__in=product_ids.values())
+    refresh_primary_images(products)
+    index_products(products)
+    return [name for pk, name in photos]
+
+
+def import_feed(rows, batch_size=1000, images_dir=None, workers=None, log=None):
+    # Пачка - одна транзакция: upsert категорий, товаров и галерей, ошибка не откатывает прошлые пачки
+    log = log or (lambda message: None)
+    stats = Counter()
+    categories = {}
+    pool = RenditionPool(workers)
+    numbered = enumerate(rows, start=1)
+    try:
+        while batch := list(islice(numbered, batch_size)):
+            items = {}
+            for number, row in batch:
+                try:
+                    item = parse_row(row)
+                except (KeyError, TypeError, ValueError) as error:
+                    stats['skipped'] += 1
+                    log(f'Строка {number} пропущена: {error}')
+                    continue
+                # Повтор слага внутри пачки: побеждает последняя строка, как и между пачками
+                items[item['slug']] = item
+            stats['rows'] += len(batch)
+            if items:
+                with transaction.atomic():
+                    names = import_batch(list(items.values()), categories, images_dir, stats)
+                stats['renditions'] += pool.submit(names) + pool.collect()
+    finally:
+        stats['renditions'] += pool.close()
+        # bulk_create обходит сигналы: фильтры, похожие товары и кэш каталога обновляются один раз в конце
+        rebuild_facets()
+        reset_product_ids()
+        bump_versions('catalogue', 'categories')
+    return stats
+
+
+def export_rows(products=None, chunk_size=2000):
+    # Пачки по ключу без моделей: на пачку один запрос товаров и один запрос фото
+    products = (Product.objects.all() if products is None else products).order_by('pk')
+    last = 0
+    while chunk := list(products.filter(pk__gt=last).values(
+            'pk', 'slug', 'title', 'description', 'price', 'size', 'colour', 'quantity', 'category__title',
+            'category__slug')[:chunk_size]):
+        last = chunk[-1]['pk']
+        images = {}
+        photos = Gallery.objects.filter(product_id__in=[row['pk'] for row in chunk]).exclude(photo='').exclude(
+            photo__isnull=True).order_by('pk').values_list('product_id', 'photo')
+        for product_id, photo in photos:
+            images.setdefault(product_id, []).append(photo)
+        for row in chunk:
+            yield {
+                'slug': row['slug'],
+                'title': row['title'],
+                'description': row['description'],
+                'price': row['price'],
+                'size': row['size'],
+                'colour': row['colour'],
+                'quantity': row['quantity'],
+                'category': row['category__title'],
+                'category_slug': row['category__slug'],
+                'images': images.get(row['pk'], []),
+            }
+
+
+def write_rows(rows, file, fmt):
+    count = 0
+    if fmt == 'csv':
+        writer = csv.DictWriter(file, FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(dict(row, images=IMAGE_SEPARATOR.join(row['images'])))
+            count += 1
+        return count
+    for row in rows:
+        file.write(json.dumps(row, ensure_ascii=False) + '\n')
+        count += 1
+    return count
@@ -40,12 +40,15 @@ class RegistrationForm(UserCreationForm):
 class ReviewForm(forms.ModelForm):
     class Meta:
         model = Review
-        fields = ('text',)
+        fields = ('text', 'rating')
 
         widgets = {
             'text': forms.Textarea(attrs={
                 'class': 'form-control',
                 'placeholder': 'Ваш отзыв...'
+            }),
+            'rating': forms.Select(attrs={
+                'class': 'form-select'
             })
         }
 
@@ -0,0 +1,101 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from PIL import Image, ImageOps
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from django.db.models import Q
+
+from .cache import bump_versions
+from .models import Product, Gallery
+
+# Ширина каждого размера в пикселях
+RENDITIONS = {
+    'thumb': 150,
+    'card': 400,
+    'detail': 630,
+}
+RENDITIONS_DIR = 'renditions'
+QUALITY = 75
+# Форматы размеров по предпочтению; превью в админке - в формате, который понимают все браузеры
+FORMATS = ('AVIF', 'WEBP')
+PREVIEW_FORMAT = 'WEBP'
+
+logger = logging.getLogger(__name__)
+_executor = None
+
+
+def get_formats():
+    # AVIF доступен только в свежих сборках Pillow
+    Image.init()
+    return [fmt for fmt in FORMATS if fmt in Image.SAVE]
+
+
+def rendition_path(name, width, fmt):
+    stem, ext = os.path.splitext(name)
+    return f'{RENDITIONS_DIR}/{stem}_{width}w.{fmt.lower()}'
+
+
+def rendition_url(name, width, fmt):
+    return default_storage.url(rendition_path(name, width, fmt))
+
+
+def render_photo(name, force=False):
+    paths = [(width, fmt, rendition_path(name, width, fmt))
+             for width in sorted(set(RENDITIONS.values())) for fmt in get_formats()]
+    if not force:
+        paths = [item for item in paths if not default_storage.exists(item[2])]
+    if not paths:
+        return 0
+
+    with default_storage.open(name) as file:
+        image = ImageOps.exif_transpose(Image.open(file))
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if image.mode in ('LA', 'P') else 'RGB')
+
+    resized = {}
+    for width, fmt, path in paths:
+        if width not in resized:
+            resized[width] = image.copy()
+            resized[width].thumbnail((width, width))
+        buffer = BytesIO()
+        resized[width].save(buffer, fmt, quality=QUALITY)
+        if default_storage.exists(path):
+            default_storage.delete(path)
+        default_storage.save(path, ContentFile(buffer.getvalue()))
+    return len(paths)
+
+
+def mark_renditions_ready(names):
+    Gallery.objects.filter(photo__in=names).update(has_renditions=True)
+    products = Product.objects.filter(primary_image__in=names)
+    # Сбрасываем кэш страниц товаров, у которых обновились фото, и их категорий
+    scopes = {'catalogue'}
+    pages = Product.objects.filter(Q(primary_image__in=names) | Q(images__photo__in=names)).distinct()
+    for slug, category_slug in pages.values_list('slug', 'category__slug'):
+        scopes.update([f'category-page:{category_slug}', f'product-page:{slug}'])
+    updated = products.update(has_renditions=True)
+    bump_versions(*scopes)
+    return updated
+
+
+def generate_renditions(name, force=False):
+    try:
+        render_photo(name, force=force)
+        mark_renditions_ready([name])
+    except Exception:
+        logger.exception('Не удалось создать размеры для %s', name)
+    finally:
+        close_old_connections()
+
+
+def schedule_renditions(name):
+    # Размеры генерируются в фоне, запрос на загрузку фото их не ждёт
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='renditions')
+    return _executor.submit(generate_renditions, name)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from store.utils import refresh_primary_images
+
+
+class Command(BaseCommand):
+    help = 'Заполняет Product.primary_image первым фото из галереи товара'
+
+    def handle(self, *args, **options):
+        updated = refresh_primary_images()
+        self.stdout.write(self.style.SUCCESS(f'Обновлено товаров: {updated}'))
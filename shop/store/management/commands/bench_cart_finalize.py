@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from store.models import Category, Customer, Order, OrderProduct, Product
+from store.utils import complete_orders, empty_order
+
+
+def clear_in_loop(order):
+    # Прежняя реализация CartForAuthenticatedUser.clear: удаление по одной строке
+    for line in order.orderproduct_set.all():
+        line.delete()
+    order.save()
+
+
+class Command(BaseCommand):
+    help = 'Замеряет очистку корзины и закрытие заказа на корзинах разного размера (данные откатываются)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('sizes', nargs='*', type=int, default=[1, 50, 500])
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            category = Category.objects.create(title='Bench', slug='bench-cart-finalize')
+            products = Product.objects.bulk_create(
+                [Product(title=f'Товар {i}', slug=f'bench-cart-finalize-{i}', price=10 + i, quantity=1000,
+                         category=category) for i in range(max(options['sizes']))]
+            )
+            customer = Customer.objects.create(name='bench', email='')
+            for size in options['sizes']:
+                for name, action in (('цикл', clear_in_loop), ('очистка', empty_order),
+                                     ('закрытие', lambda order: complete_orders([order.pk]))):
+                    timings, queries = [], 0
+                    for i in range(options['repeat']):
+                        order = Order.objects.create(customer=customer)
+                        OrderProduct.objects.bulk_create(
+                            [OrderProduct(order=order, product=product, quantity=2) for product in products[:size]]
+                        )
+                        with CaptureQueriesContext(connection) as ctx:
+                            started = time.perf_counter()
+                            action(order)
+                            timings.append((time.perf_counter() - started) * 1000)
+                        queries = len([q for q in ctx.captured_queries if 'SAVEPOINT' not in q['sql']])
+                    self.stdout.write(f'{size:>5} строк  {name:<9} {min(timings):8.2f} ms  запросов {queries}')
+            transaction.set_rollback(True)
@@ -0,0 +1,107 @@
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+
+from store.benchmarks import benchmark_cache
+from store.models import Customer, Order, OrderProduct, Product
+from store.payments import reset_gateway
+from store.stripe_stub import StripeStub
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный тест оплаты: WSGI с пулом потоков против ASGI на локальной заглушке Stripe'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--workers', type=int, default=4, help='Потоков WSGI-воркера')
+        parser.add_argument('--concurrency', type=int, default=50, help='Одновременных запросов к ASGI')
+        parser.add_argument('--latency', type=float, default=0.1, help='Задержка ответа Stripe, с')
+
+    def handle(self, *args, **options):
+        prefix = f'bench-{uuid4().hex[:8]}'
+        products = list(Product.objects.all()[:3])
+        users = User.objects.bulk_create([User(username=f'{prefix}-{i}') for i in range(options['requests'])])
+        customers = Customer.objects.bulk_create([Customer(user=user, name=user.username, email='') for user in users])
+        orders = Order.objects.bulk_create([Order(customer=customer) for customer in customers])
+        OrderProduct.objects.bulk_create(
+            [OrderProduct(order=order, product=product, quantity=1) for order in orders for product in products]
+        )
+        sessions = []
+        for user in users:
+            client = Client()
+            client.force_login(user)
+            sessions.append(client.cookies[settings.SESSION_COOKIE_NAME].value)
+
+        try:
+            # Тестовые клиенты ходят на хост testserver, как в тестах
+            with StripeStub(latency=options['latency']) as stub, benchmark_cache(), \
+                    override_settings(STRIPE_API_BASE=stub.url, ALLOWED_HOSTS=['testserver']):
+                reset_gateway()
+                for name, run in (('WSGI', self.run_wsgi), ('ASGI', self.run_asgi)):
+                    # Разные корзины - каждый запрос идёт в Stripe, повторные клики - сессия из кэша
+                    for scenario, keys in (('разные корзины', sessions),
+                                           ('повторные клики', sessions[:1] * len(sessions))):
+                        cache.clear()
+                        stub.sessions.clear()
+                        elapsed, timings = run(keys, options)
+                        self.report(f'{name}  {scenario:<16}', elapsed, timings, len(stub.sessions))
+        finally:
+            reset_gateway()
+            OrderProduct.objects.filter(order__in=orders).delete()
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+            Session.objects.filter(session_key__in=sessions).delete()
+
+    def report(self, name, elapsed, timings, created):
+        timings.sort()
+        p95 = timings[int(len(timings) * 0.95) - 1]
+        self.stdout.write(f'{name} {len(timings) / elapsed:8.1f} запросов/с  p50 {statistics.median(timings):7.1f} ms'
+                          f'  p95 {p95:7.1f} ms  сессий в Stripe {created}')
+
+    def run_wsgi(self, keys, options):
+        def worker(keys):
+            client = Client()
+            timings = []
+            for key in keys:
+                client.cookies[settings.SESSION_COOKIE_NAME] = key
+                started = time.perf_counter()
+                response = client.post(reverse('payment'))
+                assert response.status_code == 303, response.status_code
+                timings.append((time.perf_counter() - started) * 1000)
+            connection.close()
+            return timings
+
+        workers = options['workers']
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            timings = [timing for result in executor.map(worker, [keys[i::workers] for i in range(workers)])
+                       for timing in result]
+        return time.perf_counter() - started, timings
+
+    def run_asgi(self, keys, options):
+        async def request(semaphore, key):
+            async with semaphore:
+                client = AsyncClient()
+                client.cookies[settings.SESSION_COOKIE_NAME] = key
+                started = time.perf_counter()
+                response = await client.post(reverse('payment'))
+                assert response.status_code == 303, response.status_code
+                return (time.perf_counter() - started) * 1000
+
+        async def run():
+            semaphore = asyncio.Semaphore(options['concurrency'])
+            return await asyncio.gather(*[request(semaphore, key) for key in keys])
+
+        started = time.perf_counter()
+        timings = list(asyncio.run(run()))
+        return time.perf_counter() - started, timings
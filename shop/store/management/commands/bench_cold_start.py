@@ -0,0 +1,57 @@
+import os
+import statistics
+import tempfile
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from store.benchmarks import benchmark_cache
+from store.models import Category
+from store.snapshot import build_snapshot, load_snapshot, unload_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Замеряет первый запрос холодного воркера без снимка каталога и со снимком'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        category = Category.objects.order_by('pk').first()
+        urls = [reverse('product_list')] + ([category.get_absolute_url()] if category else [])
+        client = Client(HTTP_HOST='localhost')
+
+        with tempfile.TemporaryDirectory() as directory, benchmark_cache():
+            path = os.path.join(directory, 'catalogue.snapshot')
+            build_snapshot(path)
+            # Прогрев импорта шаблонов, чтобы замерять только обращения к каталогу
+            for url in urls:
+                client.get(url)
+
+            for url in urls:
+                for mode in ('без снимка', 'со снимком'):
+                    timings, queries = [], 0
+                    for i in range(options['repeat']):
+                        # Холодный воркер: пустой кэш и новое соединение с базой
+                        cache.clear()
+                        unload_snapshot()
+                        connection.close()
+                        started = time.perf_counter()
+                        if mode == 'со снимком':
+                            load_snapshot(path)
+                        startup = time.perf_counter()
+                        with CaptureQueriesContext(connection) as ctx:
+                            client.get(url)
+                        finished = time.perf_counter()
+                        timings.append(((finished - startup) * 1000, (startup - started) * 1000))
+                        queries = len(ctx.captured_queries)
+                    unload_snapshot()
+                    self.stdout.write(
+                        f'{url:<30} {mode:<12} первый запрос {statistics.median(t[0] for t in timings):7.2f} ms'
+                        f'  старт {statistics.median(t[1] for t in timings):6.2f} ms  запросов к БД {queries}'
+                    )
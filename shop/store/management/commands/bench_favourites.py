@@ -0,0 +1,53 @@
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from store.favourites import FavouritesBuffer, set_favourite, toggle_favourite
+from store.models import FavouriteProducts, Product
+
+
+def toggle_in_loop(user_id, product_id):
+    # Прежний save_or_delete_fav: товар, всё избранное пользователя, ещё раз товар, затем запись
+    product = Product.objects.get(pk=product_id)
+    favourites = [favourite.product for favourite in FavouriteProducts.objects.filter(user_id=user_id)]
+    if product in favourites:
+        FavouriteProducts.objects.get(user_id=user_id, product=Product.objects.get(pk=product_id)).delete()
+    else:
+        FavouriteProducts.objects.create(user_id=user_id, product=product)
+
+
+class Command(BaseCommand):
+    help = 'Замеряет клики по сердечку: прежний цикл, один запрос на клик и буфер с пачечной записью (откат)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clicks', type=int, default=2000)
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        product_ids = list(Product.objects.values_list('pk', flat=True)[:200])
+        with transaction.atomic():
+            users = User.objects.bulk_create([User(username=f'bench-favourites-{i}') for i in range(options['users'])])
+            # Серии кликов: один пользователь несколько раз подряд жмёт на одни и те же товары
+            rng = random.Random(0)
+            clicks = [(rng.choice(users).pk, rng.choice(product_ids[:20])) for i in range(options['clicks'])]
+            buffer = FavouritesBuffer(batch_size=options['batch_size'], interval=3600)
+            for name, action in (('цикл', toggle_in_loop), ('toggle', toggle_favourite),
+                                 ('состояние', lambda user_id, product_id: set_favourite(user_id, product_id, True)),
+                                 ('буфер', lambda user_id, product_id: buffer.set(user_id, product_id, True))):
+                FavouriteProducts.objects.filter(user__in=users).delete()
+                queries = []
+                # Счётчик вместо журнала запросов: журнал хранит только последние 9000
+                with connection.execute_wrapper(lambda execute, sql, *args: queries.append(sql) or execute(sql, *args)):
+                    started = time.perf_counter()
+                    for user_id, product_id in clicks:
+                        action(user_id, product_id)
+                    buffer.flush()
+                    elapsed = time.perf_counter() - started
+                queries = len([sql for sql in queries if 'SAVEPOINT' not in sql])
+                self.stdout.write(f'{name:<10} {len(clicks) / elapsed:9.0f} кликов/с  запросов {queries:>6}'
+                                  f'  ({queries / len(clicks):.2f} на клик)')
+            transaction.set_rollback(True)
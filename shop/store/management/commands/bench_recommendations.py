@@ -0,0 +1,55 @@
+import time
+from random import randint
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from store.models import Category, Product
+from store.recommendations import get_random_products, reset_product_ids
+
+
+def legacy_random_products(product, count=4):
+    # Прежний вариант из ProductDetail - для сравнения
+    products = Product.objects.all()
+    data = []
+    for i in range(count):
+        random_index = randint(0, len(products) - 1)
+        product = products[random_index]
+        if product not in data:
+            data.append(product)
+    return data
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает выбор "You may also like" на синтетическом каталоге (данные откатываются)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('sizes', nargs='*', type=int, default=[10000, 100000])
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        for size in options['sizes']:
+            with transaction.atomic():
+                self.run(size, options['repeat'])
+                transaction.set_rollback(True)
+        reset_product_ids()
+
+    def run(self, size, repeat):
+        categories = Category.objects.bulk_create(
+            [Category(title=f'Bench {i}', slug=f'bench-{size}-{i}') for i in range(10)]
+        )
+        Product.objects.bulk_create(
+            [Product(title=f'Bench {i}', slug=f'bench-{size}-{i}', price=i, quantity=1,
+                     category=categories[i % len(categories)]) for i in range(size)],
+            batch_size=5000
+        )
+        product = Product.objects.filter(category=categories[0]).first()
+        reset_product_ids()
+        get_random_products(product)
+
+        for name, sampler in (('legacy', legacy_random_products), ('sampler', get_random_products)):
+            started = time.perf_counter()
+            for i in range(repeat):
+                sampler(product)
+            elapsed = (time.perf_counter() - started) / repeat * 1000
+            self.stdout.write(f'{size:>8} products  {name:<8} {elapsed:10.2f} ms')
@@ -0,0 +1,52 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from store.models import Category, Product
+from store.search import rebuild_index, search_products
+
+WORDS = ['золото', 'серебро', 'кольцо', 'цепочка', 'браслет', 'часы', 'серьги', 'кулон', 'платина', 'жемчуг',
+         'классический', 'тонкий', 'массивный', 'женский', 'мужской', 'подарочный']
+QUERIES = ['кольца', 'золотой браслет', 'серебряная цепочка', 'часы мужские', 'жемчужные серьги', 'платиновое']
+
+
+class Command(BaseCommand):
+    help = 'Замеряет время поиска на синтетическом каталоге (данные откатываются)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('sizes', nargs='*', type=int, default=[10000, 100000])
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def handle(self, *args, **options):
+        for size in options['sizes']:
+            with transaction.atomic():
+                self.run(size, options['repeat'])
+                transaction.set_rollback(True)
+
+    def run(self, size, repeat):
+        categories = Category.objects.bulk_create(
+            [Category(title=word.capitalize(), slug=f'bench-{size}-{i}') for i, word in enumerate(WORDS[:8])]
+        )
+        Product.objects.bulk_create(
+            [Product(title=' '.join(random.sample(WORDS, 3)), description=' '.join(random.sample(WORDS, 8)),
+                     slug=f'bench-{size}-{i}', price=i, quantity=1, colour=random.choice(WORDS[:3]),
+                     category=categories[i % len(categories)]) for i in range(size)],
+            batch_size=5000
+        )
+        started = time.perf_counter()
+        rebuild_index()
+        self.stdout.write(f'{size:>8} products  index built in {time.perf_counter() - started:.2f} s')
+
+        for query in QUERIES:
+            timings = []
+            for i in range(repeat):
+                started = time.perf_counter()
+                search_products(query)
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            p95 = timings[int(len(timings) * 0.95) - 1]
+            self.stdout.write(f'{size:>8} products  {query:<20} p50 {statistics.median(timings):7.2f} ms'
+                              f'  p95 {p95:7.2f} ms')
@@ -0,0 +1,50 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.benchmarks import SCENARIOS, compare_results, run_scenarios
+
+
+class Command(BaseCommand):
+    help = ('Замеряет p50/p95 и число запросов на главной, категории с сортировкой, карточке товара, '
+            'добавлении в корзину и оформлении заказа; сохраняет и сравнивает JSON-базу (данные откатываются)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*', help=f'Сценарии: {", ".join(SCENARIOS)}')
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--cold', action='store_true', help='Очищать кэш перед каждым запросом')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Сохранить результаты в JSON')
+        parser.add_argument('--baseline', help='JSON прошлого запуска для сравнения')
+        parser.add_argument('--threshold', type=float, default=0.2, help='Допустимый рост задержки, доля')
+
+    def handle(self, *args, **options):
+        unknown = set(options['scenarios']) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f'Неизвестные сценарии: {", ".join(sorted(unknown))}')
+        results = run_scenarios(options['scenarios'] or SCENARIOS, repeat=options['repeat'],
+                                warmup=options['warmup'], cold=options['cold'], seed=options['seed'])
+        self.stdout.write('Данные: ' + ', '.join(f'{name} {count}' for name, count in results['dataset'].items()))
+        for name, result in results['scenarios'].items():
+            self.stdout.write(f'{name:<16} p50 {result["p50_ms"]:8.2f} ms  p95 {result["p95_ms"]:8.2f} ms'
+                              f'  запросов {result["queries"]}')
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f'Результаты сохранены в {options["output"]}'))
+
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                baseline = json.load(file)
+            if baseline['dataset'] != results['dataset']:
+                self.stdout.write(self.style.WARNING('Размер данных отличается от базового запуска'))
+            rows = compare_results(baseline, results, options['threshold'])
+            for row in rows:
+                line = (f'{row["scenario"]:<16} {row["metric"]:<8} {row["baseline"]:>10} -> {row["current"]:<10}'
+                        f' {row["change"]:+.1%}')
+                self.stdout.write(self.style.ERROR(line) if row['regression'] else line)
+            regressions = [row for row in rows if row['regression']]
+            if regressions:
+                raise CommandError(f'Регрессий по сравнению с {options["baseline"]}: {len(regressions)}')
@@ -0,0 +1,52 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from store.models import Customer, Order
+from store.stripe_stub import checkout_completed_event, sign_payload
+from store.webhooks import process_events
+
+
+class Command(BaseCommand):
+    help = 'Замеряет приём вебхуков Stripe и пакетную обработку очереди (данные откатываются)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=2000)
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        with transaction.atomic(), override_settings(ALLOWED_HOSTS=['testserver']):
+            self.run(options['events'], options['batch_size'])
+            transaction.set_rollback(True)
+
+    def run(self, count, batch_size):
+        customer = Customer.objects.create(name='bench', email='')
+        orders = Order.objects.bulk_create([Order(customer=customer) for i in range(count)])
+        # Корзины пустые, поэтому и оплаченная сумма нулевая
+        payloads = [checkout_completed_event(order.pk, 0) for order in orders]
+        client = Client()
+        url = reverse('stripe_webhook')
+
+        started = time.perf_counter()
+        for payload in payloads:
+            response = client.post(url, payload, content_type='application/json',
+                                   HTTP_STRIPE_SIGNATURE=sign_payload(payload, settings.STRIPE_WEBHOOK_SECRET))
+            assert response.status_code == 200, response.status_code
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'Приём:      {count} событий за {elapsed:.2f} с, {count / elapsed:8.1f} событий/с, '
+                          f'{elapsed / count * 1000:.2f} ms на вебхук')
+
+        started = time.perf_counter()
+        completed = 0
+        while True:
+            processed, done = process_events(batch_size)
+            if not processed:
+                break
+            completed += done
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'Обработка:  {completed} заказов за {elapsed:.2f} с, {count / elapsed:8.1f} событий/с '
+                          f'(пачки по {batch_size})')
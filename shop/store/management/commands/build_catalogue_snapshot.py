@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from store.snapshot import build_snapshot, get_path
+
+
+class Command(BaseCommand):
+    help = 'Собирает снимок каталога, который воркеры читают при старте'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='Путь к файлу снимка, по умолчанию STORE_SNAPSHOT_PATH')
+        parser.add_argument('--products-per-category', type=int, default=4)
+
+    def handle(self, *args, **options):
+        path = options['output'] or get_path()
+        data, size = build_snapshot(path, products_per_category=options['products_per_category'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Снимок каталога {path}: {len(data["categories"])} категорий, '
+            f'{len(data["product_ids"])} товаров, {size / 1024:.1f} КБ'
+        ))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from store.models import RelatedProducts
+from store.recommendations import build_related_products
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает похожие товары по совместным покупкам и избранному'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=8, help='Сколько похожих товаров хранить')
+
+    def handle(self, *args, **options):
+        related = build_related_products(top=options['top'])
+        with transaction.atomic():
+            RelatedProducts.objects.all().delete()
+            RelatedProducts.objects.bulk_create(related, batch_size=1000)
+        self.stdout.write(self.style.SUCCESS(f'Похожие товары посчитаны для {len(related)} товаров'))
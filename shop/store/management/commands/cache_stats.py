@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from store.cache import get_stats
+
+
+class Command(BaseCommand):
+    help = 'Показывает попадания и промахи кэша фрагментов магазина (приблизительно, по всем процессам)'
+
+    def handle(self, *args, **options):
+        for name, stats in get_stats().items():
+            total = stats['hits'] + stats['misses']
+            ratio = stats['hits'] / total * 100 if total else 0
+            self.stdout.write(f'{name:<15} hits {stats["hits"]:>8}  misses {stats["misses"]:>8}  {ratio:5.1f}%')
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.benchmarks import DATASET, delete_dataset, generate_dataset
+
+
+class Command(BaseCommand):
+    help = 'Заполняет базу синтетическим каталогом для замеров: категории, товары, фото, избранное, отзывы, заказы'
+
+    def add_arguments(self, parser):
+        for name, default in DATASET.items():
+            parser.add_argument(f'--{name.replace("_", "-")}', type=int, default=default)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5_000)
+        parser.add_argument('--clear', action='store_true', help='Удалить ранее сгенерированные данные')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            deleted = delete_dataset()
+            self.stdout.write(self.style.SUCCESS(f'Удалено синтетических записей: {deleted}'))
+            return
+
+        for name in DATASET:
+            # Без категорий, товаров или пользователей не из чего строить остальное
+            minimum = 1 if name in ('categories', 'products', 'users') else 0
+            if options[name] < minimum:
+                raise CommandError(f'--{name.replace("_", "-")} должно быть не меньше {minimum}')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должно быть не меньше 1')
+
+        started = time.perf_counter()
+        counts = generate_dataset(**{name: options[name] for name in DATASET}, seed=options['seed'],
+                                  batch_size=options['batch_size'], log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано за {time.perf_counter() - started:.1f} s: '
+            + ', '.join(f'{name} {count}' for name, count in counts.items())
+        ))
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.webhooks import process_events
+
+
+class Command(BaseCommand):
+    help = 'Обрабатывает очередь событий Stripe: закрывает оплаченные заказы пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--loop', action='store_true', help='Работать постоянно, опрашивая очередь')
+        parser.add_argument('--interval', type=float, default=1.0, help='Пауза при пустой очереди, с')
+
+    def handle(self, *args, **options):
+        while True:
+            processed, completed = process_events(options['batch_size'])
+            if processed:
+                self.stdout.write(f'Событий обработано: {processed}, заказов закрыто: {completed}')
+            elif not options['loop']:
+                break
+            else:
+                time.sleep(options['interval'])
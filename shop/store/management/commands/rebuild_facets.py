@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from store.facets import rebuild_facets
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики фильтров всех категорий'
+
+    def handle(self, *args, **options):
+        count = rebuild_facets()
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано значений фильтров: {count}'))
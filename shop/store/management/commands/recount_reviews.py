@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from store.utils import recount_reviews
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает число отзывов и оценок товаров после массовых изменений отзывов'
+
+    def handle(self, *args, **options):
+        count = recount_reviews()
+        self.stdout.write(self.style.SUCCESS(f'Сводка отзывов пересчитана для {count} товаров'))
@@ -0,0 +1,35 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from store.images import mark_renditions_ready, render_photo
+from store.models import Gallery
+
+
+class Command(BaseCommand):
+    help = 'Создаёт все размеры изображений галереи параллельно на всех ядрах'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Количество процессов')
+        parser.add_argument('--force', action='store_true', help='Пересоздать уже существующие размеры')
+
+    def handle(self, *args, **options):
+        names = list(Gallery.objects.exclude(photo__isnull=True).exclude(photo='').values_list('photo', flat=True))
+        # Дочерние процессы работают только с файлами, соединение с БД им не нужно
+        connection.close()
+
+        ready, failed = [], 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            futures = {executor.submit(render_photo, name, options['force']): name for name in names}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    ready.append(futures[future])
+                except Exception as error:
+                    failed += 1
+                    self.stderr.write(f'{futures[future]}: {error}')
+
+        mark_renditions_ready(ready)
+        self.stdout.write(self.style.SUCCESS(f'Готово изображений: {len(ready)}, с ошибками: {failed}'))
@@ -0,0 +1,201 @@
+import logging
+import random
+import threading
+import time
+import traceback
+from bisect import bisect_left
+from contextvars import ContextVar
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.template import TemplateDoesNotExist
+from django.template.backends import django as django_backend
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+METRICS = {
+    'store_view_latency_seconds': ('Полное время ответа представления', LATENCY_BUCKETS),
+    'store_view_db_seconds': ('Время SQL-запросов за ответ', LATENCY_BUCKETS),
+    'store_view_template_seconds': ('Время отрисовки шаблонов за ответ', LATENCY_BUCKETS),
+    'store_view_queries': ('Число SQL-запросов за ответ', QUERY_BUCKETS),
+}
+
+logger = logging.getLogger(__name__)
+_current = ContextVar('store_request_stats', default=None)
+_lock = threading.Lock()
+_histograms = {}
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RequestStats:
+    def __init__(self, sampled):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.templates = []
+        # Стек и текст запросов собираются только для выборки: на каждом ответе это слишком дорого
+        self.slow_queries = [] if sampled else None
+
+
+def observe(view, stats):
+    values = {
+        'store_view_latency_seconds': time.perf_counter() - stats.started,
+        'store_view_db_seconds': stats.db_time,
+        'store_view_template_seconds': stats.template_time,
+        'store_view_queries': stats.queries,
+    }
+    with _lock:
+        for name, value in values.items():
+            if (name, view) not in _histograms:
+                _histograms[name, view] = Histogram(METRICS[name][1])
+            _histograms[name, view].observe(value)
+
+
+def reset_metrics():
+    with _lock:
+        _histograms.clear()
+
+
+def format_metrics():
+    # Текстовый формат Prometheus: бакеты накопительные, последний - +Inf
+    lines = []
+    with _lock:
+        for name, (help_text, buckets) in METRICS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            for (metric, view), histogram in sorted(_histograms.items()):
+                if metric != name:
+                    continue
+                total = 0
+                for bound, count in zip((*buckets, '+Inf'), histogram.counts):
+                    total += count
+                    lines.append(f'{name}_bucket{{view="{view}",le="{bound}"}} {total}')
+                lines.append(f'{name}_sum{{view="{view}"}} {histogram.sum}')
+                lines.append(f'{name}_count{{view="{view}"}} {histogram.count}')
+    return '\n'.join(lines) + '\n'
+
+
+def find_origin():
+    # Ближайший к запросу кадр из кода проекта: тег шаблона, метод модели или представление
+    base_dir = str(settings.BASE_DIR)
+    for frame in reversed(traceback.extract_stack()[:-2]):
+        if frame.filename.startswith(base_dir) and 'site-packages' not in frame.filename \
+                and frame.filename != __file__:
+            return f'{Path(frame.filename).relative_to(base_dir)}:{frame.lineno} {frame.name}'
+    return None
+
+
+def record_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        stats.queries += 1
+        stats.db_time += duration
+        if stats.slow_queries is not None:
+            template = stats.templates[-1] if stats.templates else None
+            stats.slow_queries.append((duration, sql, find_origin(), template))
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    # Обёртка ставится на каждое соединение и читает статистику текущего запроса из contextvar,
+    # поэтому учитываются и запросы из sync_to_async в асинхронных представлениях
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class Template(django_backend.Template):
+    def render(self, context=None, request=None):
+        stats = _current.get()
+        if stats is None:
+            return super().render(context, request)
+        stats.templates.append(self.origin.template_name)
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.templates.pop()
+            # Вложенные render_to_string из тегов уже входят во время внешнего шаблона
+            if not stats.templates:
+                stats.template_time += time.perf_counter() - started
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return Template(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            django_backend.reraise(exc, self)
+
+
+class InstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats, token = self.start()
+        try:
+            return self.get_response(request)
+        finally:
+            _current.reset(token)
+            self.finish(request, stats)
+
+    async def __acall__(self, request):
+        stats, token = self.start()
+        try:
+            return await self.get_response(request)
+        finally:
+            _current.reset(token)
+            self.finish(request, stats)
+
+    def start(self):
+        sampled = random.random() < getattr(settings, 'STORE_METRICS_SAMPLE_RATE', 0.0)
+        stats = RequestStats(sampled)
+        return stats, _current.set(stats)
+
+    def finish(self, request, stats):
+        match = getattr(request, 'resolver_match', None)
+        # Учитываются только представления магазина; админка и статика в гистограммы не попадают
+        if match is None or not match.func.__module__.startswith('store.'):
+            return
+        observe(match.view_name, stats)
+        if stats.slow_queries:
+            self.log_slow_queries(match.view_name, request, stats)
+
+    def log_slow_queries(self, view, request, stats):
+        limit = getattr(settings, 'STORE_METRICS_SLOW_QUERIES', 5)
+        slowest = sorted(stats.slow_queries, key=lambda query: query[0], reverse=True)[:limit]
+        logger.info(
+            'Медленные запросы %s %s (%s запросов, %.1f ms в базе):\n%s', view, request.path, stats.queries,
+            stats.db_time * 1000,
+            '\n'.join(f'  {duration * 1000:.2f} ms  {origin or "?"}  [{template or "вне шаблона"}]  {sql}'
+                      for duration, sql, origin, template in slowest)
+        )
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0007_product_primary_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gallery',
+            name='has_renditions',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Размеры изображения готовы'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='has_renditions',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Размеры изображения готовы'),
+        ),
+        migrations.AlterField(
+            model_name='gallery',
+            name='photo',
+            field=models.ImageField(blank=True, null=True, upload_to='products/', verbose_name='Изображение'),
+        ),
+    ]
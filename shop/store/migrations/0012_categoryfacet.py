@@ -0,0 +1,62 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:24
+
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+# Корзины как в store.facets на момент миграции: код приложения может измениться, миграция - нет
+PRICE_BUCKETS = [0, 50, 100, 200, 500, 1000]
+SIZE_STEP = 10
+
+
+def get_facet_values(product):
+    price = max(bucket for bucket in PRICE_BUCKETS if bucket <= max(product['price'], 0))
+    return {
+        (product['category_id'], 'colour', product['colour']),
+        (product['category_id'], 'size', str(product['size'] // SIZE_STEP * SIZE_STEP)),
+        (product['category_id'], 'price', str(price)),
+    }
+
+
+def fill_facets(apps, schema_editor):
+    # Как facets.rebuild_facets, но на исторических моделях: у существующих категорий сразу есть счётчики
+    Product = apps.get_model('store', 'Product')
+    CategoryFacet = apps.get_model('store', 'CategoryFacet')
+    counts = {}
+    for product in Product.objects.order_by().values('category_id', 'colour', 'size', 'price').annotate(
+            count=Count('pk')):
+        for key in get_facet_values(product):
+            counts[key] = counts.get(key, 0) + product['count']
+    CategoryFacet.objects.bulk_create([
+        CategoryFacet(category_id=category_id, facet=facet, value=value, count=count)
+        for (category_id, facet, value), count in counts.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0011_product_sort_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(choices=[('colour', 'Цвет/Материал'), ('size', 'Размер, мм'), ('price', 'Цена')], max_length=10, verbose_name='Фильтр')),
+                ('value', models.CharField(max_length=30, verbose_name='Значение')),
+                ('count', models.IntegerField(default=0, verbose_name='Кол-во товаров')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facets', to='store.category', verbose_name='Категория')),
+            ],
+            options={
+                'verbose_name': 'Фильтр категории',
+                'verbose_name_plural': 'Фильтры категорий',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='categoryfacet',
+            constraint=models.UniqueConstraint(fields=('category', 'facet', 'value'), name='unique_category_facet_value'),
+        ),
+        migrations.RunPython(fill_facets, migrations.RunPython.noop),
+    ]
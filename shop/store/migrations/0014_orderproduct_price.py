@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0013_paymentevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderproduct',
+            name='price',
+            field=models.FloatField(blank=True, null=True, verbose_name='Цена на момент оплаты'),
+        ),
+    ]
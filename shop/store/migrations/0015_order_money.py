@@ -0,0 +1,78 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:44
+
+from decimal import Decimal
+
+from django.db import migrations, models, transaction
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce
+
+BATCH_SIZE = 1000
+
+
+def money_field():
+    return models.DecimalField(max_digits=12, decimal_places=2)
+
+
+def backfill_batches(queryset, update):
+    # Пачки по первичному ключу, каждая в своей транзакции: большие таблицы не блокируются целиком
+    last_pk = 0
+    while True:
+        pks = list(queryset.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:BATCH_SIZE])
+        if not pks:
+            break
+        with transaction.atomic():
+            queryset.model.objects.filter(pk__in=pks).update(**update)
+        last_pk = pks[-1]
+
+
+def backfill_money(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    Order = apps.get_model('store', 'Order')
+    OrderProduct = apps.get_model('store', 'OrderProduct')
+
+    # Строкам закрытых заказов - цена товара, открытые корзины считаются по каталогу
+    backfill_batches(
+        OrderProduct.objects.filter(order__is_completed=True, price__isnull=True, product__isnull=False),
+        {'price': Cast(Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('price')[:1]),
+                       money_field())}
+    )
+    totals = OrderProduct.objects.filter(order=OuterRef('pk')).order_by().values('order')
+    backfill_batches(
+        Order.objects.filter(is_completed=True, total_price__isnull=True),
+        {
+            'total_quantity': Coalesce(Subquery(totals.annotate(total=Sum('quantity')).values('total')), 0),
+            'total_price': Coalesce(
+                Subquery(totals.annotate(total=Sum(F('quantity') * F('price'), output_field=money_field()))
+                         .values('total')),
+                Value(Decimal('0.00')), output_field=money_field()
+            ),
+        }
+    )
+
+
+class Migration(migrations.Migration):
+    # Заполнение идёт пачками с отдельными транзакциями
+    atomic = False
+
+    dependencies = [
+        ('store', '0014_orderproduct_price'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='total_price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True, verbose_name='Сумма заказа'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_quantity',
+            field=models.IntegerField(blank=True, null=True, verbose_name='Количество товаров'),
+        ),
+        migrations.AlterField(
+            model_name='orderproduct',
+            name='price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True, verbose_name='Цена на момент оплаты'),
+        ),
+        migrations.RunPython(backfill_money, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:02
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def remove_duplicates(apps, schema_editor):
+    # Дубли появлялись при одновременных кликах: остаётся самая ранняя запись пары
+    FavouriteProducts = apps.get_model('store', 'FavouriteProducts')
+    first = FavouriteProducts.objects.values('user_id', 'product_id').annotate(first=Min('id')).values('first')
+    FavouriteProducts.objects.exclude(pk__in=first).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0016_review_summary'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='favouriteproducts',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='favourite_user_product_unique'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0017_favourite_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymentevent',
+            name='error',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='Ошибка обработки'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0018_paymentevent_error'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyntheticRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='Прогон')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+            ],
+            options={
+                'verbose_name': 'Синтетические данные',
+                'verbose_name_plural': 'Синтетические данные',
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:45
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+from django.db.models.functions import Coalesce
+
+
+def merge_duplicates(apps, schema_editor):
+    # Дубли появлялись при одновременных первых добавлениях: количества сливаются в самую раннюю строку
+    OrderProduct = apps.get_model('store', 'OrderProduct')
+    duplicates = OrderProduct.objects.filter(order__isnull=False, product__isnull=False).values(
+        'order_id', 'product_id').annotate(lines=Count('id'), first=Min('id'),
+                                           total=Coalesce(Sum('quantity'), 0)).filter(lines__gt=1)
+    for duplicate in duplicates:
+        lines = OrderProduct.objects.filter(order_id=duplicate['order_id'], product_id=duplicate['product_id'])
+        lines.filter(pk=duplicate['first']).update(quantity=duplicate['total'])
+        lines.exclude(pk=duplicate['first']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0019_syntheticrun'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='orderproduct',
+            constraint=models.UniqueConstraint(fields=('order', 'product'), name='orderproduct_order_product_unique'),
+        ),
+    ]
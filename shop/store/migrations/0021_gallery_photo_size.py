@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:49
+
+from django.db import migrations
+import django_resized.forms
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0020_orderproduct_unique'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='gallery',
+            name='photo',
+            field=django_resized.forms.ResizedImageField(blank=True, crop=None, force_format='JPEG', keep_meta=True, null=True, quality=75, scale=1, size=[630, 630], upload_to='products/', verbose_name='Изображение'),
+        ),
+    ]
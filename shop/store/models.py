@@ -1,9 +1,23 @@
 from django.db import models
+from decimal import Decimal
+
+from django.db.models import F, Sum, Value
+from django.db.models.functions import Cast, Coalesce
+from django.utils.functional import cached_property
 from django_resized import ResizedImageField
 # Create your models here.
 from django.urls import reverse
 from django.contrib.auth.models import User
 
+def money_field():
+    # Деньги заказов хранятся в Decimal с точностью до цента, цены каталога остаются FloatField
+    return models.DecimalField(max_digits=12, decimal_places=2)
+
+
+def to_money(value):
+    return Decimal(str(value)).quantize(Decimal('0.01'))
+
+
 class Category(models.Model):
     title = models.CharField(max_length=255, verbose_name='Категория')
     image = models.ImageField(upload_to='categories/', verbose_name='Изображение')
@@ -34,18 +48,27 @@ class Product(models.Model):
                                  verbose_name='Категория',
                                  related_name='products')
     slug = models.SlugField(unique=True, null=True, verbose_name='Слаг')
+    primary_image = models.ImageField(upload_to='products/', blank=True, editable=False,
+                                      verbose_name='Главное изображение')
+    has_renditions = models.BooleanField(default=False, editable=False, verbose_name='Размеры изображения готовы')
+    # Сводка отзывов хранится в товаре и обновляется вместе с новым отзывом, без COUNT/AVG на странице
+    review_count = models.IntegerField(default=0, editable=False, verbose_name='Кол-во отзывов')
+    rating_count = models.IntegerField(default=0, editable=False, verbose_name='Кол-во оценок')
+    rating_sum = models.IntegerField(default=0, editable=False, verbose_name='Сумма оценок')
 
     def get_absolute_url(self):
         return reverse('product', kwargs={'slug': self.slug})
 
+    @property
+    def average_rating(self):
+        if not self.rating_count:
+            return None
+        return round(self.rating_sum / self.rating_count, 1)
+
     def get_first_photo(self):
-        if self.images:
-            try:
-                return self.images.first().photo.url
-            except:
-                return 'https://экологиякрыма.рф/img/19893719.jpg'
-        else:
-            return 'https://экологиякрыма.рф/img/19893719.jpg'
+        if self.primary_image:
+            return self.primary_image.url
+        return 'https://экологиякрыма.рф/img/19893719.jpg'
 
     # '''category_id
     # category = Category.objects.get(pk=category_id)
@@ -59,11 +82,43 @@ class Product(models.Model):
     class Meta:
         verbose_name = 'Товар'
         verbose_name_plural = 'Товары'
+        # Под сортировки страницы категории и постраничный вывод по курсору
+        indexes = [
+            models.Index(fields=['category', 'price', 'id'], name='product_category_price_idx'),
+            models.Index(fields=['category', 'colour', 'id'], name='product_category_colour_idx'),
+            models.Index(fields=['category', 'size', 'id'], name='product_category_size_idx'),
+            models.Index(fields=['category', 'title', 'id'], name='product_category_title_idx'),
+        ]
+
+
+class CategoryFacet(models.Model):
+    FACETS = [
+        ('colour', 'Цвет/Материал'),
+        ('size', 'Размер, мм'),
+        ('price', 'Цена'),
+    ]
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, verbose_name='Категория', related_name='facets')
+    facet = models.CharField(max_length=10, choices=FACETS, verbose_name='Фильтр')
+    value = models.CharField(max_length=30, verbose_name='Значение')
+    count = models.IntegerField(default=0, verbose_name='Кол-во товаров')
+
+    def __str__(self):
+        return f'{self.category} - {self.facet}: {self.value}'
+
+    class Meta:
+        verbose_name = 'Фильтр категории'
+        verbose_name_plural = 'Фильтры категорий'
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'facet', 'value'], name='unique_category_facet_value')
+        ]
 
 
 class Gallery(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, verbose_name='Товар', related_name='images')
-    photo = ResizedImageField(size=[630, 630], upload_to='products/', null=True, blank=True, verbose_name='Изображение')
+    # Оригинал не больше самого крупного размера (detail, 630px): полноразмерные фото не хранятся и не отдаются
+    photo = ResizedImageField(size=[630, 630], upload_to='products/', null=True, blank=True,
+                              verbose_name='Изображение')
+    has_renditions = models.BooleanField(default=False, editable=False, verbose_name='Размеры изображения готовы')
 
     def __str__(self):
         return self.product.title
@@ -74,9 +129,12 @@ class Gallery(models.Model):
 
 
 class Review(models.Model):
+    RATINGS = [(rating, str(rating)) for rating in range(1, 6)]
+
     text = models.TextField(verbose_name='Текст отзыва')
     author = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='Автор')
     product = models.ForeignKey(Product, on_delete=models.CASCADE, verbose_name='Товар')
+    rating = models.PositiveSmallIntegerField(null=True, blank=True, choices=RATINGS, verbose_name='Оценка')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата')
 
     def __str__(self):
@@ -85,6 +143,10 @@ class Review(models.Model):
     class Meta:
         verbose_name = 'Отзыв'
         verbose_name_plural = 'Отзывы'
+        # Отзывы товара выводятся от новых к старым по курсору (created_at, id)
+        indexes = [
+            models.Index(fields=['product', 'created_at', 'id'], name='review_product_created_idx'),
+        ]
 
 class FavouriteProducts(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='Пользователь')
@@ -96,6 +158,24 @@ class FavouriteProducts(models.Model):
     class Meta:
         verbose_name = 'Избранный товар'
         verbose_name_plural = 'Избранные товары'
+        # Пара пользователь-товар одна: повторный клик не создаёт дубль, индекс же служит выборке избранного
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='favourite_user_product_unique'),
+        ]
+
+
+class RelatedProducts(models.Model):
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='related',
+                                   verbose_name='Товар')
+    product_ids = models.JSONField(default=list, verbose_name='Похожие товары')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
+
+    def __str__(self):
+        return self.product.title
+
+    class Meta:
+        verbose_name = 'Похожие товары'
+        verbose_name_plural = 'Похожие товары'
 
 
 class Customer(models.Model):
@@ -115,21 +195,46 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     is_completed = models.BooleanField(default=False)
     shipping = models.BooleanField(default=True)
+    total_quantity = models.IntegerField(null=True, blank=True, verbose_name='Количество товаров')
+    total_price = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True,
+                                      verbose_name='Сумма заказа')
 
     def __str__(self):
         return self.customer.name
 
+    def get_cart_totals_aggregates(self):
+        # Открытая корзина считается по текущим ценам каталога
+        return {
+            'total_quantity': Coalesce(Sum('quantity'), 0),
+            'total_price': Coalesce(Sum(F('quantity') * Cast('product__price', money_field()),
+                                        output_field=money_field()), Value(Decimal('0.00')),
+                                    output_field=money_field())
+        }
+
+    def get_stored_totals(self):
+        # Итоги закрытого заказа сохранены на нём самом, строки и товары не читаются
+        if self.total_price is not None:
+            return {'total_quantity': self.total_quantity, 'total_price': self.total_price}
+
+    @cached_property
+    def cart_totals(self):
+        # Итоги корзины считаются одним агрегирующим запросом и запоминаются на заказе
+        return self.get_stored_totals() or self.orderproduct_set.aggregate(**self.get_cart_totals_aggregates())
+
+    async def aget_cart_totals(self):
+        # Для async-представлений: тот же запрос через async ORM, результат в том же кэше
+        if 'cart_totals' not in self.__dict__:
+            self.cart_totals = self.get_stored_totals() or await self.orderproduct_set.aaggregate(
+                **self.get_cart_totals_aggregates())
+        return self.cart_totals
+
     @property
     def get_cart_total_price(self):
-        order_products = self.orderproduct_set.all()
-        total_price = sum([product.get_total_price for product in order_products])
-        return total_price
+        return self.cart_totals['total_price']
 
     @property
     def get_cart_total_quantity(self):
-        order_products = self.orderproduct_set.all()
-        total_quantity = sum([product.quantity for product in order_products])
-        return total_quantity
+        return self.cart_totals['total_quantity']
 
     class Meta:
         verbose_name = 'Заказ'
@@ -140,16 +245,23 @@ class OrderProduct(models.Model):
     product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True)
     order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True)
     quantity = models.IntegerField(default=0, null=True, blank=True)
+    price = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True,
+                                verbose_name='Цена на момент оплаты')
     added_at = models.DateTimeField(auto_now_add=True)
 
     @property
     def get_total_price(self):
-        total_price = self.product.price * self.quantity
-        return total_price
+        # У оплаченной строки цена сохранена, товар для расчёта не нужен
+        price = self.price if self.price is not None else to_money(self.product.price)
+        return price * self.quantity
 
     class Meta:
         verbose_name = 'Товар в заказе'
         verbose_name_plural = 'Товары в заказах'
+        # Товар в заказе одной строкой: одновременные первые добавления не создают дубль
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'product'], name='orderproduct_order_product_unique'),
+        ]
 
 
 class ShippingAddress(models.Model):
@@ -169,6 +281,40 @@ class ShippingAddress(models.Model):
         verbose_name_plural = 'Адреса доставки'
 
 
+class PaymentEvent(models.Model):
+    # Очередь событий Stripe: вебхук только сохраняет событие, заказы обновляет обработчик пачками
+    stripe_id = models.CharField(max_length=255, unique=True, verbose_name='ID события Stripe')
+    type = models.CharField(max_length=100, verbose_name='Тип события')
+    payload = models.JSONField(verbose_name='Данные события')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата получения')
+    processed_at = models.DateTimeField(null=True, blank=True, verbose_name='Дата обработки')
+    # Событие обработано, но заказ не закрыт: например, сумма оплаты разошлась с корзиной
+    error = models.CharField(max_length=255, blank=True, default='', verbose_name='Ошибка обработки')
+
+    def __str__(self):
+        return f'{self.type} {self.stripe_id}'
+
+    class Meta:
+        verbose_name = 'Событие оплаты'
+        verbose_name_plural = 'События оплаты'
+        indexes = [
+            models.Index(fields=['processed_at', 'id'], name='paymentevent_queue_idx'),
+        ]
+
+
+class SyntheticRun(models.Model):
+    # Прогон generate_synthetic_data: его слаги и логины начинаются с name, удаляются только записанные прогоны
+    name = models.CharField(max_length=100, unique=True, verbose_name='Прогон')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        verbose_name = 'Синтетические данные'
+        verbose_name_plural = 'Синтетические данные'
+
+
 
 
 
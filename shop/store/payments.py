@@ -0,0 +1,122 @@
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import stripe
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+_gateway = None
+
+
+class StripeGateway:
+    def __init__(self, api_key, api_base=stripe.DEFAULT_API_BASE, timeout=10, max_retries=2, pool_size=32,
+                 cache_timeout=60 * 60):
+        # Один пул соединений на процесс: соединение со Stripe не открывается заново на каждую оплату
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        http_client = stripe.RequestsClient(
+            timeout=timeout, session=session,
+            async_fallback_client=stripe.HTTPXClient(timeout=timeout) if httpx is not None else None
+        )
+        self.client = stripe.StripeClient(api_key, base_addresses={'api': api_base}, http_client=http_client,
+                                          max_network_retries=max_retries)
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='stripe')
+        self.cache_timeout = cache_timeout
+
+    def get_idempotency_key(self, order, params):
+        # Ключ - отпечаток всех параметров сессии: повторный клик получает ту же сессию,
+        # изменённые корзина или цены - новую, а не сессию со старой суммой
+        content = json.dumps(params, sort_keys=True, ensure_ascii=False)
+        return f'checkout-{order.pk}-{hashlib.md5(content.encode()).hexdigest()}'
+
+    def get_params(self, cart_info, success_url, cancel_url):
+        return {
+            'line_items': [
+                {
+                    'price_data': {
+                        'currency': 'usd',
+                        'product_data': {
+                            'name': 'Товары с TOTEMBO'
+                        },
+                        # Одна позиция на всю корзину: сумма уже учитывает количество товаров
+                        'unit_amount': int(cart_info['cart_total_price'] * 100)
+                    },
+                    'quantity': 1
+                }
+            ],
+            'mode': 'payment',
+            # По этому id обработчик вебхуков найдёт оплаченный заказ
+            'client_reference_id': str(cart_info['order'].pk),
+            'success_url': success_url,
+            'cancel_url': cancel_url
+        }
+
+    def remember(self, key, created):
+        session = {'id': created.id, 'url': created.url}
+        cache.set(f'store:{key}', session, self.cache_timeout)
+        return session
+
+    async def aremember(self, key, created):
+        session = {'id': created.id, 'url': created.url}
+        await cache.aset(f'store:{key}', session, self.cache_timeout)
+        return session
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+    def create_checkout_session(self, order, cart_info, success_url, cancel_url):
+        params = self.get_params(cart_info, success_url, cancel_url)
+        key = self.get_idempotency_key(order, params)
+        session = cache.get(f'store:{key}')
+        if session is None:
+            created = self.client.v1.checkout.sessions.create(params, {'idempotency_key': key})
+            session = self.remember(key, created)
+        return session
+
+    async def acreate_checkout_session(self, order, cart_info, success_url, cancel_url):
+        if httpx is None:
+            # Без httpx запрос уходит в свой пул потоков и всё равно не занимает event loop
+            return await sync_to_async(self.create_checkout_session, thread_sensitive=False,
+                                       executor=self.executor)(order, cart_info, success_url, cancel_url)
+
+        params = self.get_params(cart_info, success_url, cancel_url)
+        key = self.get_idempotency_key(order, params)
+        # Кэш на диске - асинхронные методы, чтобы чтение файла не блокировало event loop
+        session = await cache.aget(f'store:{key}')
+        if session is None:
+            created = await self.client.v1.checkout.sessions.create_async(params, {'idempotency_key': key})
+            session = await self.aremember(key, created)
+        return session
+
+
+def get_gateway():
+    global _gateway
+    if _gateway is None:
+        _gateway = StripeGateway(
+            settings.STRIPE_SECRET_KEY,
+            api_base=getattr(settings, 'STRIPE_API_BASE', stripe.DEFAULT_API_BASE),
+            timeout=getattr(settings, 'STRIPE_TIMEOUT', 10),
+            max_retries=getattr(settings, 'STRIPE_MAX_RETRIES', 2),
+            pool_size=getattr(settings, 'STRIPE_MAX_CONCURRENT_REQUESTS', 32),
+            cache_timeout=getattr(settings, 'STRIPE_SESSION_CACHE_TIMEOUT', 60 * 60),
+        )
+    return _gateway
+
+
+def reset_gateway():
+    # Пул потоков старого шлюза закрывается, иначе каждый сброс оставляет потоки висеть
+    global _gateway
+    if _gateway is not None:
+        _gateway.close()
+    _gateway = None
@@ -0,0 +1,81 @@
+import random
+from array import array
+from collections import Counter, defaultdict
+from itertools import combinations, groupby
+
+from django.core.cache import cache
+
+from .models import Product, FavouriteProducts, OrderProduct, RelatedProducts
+
+PRODUCT_IDS_KEY = 'store:product_ids'
+
+
+def get_product_ids():
+    # {id категории: массив id товаров}, None - все товары
+    ids = cache.get(PRODUCT_IDS_KEY)
+    if ids is None:
+        ids = {None: array('q')}
+        for category_id, pk in Product.objects.order_by().values_list('category_id', 'pk'):
+            ids.setdefault(category_id, array('q')).append(pk)
+            ids[None].append(pk)
+        cache.set(PRODUCT_IDS_KEY, ids, None)
+    return ids
+
+
+def reset_product_ids():
+    cache.delete(PRODUCT_IDS_KEY)
+
+
+def sample_ids(ids, count, exclude):
+    # random.sample выбирает count элементов без прохода по всему массиву
+    count = min(count + len(exclude), len(ids))
+    return [pk for pk in random.sample(ids, count) if pk not in exclude]
+
+
+def get_random_products(product, count=4, exclude=()):
+    ids = get_product_ids()
+    exclude = {product.pk, *exclude}
+    chosen = sample_ids(ids.get(product.category_id, array('q')), count, exclude)[:count]
+    if len(chosen) < count:
+        exclude.update(chosen)
+        chosen += sample_ids(ids[None], count - len(chosen), exclude)[:count - len(chosen)]
+
+    products = Product.objects.in_bulk(chosen)
+    return [products[pk] for pk in chosen if pk in products]
+
+
+def get_recommended_products(product, count=4):
+    # Похожие товары посчитаны заранее командой build_recommendations
+    try:
+        related_ids = product.related.product_ids[:count]
+    except RelatedProducts.DoesNotExist:
+        related_ids = []
+
+    products = Product.objects.in_bulk(related_ids) if related_ids else {}
+    data = [products[pk] for pk in related_ids if pk in products]
+    if len(data) < count:
+        data += get_random_products(product, count - len(data), exclude=[p.pk for p in data])
+    return data
+
+
+def count_pairs(rows, weight, scores, max_basket=100):
+    # rows - пары (корзина, товар), отсортированные по корзине
+    for basket, items in groupby(rows, key=lambda row: row[0]):
+        product_ids = sorted({product_id for basket_id, product_id in items if product_id})[:max_basket]
+        for first, second in combinations(product_ids, 2):
+            scores[first][second] += weight
+            scores[second][first] += weight
+
+
+def build_related_products(top=8, purchase_weight=2, favourite_weight=1):
+    scores = defaultdict(Counter)
+    orders = OrderProduct.objects.filter(quantity__gt=0, order__isnull=False).order_by('order_id').values_list(
+        'order_id', 'product_id')
+    count_pairs(orders.iterator(), purchase_weight, scores)
+    favourites = FavouriteProducts.objects.order_by('user_id').values_list('user_id', 'product_id')
+    count_pairs(favourites.iterator(), favourite_weight, scores)
+
+    return [
+        RelatedProducts(product_id=product_id, product_ids=[pk for pk, score in related.most_common(top)])
+        for product_id, related in scores.items()
+    ]
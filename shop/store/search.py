@@ -0,0 +1,96 @@
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+from .models import Product
+
+FTS_TABLE = 'store_product_fts'
+ENDINGS = sorted([
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ией', 'ий', 'ый', 'ой', 'ая', 'яя', 'ое',
+    'ее', 'ые', 'ие', 'ых', 'их', 'ов', 'ев', 'ей', 'ам', 'ям', 'ах', 'ях', 'ом', 'ем', 'ую', 'юю', 'ия', 'ья',
+    'а', 'я', 'ы', 'и', 'о', 'е', 'у', 'ю', 'ь', 's',
+], key=len, reverse=True)
+
+
+def use_fts():
+    return connection.vendor == 'sqlite'
+
+
+def stem(word):
+    # Упрощённый стемминг: отрезаем окончание, дальше ищем по префиксу
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+def get_terms(query):
+    return [stem(word) for word in re.findall(r'\w+', query.lower())]
+
+
+def index_products(products):
+    if not use_fts():
+        return
+    rows = list(products.values_list('pk', 'title', 'description', 'colour', 'category__title'))
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE} (rowid, title, description, colour, category) VALUES (%s, %s, %s, %s, %s)',
+            rows
+        )
+
+
+def unindex_product(product_id):
+    if use_fts():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product_id])
+
+
+def rebuild_index():
+    if not use_fts():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(f'''
+            INSERT INTO {FTS_TABLE} (rowid, title, description, colour, category)
+            SELECT p.id, p.title, p.description, p.colour, c.title
+            FROM store_product p JOIN store_category c ON c.id = p.category_id
+        ''')
+        return cursor.rowcount
+
+
+def match_ids(terms, operator, limit):
+    query = f' {operator} '.join(f'"{term}"*' for term in terms)
+    # По умолчанию bm25 ранжирует все совпадения. STORE_SEARCH_MAX_CANDIDATES ограничивает ранжирование
+    # первыми N совпадениями по rowid: быстрее на широких запросах, но релевантность за пределом N приблизительная
+    candidates = getattr(settings, 'STORE_SEARCH_MAX_CANDIDATES', None)
+    if candidates is None:
+        sql = f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s ORDER BY rank LIMIT %s'
+    else:
+        sql = (f'SELECT rowid FROM (SELECT rowid, rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+               f'LIMIT {int(candidates)}) ORDER BY rank LIMIT %s')
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [query, limit])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search_products(query, limit=48):
+    terms = get_terms(query)
+    if not terms:
+        return []
+
+    if not use_fts():
+        condition = Q()
+        for term in terms:
+            condition &= (Q(title__icontains=term) | Q(description__icontains=term) |
+                          Q(colour__icontains=term) | Q(category__title__icontains=term))
+        return list(Product.objects.filter(condition)[:limit])
+
+    # Сначала все слова сразу, если пусто - хотя бы одно из них
+    ids = match_ids(terms, 'AND', limit)
+    if not ids and len(terms) > 1:
+        ids = match_ids(terms, 'OR', limit)
+    products = Product.objects.in_bulk(ids)
+    return [products[pk] for pk in ids if pk in products]
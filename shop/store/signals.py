@@ -0,0 +1,128 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from .cache import bump_versions
+from .facets import update_facets
+from .images import schedule_renditions
+from .models import Category, Product, Gallery
+from .recommendations import reset_product_ids
+from .search import index_products, unindex_product
+from .utils import refresh_primary_images
+
+_muted = ContextVar('store_signals_muted', default=False)
+
+
+@contextmanager
+def mute_signals():
+    # Массовые операции сами обновляют поиск, фильтры и кэш один раз в конце, а не на каждую строку
+    token = _muted.set(True)
+    try:
+        yield
+    finally:
+        _muted.reset(token)
+
+
+def unless_muted(handler):
+    @wraps(handler)
+    def wrapper(*args, **kwargs):
+        if not _muted.get():
+            return handler(*args, **kwargs)
+    return wrapper
+
+
+@receiver(post_save, sender=Gallery)
+@unless_muted
+def update_gallery_photo(sender, instance, **kwargs):
+    # Фото могло смениться - старые размеры больше не подходят
+    Gallery.objects.filter(pk=instance.pk).update(has_renditions=False)
+    refresh_primary_images(Product.objects.filter(pk=instance.product_id))
+    if instance.photo:
+        transaction.on_commit(lambda: schedule_renditions(instance.photo.name))
+
+
+@receiver(post_delete, sender=Gallery)
+@unless_muted
+def update_primary_image(sender, instance, **kwargs):
+    refresh_primary_images(Product.objects.filter(pk=instance.product_id))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@unless_muted
+def update_product_ids(sender, instance, **kwargs):
+    reset_product_ids()
+
+
+@receiver(post_save, sender=Product)
+@unless_muted
+def index_product(sender, instance, **kwargs):
+    index_products(Product.objects.filter(pk=instance.pk))
+
+
+@receiver(post_delete, sender=Product)
+@unless_muted
+def remove_product_from_index(sender, instance, **kwargs):
+    unindex_product(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+@unless_muted
+def index_category_products(sender, instance, created, **kwargs):
+    if not created:
+        index_products(instance.products.all())
+
+
+@receiver(pre_save, sender=Product)
+@unless_muted
+def remember_old_values(sender, instance, raw=False, **kwargs):
+    instance._old_values = None
+    if instance.pk and not raw:
+        instance._old_values = Product.objects.filter(pk=instance.pk).values(
+            'category_id', 'colour', 'size', 'price', 'slug').first()
+
+
+@receiver(post_save, sender=Product)
+@unless_muted
+def update_product_facets(sender, instance, raw=False, **kwargs):
+    if not raw:
+        update_facets(getattr(instance, '_old_values', None), instance)
+
+
+@receiver(post_delete, sender=Product)
+@unless_muted
+def remove_product_facets(sender, instance, **kwargs):
+    update_facets(instance, None)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@unless_muted
+def reset_category_fragments(sender, instance, **kwargs):
+    bump_versions('catalogue', 'categories', f'category-page:{instance.slug}')
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@unless_muted
+def reset_product_fragments(sender, instance, **kwargs):
+    scopes = ['catalogue', f'category-page:{instance.category.slug}', f'product-page:{instance.slug}']
+    old = getattr(instance, '_old_values', None)
+    if old and old['slug'] != instance.slug:
+        scopes.append(f'product-page:{old["slug"]}')
+    if old and old['category_id'] != instance.category_id:
+        scopes += [f'category-page:{slug}' for slug in Category.objects.filter(pk=old['category_id']).values_list(
+            'slug', flat=True)]
+    bump_versions(*scopes)
+
+
+@receiver(post_save, sender=Gallery)
+@receiver(post_delete, sender=Gallery)
+@unless_muted
+def reset_gallery_fragments(sender, instance, **kwargs):
+    for slug, category_slug in Product.objects.filter(pk=instance.product_id).values_list('slug', 'category__slug'):
+        bump_versions('catalogue', f'category-page:{category_slug}', f'product-page:{slug}')
@@ -0,0 +1,179 @@
+import hashlib
+import logging
+import mmap
+import os
+import pickle
+import struct
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.db.models import Count, Max, Q
+from django.shortcuts import get_object_or_404
+
+from .cache import cached, get_versions
+from .models import Category, Product
+from .utils import get_catalogue
+
+# Заголовок файла: метка, версия формата, отпечаток данных каталога
+HEADER = struct.Struct('<4sH32s')
+MAGIC = b'TSCS'
+FORMAT = 1
+CATEGORY_FIELDS = ['id', 'title', 'image', 'slug']
+PRODUCT_FIELDS = ['id', 'title', 'description', 'price', 'size', 'colour', 'updated_at', 'quantity', 'category_id',
+                  'slug', 'primary_image', 'has_renditions']
+
+logger = logging.getLogger(__name__)
+_snapshot = None
+
+
+def get_path():
+    return getattr(settings, 'STORE_SNAPSHOT_PATH', settings.BASE_DIR / 'catalogue.snapshot')
+
+
+def get_fingerprint():
+    # Меняется при изменении любого товара (updated_at, готовность размеров фото) или категории
+    products = Product.objects.aggregate(count=Count('pk'), updated_at=Max('updated_at'),
+                                         renditions=Count('pk', filter=Q(has_renditions=True)))
+    categories = list(Category.objects.order_by('pk').values_list(*CATEGORY_FIELDS))
+    return hashlib.sha256(repr((products, categories)).encode()).digest()
+
+
+def product_row(product):
+    return tuple(str(product.primary_image) if field == 'primary_image' else getattr(product, field)
+                 for field in PRODUCT_FIELDS)
+
+
+def build_snapshot(path=None, products_per_category=4):
+    # Отпечаток считается до чтения данных: правка во время сборки сделает снимок устаревшим, а не неверным
+    fingerprint = get_fingerprint()
+    data = {
+        'categories': list(Category.objects.order_by('pk').values_list(*CATEGORY_FIELDS)),
+        'catalogue': {
+            entry['title'].pk: [product_row(product) for product in entry['products']]
+            for entry in get_catalogue(products_per_category)
+        },
+        'product_ids': dict(Product.objects.order_by().values_list('slug', 'pk')),
+    }
+    payload = HEADER.pack(MAGIC, FORMAT, fingerprint) + pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+
+    # Запись во временный файл и замена: воркеры не увидят недописанный снимок
+    path = path or get_path()
+    with open(f'{path}.tmp', 'wb') as file:
+        file.write(payload)
+    os.replace(f'{path}.tmp', path)
+    return data, len(payload)
+
+
+class CatalogueSnapshot:
+    def __init__(self, fingerprint, data):
+        self.fingerprint = fingerprint
+        self.categories = [Category.from_db('default', CATEGORY_FIELDS, row) for row in data['categories']]
+        self.categories_by_slug = {category.slug: category for category in self.categories}
+        self.catalogue = []
+        for category in self.categories:
+            self.catalogue.append({
+                'title': category,
+                'products': [Product.from_db('default', PRODUCT_FIELDS, row)
+                             for row in data['catalogue'].get(category.pk, [])],
+                'image': category.image.url if category.image else 'https://экологиякрыма.рф/img/19893719.jpg'
+            })
+        self.product_ids = data['product_ids']
+        # Токен версии каталога и время, когда снимок последний раз сверен с базой
+        self.version = None
+        self.checked_at = None
+
+
+def read_snapshot(path):
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        magic, file_format, fingerprint = HEADER.unpack_from(buffer)
+        if magic != MAGIC or file_format != FORMAT:
+            raise ValueError(f'Неизвестный формат снимка каталога: {path}')
+        with memoryview(buffer)[HEADER.size:] as view:
+            data = pickle.loads(view)
+    return CatalogueSnapshot(fingerprint, data)
+
+
+def load_snapshot(path=None):
+    # Вызывается при старте воркера: снимок принимается, только если совпадает с базой
+    global _snapshot
+    _snapshot = None
+    path = path or get_path()
+    try:
+        snapshot = read_snapshot(path)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, struct.error, pickle.UnpicklingError):
+        logger.exception('Не удалось прочитать снимок каталога %s', path)
+        return None
+
+    try:
+        if snapshot.fingerprint != get_fingerprint():
+            logger.warning('Снимок каталога %s устарел, каталог читается из базы', path)
+            return None
+        snapshot.version = get_versions('catalogue')[0]
+        snapshot.checked_at = time.monotonic()
+    except DatabaseError:
+        # База не мигрирована или недоступна: воркер стартует и читает каталог из базы, когда она вернётся
+        logger.exception('Не удалось сверить снимок каталога %s с базой', path)
+        return None
+    finally:
+        # Соединение, открытое до форка воркеров, не должно достаться им по наследству
+        if not connection.in_atomic_block:
+            connection.close()
+    _snapshot = snapshot
+    return snapshot
+
+
+def unload_snapshot():
+    global _snapshot
+    _snapshot = None
+
+
+def get_snapshot():
+    # Версия в кэше ловит правки этого процесса; правки других процессов видны только по отпечатку базы,
+    # который сверяется не чаще раза в STORE_SNAPSHOT_CHECK_INTERVAL секунд
+    global _snapshot
+    snapshot = _snapshot
+    if snapshot is None:
+        return None
+    if snapshot.version != get_versions('catalogue')[0]:
+        _snapshot = None
+        return None
+    now = time.monotonic()
+    if now - snapshot.checked_at >= getattr(settings, 'STORE_SNAPSHOT_CHECK_INTERVAL', 30):
+        if snapshot.fingerprint != get_fingerprint():
+            logger.info('Каталог изменился в базе, снимок больше не используется')
+            _snapshot = None
+            return None
+        snapshot.checked_at = now
+    return snapshot
+
+
+def lookup_categories():
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        return snapshot.categories
+    return cached('categories', ['catalogue'], lambda: list(Category.objects.all()))
+
+
+def lookup_catalogue():
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        return snapshot.catalogue
+    return cached('catalogue', ['catalogue'], get_catalogue)
+
+
+def lookup_category(slug):
+    # Слага нет в снимке - категория могла появиться после его сборки, её ищут в базе
+    snapshot = get_snapshot()
+    if snapshot is not None and slug in snapshot.categories_by_slug:
+        return snapshot.categories_by_slug[slug]
+    return get_object_or_404(Category, slug=slug)
+
+
+def lookup_product_id(slug):
+    snapshot = get_snapshot()
+    if snapshot is not None and slug in snapshot.product_ids:
+        return snapshot.product_ids[slug]
+    return Product.objects.values_list('pk', flat=True).get(slug=slug)
@@ -47,4 +47,38 @@ $('.stop').on('click',function(){
     owl.trigger('stop.owl.autoplay')
 })
 
+$('.customer_reviews-more').on('click', function () {
+    var button = $(this);
+    $.getJSON(button.data('url'), function (data) {
+        $(data.html).filter('.customer_reviews-slider_block').each(function () {
+            $('.customer_reviews-slider').trigger('add.owl.carousel', [this]);
+        });
+        $('.customer_reviews-slider').trigger('refresh.owl.carousel');
+        if (data.next_url) {
+            button.data('url', data.next_url);
+        } else {
+            button.remove();
+        }
+    });
+})
+
+function getCookie(name) {
+    var match = document.cookie.match(new RegExp('(?:^|; )' + name + '=([^;]*)'));
+    return match ? decodeURIComponent(match[1]) : null;
+}
 
+$('.product_card_basket-link[data-api]').on('click', function (event) {
+    event.preventDefault();
+    var link = $(this);
+    $.ajax({
+        url: link.data('api'),
+        method: 'POST',
+        data: {favourite: link.data('favourite') !== true},
+        headers: {'X-CSRFToken': getCookie('csrftoken')}
+    }).done(function (data) {
+        link.data('favourite', data.favourite);
+        link.find('svg').attr('fill', data.favourite ? 'red' : 'none');
+    }).fail(function () {
+        window.location = link.attr('href');
+    });
+})
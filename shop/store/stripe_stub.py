@@ -0,0 +1,101 @@
+import hashlib
+import hmac
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+from uuid import uuid4
+
+
+def sign_payload(payload, secret, timestamp=None):
+    # Заголовок Stripe-Signature, как его формирует Stripe для вебхуков
+    timestamp = timestamp or int(time.time())
+    signature = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={signature}'
+
+
+def checkout_completed_event(order_id, amount_total, event_id=None, payment_status='paid'):
+    return json.dumps({
+        'id': event_id or f'evt_test_{uuid4().hex}',
+        'object': 'event',
+        'type': 'checkout.session.completed',
+        'data': {'object': {'id': f'cs_test_{uuid4().hex}', 'object': 'checkout.session',
+                            'client_reference_id': str(order_id), 'amount_total': amount_total,
+                            'payment_status': payment_status}},
+    })
+
+
+class StripeStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        params = parse_qs(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode())
+        # Задержка имитирует сетевой обмен с настоящим Stripe
+        time.sleep(self.server.latency)
+        if self.path != '/v1/checkout/sessions':
+            return self.send_json(404, {'error': {'type': 'invalid_request_error', 'message': 'Unknown path'}})
+
+        # Как и Stripe, на повторный запрос с тем же ключом идемпотентности отдаём сохранённый ответ
+        key = self.headers.get('Idempotency-Key')
+        with self.server.lock:
+            self.server.requests.append(params)
+            self.server.idempotency_keys.append(key)
+            if key not in self.server.sessions:
+                session_id = f'cs_test_{uuid4().hex}'
+                self.server.sessions[key] = {
+                    'id': session_id,
+                    'object': 'checkout.session',
+                    'mode': params.get('mode', [''])[0],
+                    'url': f'http://{self.server.server_address[0]}:{self.server.server_port}/pay/{session_id}',
+                }
+            session = self.server.sessions[key]
+        self.send_json(200, session)
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StripeStub:
+    # Локальный сервер с API создания Checkout Session для тестов и замеров без сети
+    def __init__(self, latency=0.0):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StripeStubHandler)
+        self.server.daemon_threads = True
+        self.server.latency = latency
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.idempotency_keys = []
+        self.server.sessions = {}
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server.server_port}'
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    @property
+    def idempotency_keys(self):
+        return self.server.idempotency_keys
+
+    @property
+    def sessions(self):
+        return self.server.sessions
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
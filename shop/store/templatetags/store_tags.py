@@ -1,52 +1,71 @@
 from django import template
-from store.models import Category, FavouriteProducts
+from django.template.loader import render_to_string
+from django.utils.html import format_html, format_html_join
+from django.utils.safestring import mark_safe
+from store.cache import cached
+from store.images import RENDITIONS, get_formats, rendition_url
+from store.snapshot import lookup_categories
+from store.utils import SORTERS, get_favourite_ids
 
 register = template.Library()
 
 @register.simple_tag()
 def get_categories():
-    categories = Category.objects.all()
-    return categories
+    return lookup_categories()
 
 
 @register.simple_tag()
 def get_sorted():
-    sorters = [
-        {
-            'title': 'По цене',
-            'sorters': [
-                ['price', 'По возрастанию'],
-                ['-price', 'По убыванию']
-            ]
-        },
-        {
-            'title': 'По цвету/материалу',
-            'sorters': [
-                ['colour', 'От А до Я'],
-                ['-colour', 'От Я до А']
-            ]
-        },
-        {
-            'title': 'По размеру',
-            'sorters': [
-                ['size', 'По возрастанию'],
-                ['-size', 'По убыванию']
-            ]
-        },
-        {
-            'title': 'По названию',
-            'sorters': [
-                ['title', 'От А до Я'],
-                ['-title', 'От Я до А']
-            ]
-        }
-    ]
-    return sorters
+    return SORTERS
 
 
 @register.simple_tag()
-def get_favourite_products(user):
-    favs = FavouriteProducts.objects.filter(user=user)
-    products = [i.product for i in favs]
-    return products
+def sort_url(request, sort):
+    # Фильтры сохраняются, постраничный курсор сбрасывается
+    query = request.GET.copy()
+    for key in ('after', 'before'):
+        query.pop(key, None)
+    query['sort'] = sort
+    return f'?{query.urlencode()}'
 
+
+@register.simple_tag()
+def get_favourite_products(request):
+    return get_favourite_ids(request)
+
+
+def picture(name, has_renditions, rendition, css_class, alt, fallback):
+    width = RENDITIONS[rendition]
+    img = format_html('<img class="{}" src="{}" width="{}" alt="{}" loading="lazy">', css_class, fallback, width, alt)
+    if not has_renditions:
+        return img
+
+    widths = sorted(set(RENDITIONS.values()))
+    sizes = f'(max-width: {width}px) 100vw, {width}px'
+    sources = format_html_join('', '<source type="image/{}" srcset="{}" sizes="{}">', (
+        (fmt.lower(), ', '.join(f'{rendition_url(name, w, fmt)} {w}w' for w in widths), sizes)
+        for fmt in get_formats()
+    ))
+    return format_html('<picture>{}{}</picture>', sources, img)
+
+
+@register.simple_tag()
+def product_image(product, rendition='card', css_class=''):
+    return picture(product.primary_image.name, product.has_renditions, rendition, css_class,
+                   product.title, product.get_first_photo())
+
+
+@register.simple_tag()
+def gallery_image(image, rendition='detail', css_class=''):
+    if not image.photo:
+        return ''
+    return picture(image.photo.name, image.has_renditions, rendition, css_class, '', image.photo.url)
+
+
+@register.simple_tag()
+def product_card_detail(product):
+    # Ключ меняется вместе с updated_at и готовностью размеров фото - сбрасывать вручную не нужно
+    html = cached('product_card', [], lambda: render_to_string('store/components/_product_card_detail.html',
+                                                              {'product': product}),
+                  product.pk, product.updated_at.timestamp(), product.has_renditions)
+    return mark_safe(html)
@@ -0,0 +1,20 @@
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+from .cache import reset_stats
+
+
+class StoreTestRunner(DiscoverRunner):
+    # Тесты чистят кэш в setUp: у них свой кэш в памяти, рабочий кэш на диске (CACHES) не трогается
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.cache_settings = override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'store-tests'}
+        })
+        self.cache_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        # Несброшенные счётчики тестов не должны уйти в рабочий кэш при выходе
+        reset_stats()
+        self.cache_settings.disable()
+        super().teardown_test_environment(**kwargs)
@@ -1,3 +1,1290 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from decimal import Decimal
+from importlib import import_module
+from io import BytesIO, StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from PIL import Image
+from django.apps import apps
+from django.contrib import admin
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import connection, IntegrityError, OperationalError
+from django.db.models.query import QuerySet
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import User
+from django.urls import reverse
+from django.utils import timezone
+
+from .admin import ProductAdmin
+from .benchmarks import compare_results, delete_dataset, generate_dataset, run_scenarios
+from .cache import get_stats, reset_stats
+from .favourites import fcntl, get_buffer, reset_buffer
+from .feeds import export_rows, import_feed, read_rows, write_rows
+from .images import PREVIEW_FORMAT, RENDITIONS, generate_renditions, get_formats, rendition_path
+from .metrics import reset_metrics
+from .payments import get_gateway, reset_gateway
+from .models import (Category, CategoryFacet, Product, Gallery, FavouriteProducts, Customer, Order, OrderProduct,
+                     RelatedProducts, PaymentEvent, Review, to_money)
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.exceptions import ImproperlyConfigured
+
+from .recommendations import get_random_products
+from .search import rebuild_index, search_products
+from .stripe_stub import StripeStub, checkout_completed_event, sign_payload
+from .snapshot import build_snapshot, get_snapshot, load_snapshot, lookup_product_id, unload_snapshot
+from .utils import CartForAuthenticatedUser, CartForAnonymousUser, encode_cursor, recount_reviews
+from .webhooks import process_events
+
+
+def create_catalogue(categories=2, products=4):
+    data = []
+    start = Category.objects.count()
+    for i in range(start, start + categories):
+        category = Category.objects.create(title=f'Категория {i}', slug=f'category-{i}',
+                                           image='categories/test.png')
+        for j in range(products):
+            Product.objects.create(title=f'Товар {i}-{j}', slug=f'product-{i}-{j}', price=10 + j,
+                                   quantity=5, category=category)
+        data.append(category)
+    return data
+
+
+class FavouriteProductsQueriesTest(TestCase):
+    def setUp(self):
+        self.categories = create_catalogue()
+        self.user = User.objects.create_user(username='buyer', password='password')
+
+    def count_favourite_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len([q for q in ctx.captured_queries if 'store_favouriteproducts' in q['sql']])
+
+    def test_anonymous_pages_do_not_query_favourites(self):
+        self.assertEqual(self.count_favourite_queries(reverse('product_list')), 0)
+        url = reverse('category', kwargs={'slug': self.categories[0].slug})
+        self.assertEqual(self.count_favourite_queries(url), 0)
+
+    def test_one_favourites_query_per_page(self):
+        self.client.force_login(self.user)
+        for product in Product.objects.all():
+            FavouriteProducts.objects.create(user=self.user, product=product)
+
+        self.assertEqual(self.count_favourite_queries(reverse('product_list')), 1)
+        url = reverse('category', kwargs={'slug': self.categories[0].slug})
+        self.assertEqual(self.count_favourite_queries(url), 1)
+
+    def test_favourite_card_is_marked(self):
+        self.client.force_login(self.user)
+        product = self.categories[0].products.first()
+        self.client.get(reverse('save_or_del', kwargs={'product__slug': product.slug}))
+        self.assertTrue(FavouriteProducts.objects.filter(user=self.user, product=product).exists())
+
+        response = self.client.get(reverse('category', kwargs={'slug': self.categories[0].slug}))
+        self.assertContains(response, 'fill="red"', count=1)
+
+        self.client.get(reverse('save_or_del', kwargs={'product__slug': product.slug}))
+        self.assertFalse(FavouriteProducts.objects.filter(user=self.user, product=product).exists())
+
+
+class FavouritesApiTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.products = list(create_catalogue(categories=1, products=4)[0].products.order_by('pk'))
+        self.user = User.objects.create_user(username='buyer', password='password')
+        self.client.force_login(self.user)
+        self.addCleanup(reset_buffer)
+
+    def click(self, product, state=None):
+        data = {} if state is None else {'favourite': state}
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse('favourite_api', kwargs={'product__slug': product.slug}), data)
+        self.assertEqual(response.status_code, 200)
+        writes = [q['sql'] for q in ctx.captured_queries
+                  if 'store_favouriteproducts' in q['sql'] and not q['sql'].startswith('SELECT')]
+        return response.json()['favourite'], writes
+
+    def test_known_state_is_one_statement(self):
+        product = self.products[0]
+        for state, expected in (('true', True), ('true', True), ('false', False)):
+            favourite, writes = self.click(product, state)
+            self.assertEqual(favourite, expected)
+            self.assertEqual(len(writes), 1)
+            self.assertEqual(FavouriteProducts.objects.filter(user=self.user).count(), int(expected))
+
+        self.assertEqual([self.click(product)[0] for i in range(3)], [True, False, True])
+        with self.assertRaises(IntegrityError):
+            FavouriteProducts.objects.create(user=self.user, product=product)
+
+    def test_redirect_toggle_and_anonymous(self):
+        product = self.products[1]
+        self.client.get(reverse('save_or_del', kwargs={'product__slug': product.slug}))
+        self.assertContains(self.client.get(reverse('favourite')), product.get_absolute_url())
+
+        self.client.logout()
+        response = self.client.post(reverse('favourite_api', kwargs={'product__slug': product.slug}))
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(STORE_FAVOURITES_WRITE_BEHIND=True, STORE_FAVOURITES_BATCH_SIZE=3,
+                       STORE_FAVOURITES_FLUSH_INTERVAL=60,
+                       STORE_FAVOURITES_LOCK_PATH=os.path.join(tempfile.gettempdir(), 'store-favourites-test.lock'))
+    def test_write_behind_absorbs_bursts(self):
+        reset_buffer()
+        product = self.products[0]
+        # Серия кликов по одному товару - ни одной записи, а страница уже видит итог
+        for i in range(5):
+            self.assertEqual(self.click(product)[1], [])
+        self.assertFalse(FavouriteProducts.objects.exists())
+        self.assertContains(self.client.get(reverse('favourite')), product.get_absolute_url())
+
+        self.assertEqual(get_buffer().flush(), 1)
+        self.assertEqual(list(FavouriteProducts.objects.values_list('product_id', flat=True)), [product.pk])
+
+        # Буфер из трёх изменений записывается сам, пачкой
+        self.click(self.products[0], 'false')
+        self.click(self.products[1], 'true')
+        with CaptureQueriesContext(connection) as ctx:
+            self.click(self.products[2], 'true')
+        self.assertEqual(set(FavouriteProducts.objects.values_list('product_id', flat=True)),
+                         {self.products[1].pk, self.products[2].pk})
+        self.assertEqual(len([q for q in ctx.captured_queries if 'store_favouriteproducts' in q['sql']
+                              and not q['sql'].startswith('SELECT')]), 2)
+
+
+    @unittest.skipIf(fcntl is None, 'нет fcntl')
+    def test_write_behind_requires_single_worker(self):
+        path = os.path.join(tempfile.gettempdir(), 'store-favourites-test.lock')
+        reset_buffer()
+        self.addCleanup(reset_buffer)
+        with override_settings(STORE_FAVOURITES_WRITE_BEHIND=True, STORE_FAVOURITES_LOCK_PATH=path):
+            # Буфер уже открыт другим воркером
+            with open(path, 'a') as other:
+                fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                with self.assertRaises(ImproperlyConfigured):
+                    get_buffer()
+            self.assertIsNotNone(get_buffer())
+
+
+class CatalogueQueriesTest(TestCase):
+    def get_home_page_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('product_list'))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_home_page_queries_do_not_grow_with_categories(self):
+        create_catalogue(categories=1, products=2)
+        queries = self.get_home_page_queries()
+
+        for category in create_catalogue(categories=4, products=6):
+            Gallery.objects.create(product=category.products.first(), photo='products/test.jpg')
+        self.assertEqual(self.get_home_page_queries(), queries)
+
+    def test_four_products_per_category(self):
+        categories = create_catalogue(categories=2, products=6)
+        response = self.client.get(reverse('product_list'))
+        for block, category in zip(response.context['categories'], categories):
+            self.assertEqual(block['title'], category)
+            self.assertEqual([p.pk for p in block['products']],
+                             list(category.products.order_by('pk').values_list('pk', flat=True)[:4]))
+
+
+class PrimaryImageTest(TestCase):
+    def setUp(self):
+        self.category = create_catalogue(categories=1, products=2)[0]
+        self.product = self.category.products.first()
+
+    def test_primary_image_follows_gallery(self):
+        first = Gallery.objects.create(product=self.product, photo='products/first.jpg')
+        Gallery.objects.create(product=self.product, photo='products/second.jpg')
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.primary_image.name, 'products/first.jpg')
+
+        first.delete()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.primary_image.name, 'products/second.jpg')
+
+        self.product.images.all().delete()
+        self.product.refresh_from_db()
+        self.assertFalse(self.product.primary_image)
+
+    def test_cards_do_not_query_gallery(self):
+        Gallery.objects.create(product=self.product, photo='products/first.jpg')
+        url = reverse('category', kwargs={'slug': self.category.slug})
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertContains(response, '/media/products/first.jpg')
+        self.assertFalse([q for q in ctx.captured_queries if 'store_gallery' in q['sql']])
+
+
+class RenditionsTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings = override_settings(MEDIA_ROOT=self.media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.product = create_catalogue(categories=1, products=1)[0].products.get()
+        buffer = BytesIO()
+        Image.new('RGB', (1200, 600), 'gold').save(buffer, 'JPEG')
+        self.image = Gallery.objects.create(product=self.product,
+                                            photo=SimpleUploadedFile('ring.jpg', buffer.getvalue()))
+
+    def test_renditions_are_generated_in_every_format(self):
+        name = self.image.photo.name
+        generate_renditions(name)
+
+        for width in RENDITIONS.values():
+            for fmt in get_formats():
+                with default_storage.open(rendition_path(name, width, fmt)) as file:
+                    self.assertEqual(Image.open(file).size, (width, width // 2))
+        self.image.refresh_from_db()
+        self.product.refresh_from_db()
+        self.assertTrue(self.image.has_renditions)
+        self.assertTrue(self.product.has_renditions)
+
+    def test_card_uses_srcset_once_ready(self):
+        url = reverse('category', kwargs={'slug': self.product.category.slug})
+        self.assertNotContains(self.client.get(url), 'srcset')
+
+        generate_renditions(self.image.photo.name)
+        response = self.client.get(url)
+        self.assertContains(response, '<source type="image/webp"')
+        self.assertContains(response, rendition_path(self.image.photo.name, RENDITIONS['card'], 'WEBP'))
+
+    def test_original_is_capped_and_admin_uses_preview_format(self):
+        # Оригинал 1200x600 хранится не больше самого крупного размера
+        with self.image.photo.open() as file:
+            self.assertEqual(Image.open(file).size, (RENDITIONS['detail'], RENDITIONS['detail'] // 2))
+
+        generate_renditions(self.image.photo.name)
+        self.product.refresh_from_db()
+        self.assertIn(rendition_path(self.image.photo.name, RENDITIONS['thumb'], PREVIEW_FORMAT),
+                      ProductAdmin(Product, admin.site).get_photo(self.product))
+
+
+class FeedsTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.images_dir = tempfile.mkdtemp()
+        for directory in (self.media_root, self.images_dir):
+            self.addCleanup(shutil.rmtree, directory)
+        settings = override_settings(MEDIA_ROOT=self.media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        Image.new('RGB', (800, 400), 'gold').save(f'{self.images_dir}/ring.jpg', 'JPEG')
+
+    def import_csv(self, content, **kwargs):
+        return import_feed(read_rows(StringIO(content), 'csv'), images_dir=self.images_dir, workers=0, **kwargs)
+
+    def test_import_upserts_products_and_images(self):
+        with self.assertLogs('store.feeds', 'WARNING'):
+            stats = self.import_csv(
+                'title,price,quantity,category,images\n'
+                'Золотое кольцо,100,3,Кольца,ring.jpg|missing.jpg\n'
+                'Серебряная цепочка,50,1,Цепочки,\n'
+                'Без цены,,1,Кольца,\n'
+            )
+        self.assertEqual((stats['rows'], stats['products'], stats['categories'], stats['images'], stats['skipped'],
+                          stats['missing_images'], stats['renditions']), (3, 2, 2, 1, 1, 1, 1))
+        product = Product.objects.get(slug='zolotoe-kolco')
+        self.assertEqual(product.category.slug, 'kolca')
+        self.assertEqual(product.primary_image.name, 'products/ring.jpg')
+        self.assertTrue(product.has_renditions)
+        self.assertIn(product, search_products('кольцо'))
+
+        self.import_csv('slug,title,price,quantity,category,images\n'
+                        'zolotoe-kolco,Золотое кольцо,120,7,Кольца,ring.jpg\n')
+        product.refresh_from_db()
+        self.assertEqual((product.price, product.quantity), (120, 7))
+        self.assertEqual(Product.objects.count(), 2)
+        self.assertEqual(product.images.count(), 1)
+
+    def test_queries_do_not_grow_with_batch(self):
+        def count_queries(rows):
+            content = 'title,price,quantity,category\n' + ''.join(
+                f'Товар {rows}-{i},10,1,Категория {rows}-{i % 3}\n' for i in range(rows))
+            with CaptureQueriesContext(connection) as ctx:
+                self.import_csv(content, batch_size=100)
+            return len(ctx.captured_queries)
+
+        self.assertEqual(count_queries(5), count_queries(50))
+
+    def test_export_round_trip(self):
+        self.import_csv('title,price,quantity,category,images\nЗолотое кольцо,100,3,Кольца,ring.jpg\n')
+        output = StringIO()
+        self.assertEqual(write_rows(export_rows(), output, 'jsonl'), 1)
+        row = json.loads(output.getvalue())
+        self.assertEqual((row['slug'], row['category_slug'], row['images']),
+                         ('zolotoe-kolco', 'kolca', ['products/ring.jpg']))
+
+        csv_output = StringIO()
+        write_rows(export_rows(), csv_output, 'csv')
+        self.assertIn('products/ring.jpg', csv_output.getvalue())
+        stats = import_feed(read_rows(StringIO(output.getvalue()), 'jsonl'), workers=0)
+        self.assertEqual((stats['products'], stats['images'], stats['categories']), (1, 0, 0))
+        self.assertEqual(Product.objects.count(), 1)
+
+    def test_unsafe_rows_are_rejected(self):
+        secret = tempfile.NamedTemporaryFile(suffix='.jpg', delete=False)
+        self.addCleanup(os.remove, secret.name)
+        Category.objects.create(title='Кольца', slug='kolca', image='categories/test.png')
+        with self.assertLogs('store.feeds', 'WARNING'):
+            stats = self.import_csv(
+                'title,price,quantity,category,images\n'
+                f'Кольцо,100,3,КОЛЬЦА,{secret.name}|../{os.path.basename(self.images_dir)}/ring.jpg\n'
+                'Цепочка,nan,1,Цепочки,\n'
+                'Браслет,inf,1,Цепочки,\n'
+            )
+        self.assertEqual((stats['products'], stats['categories'], stats['skipped'], stats['missing_images']),
+                         (1, 0, 2, 1))
+        self.assertFalse(default_storage.exists(f'products/{os.path.basename(secret.name)}'))
+        # Ссылка ../ обратно в каталог поставщика безопасна
+        self.assertEqual(stats['images'], 1)
+        self.assertEqual(Category.objects.get(slug='kolca').title, 'Кольца')
+
+
+class CartTest(TestCase):
+    def setUp(self):
+        self.product = create_catalogue(categories=1, products=1)[0].products.get()
+        self.user = User.objects.create_user(username='buyer', password='password')
+        self.cart = CartForAuthenticatedUser(RequestStub(self.user))
+        self.order = self.cart.get_order()
+
+    def test_add_and_delete(self):
+        for i in range(3):
+            self.cart.add_or_delete(self.product.pk, 'add')
+        self.cart.add_or_delete(self.product.pk, 'delete')
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 3)
+        self.assertEqual(self.order.orderproduct_set.get().quantity, 2)
+
+        self.cart.add_or_delete(self.product.pk, 'delete')
+        self.cart.add_or_delete(self.product.pk, 'delete')
+        self.assertFalse(self.cart.add_or_delete(self.product.pk, 'delete'))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 5)
+        self.assertFalse(self.order.orderproduct_set.exists())
+
+    def test_add_out_of_stock(self):
+        Product.objects.filter(pk=self.product.pk).update(quantity=0)
+        self.assertFalse(self.cart.add_or_delete(self.product.pk, 'add'))
+        self.assertFalse(self.order.orderproduct_set.exists())
+
+    def test_add_queries(self):
+        self.cart.add_or_delete(self.product.pk, 'add')
+        self.cart.get_order = lambda: self.order
+        with CaptureQueriesContext(connection) as ctx:
+            self.cart.add_or_delete(self.product.pk, 'add')
+        self.assertEqual(len([q for q in ctx.captured_queries if 'SAVEPOINT' not in q['sql']]), 2)
+
+
+class CartTotalsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='password')
+        self.client.force_login(self.user)
+        self.cart = CartForAuthenticatedUser(RequestStub(self.user))
+        self.products = list(create_catalogue(categories=1, products=6)[0].products.all())
+
+    def get_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_totals(self):
+        self.cart.add_or_delete(self.products[0].pk, 'add')
+        self.cart.add_or_delete(self.products[0].pk, 'add')
+        self.cart.add_or_delete(self.products[1].pk, 'add')
+        order = self.cart.get_order()
+        with self.assertNumQueries(1):
+            self.assertEqual(order.get_cart_total_quantity, 3)
+            self.assertEqual(order.get_cart_total_price, 10 * 2 + 11)
+
+    def test_cart_and_checkout_queries_do_not_grow_with_lines(self):
+        self.cart.add_or_delete(self.products[0].pk, 'add')
+        self.client.get(reverse('cart'))
+        queries = {url: self.get_queries(url) for url in (reverse('cart'), reverse('checkout'))}
+
+        for product in self.products[1:]:
+            self.cart.add_or_delete(product.pk, 'add')
+        for url, count in queries.items():
+            self.assertEqual(self.get_queries(url), count)
+
+
+class CartSessionTest(TestCase):
+    def setUp(self):
+        self.products = list(create_catalogue(categories=1, products=2)[0].products.all())
+        self.user = User.objects.create_user(username='buyer', password='password')
+
+    def test_order_is_found_by_session(self):
+        cart = CartForAuthenticatedUser(RequestStub(self.user))
+        order = cart.get_order()
+        with self.assertNumQueries(1):
+            self.assertEqual(cart.get_order(), order)
+
+        cart.clear()
+        self.assertNotIn(CartForAuthenticatedUser.session_key, cart.session)
+        Order.objects.filter(pk=order.pk).update(is_completed=True)
+        cart.session[CartForAuthenticatedUser.session_key] = order.pk
+        self.assertNotEqual(cart.get_order(), order)
+
+    def test_guest_cart_lives_in_session(self):
+        for product in (self.products[0], self.products[0], self.products[1]):
+            self.client.get(reverse('to_cart', kwargs={'product_id': product.pk, 'action': 'add'}))
+        self.assertFalse(Customer.objects.exists())
+
+        response = self.client.get(reverse('cart'))
+        self.assertEqual(response.context['order'].get_cart_total_quantity, 3)
+        self.assertEqual(response.context['order'].get_cart_total_price, 10 * 2 + 11)
+
+        self.client.post(reverse('login'), {'username': 'buyer', 'password': 'password'})
+        order = Order.objects.get(customer__user=self.user)
+        self.assertEqual(order.get_cart_total_quantity, 3)
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).quantity, 3)
+        self.assertNotIn(CartForAnonymousUser.session_key, self.client.session)
+
+
+class AsyncCheckoutTest(TestCase):
+    def setUp(self):
+        self.products = list(create_catalogue(categories=1, products=2)[0].products.all())
+        self.user = User.objects.create_user(username='buyer', password='password')
+        cart = CartForAuthenticatedUser(RequestStub(self.user))
+        for product in (self.products[0], self.products[0], self.products[1]):
+            cart.add_or_delete(product.pk, 'add')
+        self.client.force_login(self.user)
+        self.async_client.force_login(self.user)
+        self.stub = StripeStub(latency=0.3).__enter__()
+        cache.clear()
+        reset_gateway()
+        self.settings = override_settings(STRIPE_API_BASE=self.stub.url)
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        reset_gateway()
+        self.stub.__exit__()
+
+    def test_cart_and_checkout_pages(self):
+        for name in ('cart', 'checkout'):
+            response = self.client.get(reverse(name))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.context['order'].get_cart_total_quantity, 3)
+            self.assertEqual(response.context['order'].get_cart_total_price, 10 * 2 + 11)
+
+        self.client.logout()
+        self.assertRedirects(self.client.get(reverse('checkout')), reverse('login_registration'),
+                             fetch_redirect_response=False)
+
+    def test_checkout_session_is_created_in_stub(self):
+        response = self.client.post(reverse('payment'))
+        self.assertEqual(response.status_code, 303)
+        self.assertTrue(response['Location'].startswith(f'{self.stub.url}/pay/cs_test_'))
+        params = self.stub.requests[0]
+        self.assertEqual(params['line_items[0][price_data][unit_amount]'], ['3100'])
+        self.assertEqual(params['line_items[0][quantity]'], ['1'])
+
+    def test_double_click_reuses_session(self):
+        first = self.client.post(reverse('payment'))['Location']
+        self.assertEqual(self.client.post(reverse('payment'))['Location'], first)
+        self.assertEqual(len(self.stub.requests), 1)
+
+        # Кэш потерян - Stripe узнаёт повтор по ключу идемпотентности
+        cache.clear()
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.post(reverse('payment'))['Location'], first)
+        self.assertEqual(len(set(self.stub.idempotency_keys)), 1)
+
+        self.client.get(reverse('to_cart', kwargs={'product_id': self.products[1].pk, 'action': 'add'}))
+        self.assertNotEqual(self.client.post(reverse('payment'))['Location'], first)
+        self.assertEqual(self.stub.requests[-1]['line_items[0][price_data][unit_amount]'], ['4200'])
+
+    def test_price_change_creates_new_session(self):
+        first = self.client.post(reverse('payment'))['Location']
+        Product.objects.filter(pk=self.products[0].pk).update(price=20)
+        self.assertNotEqual(self.client.post(reverse('payment'))['Location'], first)
+        self.assertEqual(self.stub.requests[-1]['line_items[0][price_data][unit_amount]'], ['5100'])
+        self.assertEqual(len(set(self.stub.idempotency_keys)), 2)
+
+    def test_get_empty_cart_and_unavailable_stripe(self):
+        self.assertRedirects(self.client.get(reverse('payment')), reverse('checkout'), fetch_redirect_response=False)
+
+        with override_settings(STRIPE_API_BASE='http://127.0.0.1:9', STRIPE_MAX_RETRIES=0):
+            reset_gateway()
+            response = self.client.post(reverse('payment'))
+        self.assertRedirects(response, reverse('checkout'), fetch_redirect_response=False)
+
+        CartForAuthenticatedUser(RequestStub(self.user)).clear()
+        self.assertRedirects(self.client.post(reverse('payment')), reverse('cart'), fetch_redirect_response=False)
+
+    def test_reset_shuts_down_thread_pool(self):
+        executor = get_gateway().executor
+        reset_gateway()
+        with self.assertRaises(RuntimeError):
+            executor.submit(print)
+
+    async def test_concurrent_checkouts_do_not_wait_for_each_other(self):
+        started = time.perf_counter()
+        responses = await asyncio.gather(*[self.async_client.post(reverse('payment')) for i in range(5)])
+        # Пять запросов по 0.3 с к Stripe идут одновременно, а не друг за другом
+        self.assertLess(time.perf_counter() - started, 1.2)
+        self.assertEqual([response.status_code for response in responses], [303] * 5)
+
+
+class StripeWebhookTest(TestCase):
+    def setUp(self):
+        self.product = create_catalogue(categories=1, products=1)[0].products.first()
+        self.user = User.objects.create_user(username='buyer', password='password')
+        self.cart = CartForAuthenticatedUser(RequestStub(self.user))
+        self.cart.add_or_delete(self.product.pk, 'add')
+        self.order = self.cart.get_order()
+        self.amount = int(to_money(self.product.price) * 100)
+
+    def post_event(self, payload, secret=settings.STRIPE_WEBHOOK_SECRET):
+        return self.client.post(reverse('stripe_webhook'), payload, content_type='application/json',
+                                HTTP_STRIPE_SIGNATURE=sign_payload(payload, secret))
+
+    def test_signature_is_verified(self):
+        payload = checkout_completed_event(self.order.pk, self.amount)
+        self.assertEqual(self.post_event(payload, secret='whsec_wrong').status_code, 400)
+        self.assertEqual(self.client.post(reverse('stripe_webhook'), payload,
+                                          content_type='application/json').status_code, 400)
+        self.assertFalse(PaymentEvent.objects.exists())
+
+    def test_events_are_queued_once_and_processed_in_batch(self):
+        payload = checkout_completed_event(self.order.pk, self.amount)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.post_event(payload).status_code, 200)
+        # Вебхук только вставляет событие
+        self.assertEqual([q['sql'].split()[0] for q in ctx.captured_queries if 'store_' in q['sql']], ['INSERT'])
+        self.post_event(payload)
+        self.post_event(checkout_completed_event(self.order.pk, self.amount, payment_status='unpaid'))
+        self.assertEqual(PaymentEvent.objects.count(), 2)
+        self.assertFalse(Order.objects.get(pk=self.order.pk).is_completed)
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(process_events(), (2, 1))
+        # события, открытые заказы, суммы корзин, пустые строки, цены строк, заказы, отметка событий
+        self.assertEqual(len([q for q in ctx.captured_queries if 'store_' in q['sql']]), 7)
+        self.assertTrue(Order.objects.get(pk=self.order.pk).is_completed)
+        self.assertEqual(self.order.orderproduct_set.get().price, self.product.price)
+        self.assertEqual(process_events(), (0, 0))
+        self.assertNotEqual(self.cart.get_order(), self.order)
+        self.assertEqual(self.cart.get_order().get_cart_total_quantity, 0)
+
+    def test_items_added_after_payment_are_not_completed(self):
+        # Оплачена старая сессия, а в открытую корзину успели добавить ещё товар
+        self.post_event(checkout_completed_event(self.order.pk, self.amount))
+        self.cart.add_or_delete(self.product.pk, 'add')
+        with self.assertLogs('store.webhooks', 'WARNING'):
+            self.assertEqual(process_events(), (1, 0))
+        self.assertFalse(Order.objects.get(pk=self.order.pk).is_completed)
+        event = PaymentEvent.objects.get()
+        self.assertIsNotNone(event.processed_at)
+        self.assertNotEqual(event.error, '')
+        self.assertEqual(process_events(), (0, 0))
+
+    def test_repeated_event_for_completed_order_is_not_flagged(self):
+        self.post_event(checkout_completed_event(self.order.pk, self.amount))
+        self.assertEqual(process_events(), (1, 1))
+        # Повтор того же платежа приходит, когда корзина уже закрыта
+        self.post_event(checkout_completed_event(self.order.pk, self.amount))
+        with self.assertNoLogs('store.webhooks', 'WARNING'):
+            self.assertEqual(process_events(), (1, 0))
+        self.assertFalse(PaymentEvent.objects.exclude(error='').exists())
+        self.assertFalse(PaymentEvent.objects.filter(processed_at__isnull=True).exists())
+
+    def test_success_page_does_not_touch_cart(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('successPayment'))
+        self.assertFalse(Order.objects.get(pk=self.order.pk).is_completed)
+        self.assertEqual(self.order.orderproduct_set.count(), 1)
+
+
+class CartFinalizeTest(TestCase):
+    def setUp(self):
+        self.products = list(create_catalogue(categories=1, products=4)[0].products.all())
+        self.user = User.objects.create_user(username='buyer', password='password')
+        self.cart = CartForAuthenticatedUser(RequestStub(self.user))
+
+    def fill(self, products):
+        for product in products:
+            self.cart.add_or_delete(product.pk, 'add')
+        return self.cart.get_order()
+
+    def count_queries(self, action):
+        with CaptureQueriesContext(connection) as ctx:
+            action()
+        return len([q for q in ctx.captured_queries if 'store_' in q['sql']])
+
+    def test_clear_returns_stock_with_constant_queries(self):
+        self.fill(self.products[:1])
+        small = self.count_queries(self.cart.clear)
+        order = self.fill(self.products + self.products[:2])
+        self.assertEqual(self.count_queries(self.cart.clear), small)
+
+        self.assertFalse(order.orderproduct_set.exists())
+        self.assertEqual([p.quantity for p in Product.objects.filter(pk__in=[p.pk for p in self.products])],
+                         [5, 5, 5, 5])
+
+    def test_complete_snapshots_prices(self):
+        order = self.fill(self.products[:2] + self.products[:1])
+        self.cart.add_or_delete(self.products[1].pk, 'delete')
+        OrderProduct.objects.create(order=order, product=self.products[2], quantity=0)
+        self.assertEqual(self.count_queries(self.cart.complete), 4)
+
+        Product.objects.filter(pk=self.products[0].pk).update(price=999)
+        order = Order.objects.get(pk=order.pk)
+        self.assertTrue(order.is_completed)
+        self.assertEqual([(line.product_id, line.quantity, line.price) for line in order.orderproduct_set.all()],
+                         [(self.products[0].pk, 2, self.products[0].price)])
+        self.assertNotEqual(self.cart.get_order(), order)
+        # Остатки уже зарезервированы корзиной и при закрытии заказа не меняются
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).quantity, 3)
+
+    def test_completed_order_totals_are_stored_in_decimal(self):
+        Product.objects.filter(pk=self.products[0].pk).update(price=0.1)
+        order = self.fill(self.products[:1] * 3 + self.products[1:2])
+        self.assertEqual(order.get_cart_total_price, Decimal('11.30'))
+        self.cart.complete()
+
+        Product.objects.update(price=999)
+        order = Order.objects.get(pk=order.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual((order.get_cart_total_quantity, order.get_cart_total_price), (4, Decimal('11.30')))
+        lines = order.orderproduct_set.order_by('pk')
+        with self.assertNumQueries(1):
+            self.assertEqual([line.get_total_price for line in lines], [Decimal('0.30'), Decimal('11.00')])
+
+    def test_concurrent_first_add_keeps_one_line(self):
+        product = self.products[0]
+        order = self.cart.get_order()
+        OrderProduct.objects.create(order=order, product=product, quantity=1)
+        update = QuerySet.update
+
+        def update_before_other_request(queryset, **kwargs):
+            # Первый UPDATE строки прошёл до того, как параллельный запрос вставил её
+            if queryset.model is OrderProduct and not missed:
+                missed.append(queryset)
+                return 0
+            return update(queryset, **kwargs)
+
+        missed = []
+        with mock.patch.object(QuerySet, 'update', autospec=True, side_effect=update_before_other_request):
+            self.assertTrue(self.cart.add_or_delete(product.pk, 'add'))
+        self.assertEqual(len(missed), 1)
+        self.assertEqual(list(order.orderproduct_set.values_list('quantity', flat=True)), [2])
+        self.assertEqual(Product.objects.get(pk=product.pk).quantity, 4)
+
+    def test_backfill_of_existing_orders(self):
+        order = self.fill(self.products[:2])
+        Order.objects.filter(pk=order.pk).update(is_completed=True)
+        migration = import_module('store.migrations.0015_order_money')
+        migration.backfill_money(apps, None)
+
+        order = Order.objects.get(pk=order.pk)
+        self.assertEqual((order.total_quantity, order.total_price), (2, Decimal('21.00')))
+        self.assertEqual(sorted(order.orderproduct_set.values_list('price', flat=True)), [10, 11])
+
+
+class RandomProductsTest(TestCase):
+    def test_same_category_first_without_current_product(self):
+        small, large = create_catalogue(categories=2, products=3)
+        product = small.products.first()
+        for i in range(20):
+            products = get_random_products(product)
+            self.assertEqual(len(products), 4)
+            self.assertEqual(len(set(products)), 4)
+            self.assertNotIn(product, products)
+            self.assertEqual(len([p for p in products if p.category_id == small.pk]), 2)
+
+    def test_new_products_are_sampled(self):
+        category = create_catalogue(categories=1, products=1)[0]
+        product = category.products.get()
+        self.assertEqual(get_random_products(product), [])
+        other = Product.objects.create(title='Новый', slug='new', price=1, quantity=1, category=category)
+        self.assertEqual(get_random_products(product), [other])
+
+
+class RelatedProductsTest(TestCase):
+    def test_related_products_from_orders_and_favourites(self):
+        ring, chain, watch, bracelet, earrings = create_catalogue(categories=1, products=5)[0].products.order_by('pk')
+        for i, basket in enumerate([(ring, chain), (ring, chain, watch), (ring, watch)]):
+            order = Order.objects.create()
+            for product in basket:
+                OrderProduct.objects.create(order=order, product=product, quantity=1)
+        user = User.objects.create_user(username='buyer', password='password')
+        for product in (ring, bracelet):
+            FavouriteProducts.objects.create(user=user, product=product)
+
+        call_command('build_recommendations', stdout=StringIO())
+        self.assertEqual(RelatedProducts.objects.get(pk=ring.pk).product_ids, [chain.pk, watch.pk, bracelet.pk])
+
+        response = self.client.get(ring.get_absolute_url())
+        self.assertEqual(response.context['products'][:3], [chain, watch, bracelet])
+        self.assertEqual(response.context['products'][3], earrings)
+
+
+class ReviewsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.product, self.other = create_catalogue(categories=1, products=2)[0].products.order_by('pk')
+        authors = User.objects.bulk_create([User(username=f'author-{i}') for i in range(25)])
+        Review.objects.bulk_create([Review(product=self.product, author=author, text=f'Отзыв {i}')
+                                    for i, author in enumerate(authors)])
+        Review.objects.create(product=self.other, author=authors[0], text='Отзыв')
+        # Одинаковое время у части отзывов: порядок внутри держится на id
+        Review.objects.filter(pk__in=Review.objects.order_by('pk').values('pk')[5:15]).update(
+            created_at=timezone.now())
+        recount_reviews()
+        self.user = User.objects.create_user(username='buyer', password='password')
+        self.client.force_login(self.user)
+
+    def get_queries(self, product):
+        # Первый запрос заполняет кэш меню и карточек, считается второй
+        self.client.get(product.get_absolute_url())
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(product.get_absolute_url())
+        return response, len(ctx.captured_queries)
+
+    def test_product_page_shows_first_page(self):
+        response, queries = self.get_queries(self.product)
+        expected = list(Review.objects.filter(product=self.product).order_by('-created_at', '-pk')[:10])
+        self.assertEqual(response.context['reviews'], expected)
+        self.assertContains(response, 'CUSTOMER REVIEWS (25)')
+        self.assertIn('reviews_next_url', response.context)
+        # Авторы приходят тем же запросом: страница с 25 отзывами стоит столько же запросов, сколько с одним
+        self.assertEqual(queries, self.get_queries(self.other)[1])
+
+    def test_load_more_walks_all_reviews(self):
+        url = self.client.get(self.product.get_absolute_url()).context['reviews_next_url']
+        seen = 10
+        while url:
+            data = self.client.get(url).json()
+            seen += data['html'].count('customer_reviews-slider_block')
+            url = data['next_url']
+        self.assertEqual(seen, 25)
+
+        reviews_url = reverse('product_reviews', kwargs={'slug': self.product.slug})
+        self.assertEqual(self.client.get(reviews_url, {'after': 'broken'}).status_code, 400)
+        for created_at in ('garbage', 5):
+            cursor = encode_cursor(SimpleNamespace(created_at=created_at, pk=1), 'created_at')
+            self.assertEqual(self.client.get(reviews_url, {'after': cursor}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('product_reviews', kwargs={'slug': 'missing'})).status_code, 404)
+
+    def test_save_review_updates_summary(self):
+        url = reverse('save_review', kwargs={'product_slug': self.other.slug})
+        for rating in ('4', '5', ''):
+            self.client.post(url, {'text': 'Отлично', 'rating': rating})
+        self.other.refresh_from_db()
+        self.assertEqual((self.other.review_count, self.other.rating_count, self.other.average_rating), (4, 2, 4.5))
+        self.assertContains(self.client.get(self.other.get_absolute_url()), '4,5/5')
+
+        Product.objects.update(review_count=0, rating_count=0, rating_sum=0)
+        recount_reviews()
+        self.other.refresh_from_db()
+        self.assertEqual((self.other.review_count, self.other.rating_sum), (4, 9))
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(title='Браслеты', slug='bracelets', image='categories/test.png')
+        self.ring = Product.objects.create(title='Золотое кольцо', slug='ring', price=100, quantity=1,
+                                           category=self.category, colour='Золото')
+        self.chain = Product.objects.create(title='Цепочка', slug='chain', price=50, quantity=1,
+                                            category=self.category, colour='Серебро')
+
+    def search(self, query):
+        return list(self.client.get(reverse('search'), {'q': query}).context['products'])
+
+    def test_search_by_fields_and_word_forms(self):
+        self.assertEqual(self.search('кольца'), [self.ring])
+        self.assertEqual(self.search('серебряная цепочка'), [self.chain])
+        self.assertEqual(set(self.search('браслет')), {self.ring, self.chain})
+        self.assertEqual(self.search(''), [])
+
+    def test_index_follows_changes(self):
+        self.ring.title = 'Кулон'
+        self.ring.save()
+        self.assertEqual(self.search('кольцо'), [])
+        self.assertEqual(self.search('кулоны'), [self.ring])
+
+        self.category.title = 'Подвески'
+        self.category.save()
+        self.assertEqual(len(self.search('подвеска')), 2)
+
+        self.chain.delete()
+        self.assertEqual(self.search('цепочка'), [])
+
+    def test_best_match_ranks_first_among_many(self):
+        # Слабые совпадения раньше по rowid, сильное - последним
+        Product.objects.bulk_create([
+            Product(title=f'Товар {i}', description='длинное описание с жемчугом и другими словами ' * 5,
+                    slug=f'weak-{i}', price=10, quantity=1, category=self.category) for i in range(30)
+        ])
+        pearl = Product.objects.create(title='Жемчуг', description='Жемчуг', slug='pearl', price=10, quantity=1,
+                                       category=self.category)
+        rebuild_index()
+        self.assertEqual(search_products('жемчуг', limit=1), [pearl])
+        with self.settings(STORE_SEARCH_MAX_CANDIDATES=10):
+            self.assertNotEqual(search_products('жемчуг', limit=1), [pearl])
+
+
+class CategoryPaginationTest(TestCase):
+    def setUp(self):
+        self.category = create_catalogue(categories=1, products=0)[0]
+        for i in range(30):
+            Product.objects.create(title=f'Товар {i:02}', slug=f'product-{i}', price=i % 7, size=i % 5,
+                                   quantity=1, category=self.category)
+        self.url = reverse('category', kwargs={'slug': self.category.slug})
+
+    def walk(self, sort):
+        pages = [self.client.get(self.url, {'sort': sort})]
+        while 'next_page_url' in pages[-1].context:
+            pages.append(self.client.get(self.url + pages[-1].context['next_page_url']))
+        return pages
+
+    def test_every_sort_walks_whole_category(self):
+        for sort in ('price', '-price', 'size', '-size', 'title', '-title'):
+            pages = self.walk(sort)
+            self.assertEqual(len(pages), 3)
+            products = [p for page in pages for p in page.context['products']]
+            field = sort.lstrip('-')
+            expected = sorted(self.category.products.all(), key=lambda p: (getattr(p, field), p.pk),
+                              reverse=sort.startswith('-'))
+            self.assertEqual(products, expected)
+
+    def test_previous_page(self):
+        first, second, third = self.walk('-price')
+        response = self.client.get(self.url + third.context['previous_page_url'])
+        self.assertEqual(list(response.context['products']), list(second.context['products']))
+
+    def test_deep_page_queries(self):
+        pages = self.walk('price')
+        self.client.force_login(User.objects.create_user(username='buyer', password='password'))
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(self.url + pages[1].context['next_page_url'])
+        self.assertEqual(len([q for q in ctx.captured_queries if 'store_product' in q['sql']]), 1)
+
+    def test_unknown_sort_and_cursor_are_rejected(self):
+        self.assertEqual(self.client.get(self.url, {'sort': 'description'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'sort': 'price', 'after': 'garbage'}).status_code, 400)
+        # Значение курсора не того типа, что поле сортировки
+        for sort in ('price', 'size', '-size'):
+            cursor = encode_cursor(SimpleNamespace(**{sort.lstrip('-'): 'abc', 'pk': 1}), sort.lstrip('-'))
+            self.assertEqual(self.client.get(self.url, {'sort': sort, 'after': cursor}).status_code, 400)
+
+
+class FacetsTest(TestCase):
+    def setUp(self):
+        self.category = create_catalogue(categories=1, products=0)[0]
+        self.url = reverse('category', kwargs={'slug': self.category.slug})
+        for i, (colour, size, price) in enumerate([('Золото', 12, 40), ('Золото', 18, 120), ('Серебро', 25, 150),
+                                                   ('Серебро', 31, 900), ('Платина', 15, 1500)]):
+            Product.objects.create(title=f'Товар {i}', slug=f'product-{i}', colour=colour, size=size,
+                                   price=price, quantity=1, category=self.category)
+
+    def get_counts(self):
+        return {(f.facet, f.value): f.count for f in self.category.facets.filter(count__gt=0)}
+
+    def test_counts_follow_changes(self):
+        counts = self.get_counts()
+        self.assertEqual(counts[('colour', 'Золото')], 2)
+        self.assertEqual(counts[('size', '10')], 3)
+        self.assertEqual(counts[('price', '100')], 2)
+        self.assertEqual(counts[('price', '1000')], 1)
+
+        product = Product.objects.get(slug='product-0')
+        product.colour = 'Серебро'
+        product.price = 60
+        product.save()
+        product = Product.objects.get(slug='product-4')
+        product.delete()
+        counts = self.get_counts()
+        self.assertEqual(counts[('colour', 'Золото')], 1)
+        self.assertEqual(counts[('colour', 'Серебро')], 3)
+        self.assertEqual(counts[('price', '50')], 1)
+        self.assertNotIn(('price', '0'), counts)
+        self.assertNotIn(('colour', 'Платина'), counts)
+
+        call_command('rebuild_facets', stdout=StringIO())
+        self.assertEqual(self.get_counts(), counts)
+
+    def test_filtered_page(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url, {'colour': ['Золото', 'Серебро'], 'price': '100', 'sort': 'price'})
+        self.assertEqual([p.slug for p in response.context['products']], ['product-1', 'product-2'])
+        # категория, страница товаров, счётчики фильтров, меню категорий и дата изменения для кэша страницы
+        self.assertEqual(len([q for q in ctx.captured_queries if 'store_' in q['sql']]), 5)
+
+        colours = next(f for f in response.context['facets'] if f['name'] == 'colour')['values']
+        self.assertEqual([(c['value'], c['count'], c['checked']) for c in colours],
+                         [('Золото', 2, True), ('Платина', 1, False), ('Серебро', 2, True)])
+
+        response = self.client.get(self.url, {'size': '10'})
+        self.assertEqual(len(response.context['products']), 3)
+        self.assertEqual(self.client.get(self.url, {'price': '70'}).status_code, 400)
+
+
+class FragmentCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        reset_stats()
+        self.category = create_catalogue(categories=1, products=2)[0]
+        # Гостям отдаётся кэш всей страницы, фрагменты проверяются на пользователе
+        self.client.force_login(User.objects.create_user(username='buyer', password='password'))
+
+    def get_home_page(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('product_list'))
+        return response, [q['sql'] for q in ctx.captured_queries if 'store_favouriteproducts' not in q['sql']]
+
+    def check_invalidation(self):
+        self.get_home_page()
+        response, queries = self.get_home_page()
+        self.assertFalse([sql for sql in queries if 'store_' in sql])
+        self.assertEqual(get_stats()['catalogue'], {'hits': 1, 'misses': 1})
+
+        product = self.category.products.first()
+        product.title = 'Новое название'
+        product.save()
+        response, queries = self.get_home_page()
+        self.assertContains(response, 'Новое название')
+
+        self.category.title = 'Кольца'
+        self.category.save()
+        response, queries = self.get_home_page()
+        self.assertContains(response, 'КОЛЬЦА')
+
+    def test_locmem_backend(self):
+        self.check_invalidation()
+
+    def test_stats_are_flushed_in_batches(self):
+        self.get_home_page()
+        # Чтение фрагмента не пишет в кэш, счётчики сбрасываются пачкой
+        self.assertIsNone(cache.get('store:stats:catalogue:misses'))
+        self.assertEqual(get_stats()['catalogue'], {'hits': 0, 'misses': 1})
+        self.assertEqual(cache.get('store:stats:catalogue:misses'), 1)
+
+    def test_file_backend(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                                   'LOCATION': location}}):
+            self.check_invalidation()
+
+
+class PageCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.first, self.second = create_catalogue(categories=2, products=2)
+        self.product = self.first.products.first()
+        self.urls = {
+            'home': reverse('product_list'),
+            'first': self.first.get_absolute_url(),
+            'second': self.second.get_absolute_url(),
+            'product': self.product.get_absolute_url(),
+        }
+
+    def get_queries(self, url, **headers):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, **headers)
+        return response, len([q for q in ctx.captured_queries if 'store_' in q['sql']])
+
+    def test_anonymous_pages_are_cached(self):
+        for url in self.urls.values():
+            self.get_queries(url)
+            response, queries = self.get_queries(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(queries, 0)
+            self.assertTrue(response.has_header('ETag'))
+            self.assertTrue(response.has_header('Last-Modified'))
+
+            response, queries = self.get_queries(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(queries, 0)
+
+        response, queries = self.get_queries(self.urls['first'] + '?sort=-price')
+        self.assertNotEqual(queries, 0)
+
+    def test_product_change_purges_only_its_pages(self):
+        etags = {name: self.client.get(url)['ETag'] for name, url in self.urls.items()}
+        self.product.price = 999
+        self.product.save()
+
+        changed = {name for name, url in self.urls.items() if self.client.get(url)['ETag'] != etags[name]}
+        self.assertEqual(changed, {'home', 'first', 'product'})
+        self.assertContains(self.client.get(self.urls['first']), '999')
+
+    def test_category_rename_moves_last_modified(self):
+        response = self.client.get(self.urls['first'])
+        # Переименование позже первой выдачи, updated_at товаров не меняется
+        with mock.patch('store.cache.time.time', return_value=time.time() + 60):
+            self.first.title = 'Новое название'
+            self.first.save()
+
+        response = self.client.get(self.urls['first'], HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Новое название')
+
+        response = self.client.get(self.urls['first'], HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_authenticated_users_bypass_cache(self):
+        self.client.get(self.urls['home'])
+        self.client.force_login(User.objects.create_user(username='buyer', password='password'))
+        response, queries = self.get_queries(self.urls['home'])
+        self.assertFalse(response.has_header('ETag'))
+        self.assertNotEqual(queries, 0)
+
+
+class SnapshotTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.mkdtemp()
+        self.path = f'{self.directory}/catalogue.snapshot'
+        self.category = create_catalogue(categories=2, products=5)[0]
+        build_snapshot(self.path)
+
+    def tearDown(self):
+        unload_snapshot()
+        shutil.rmtree(self.directory)
+
+    def get_catalogue_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        # Дата изменения для кэша страницы берётся из базы и со снимком
+        return response, [q['sql'] for q in ctx.captured_queries
+                          if 'store_' in q['sql'] and 'last_modified' not in q['sql']]
+
+    def test_cold_worker_serves_catalogue_from_snapshot(self):
+        self.assertIsNotNone(load_snapshot(self.path))
+        response, queries = self.get_catalogue_queries(reverse('product_list'))
+        self.assertEqual(queries, [])
+        self.assertEqual([len(entry['products']) for entry in response.context['categories']], [4, 4])
+        self.assertContains(response, self.category.products.first().get_absolute_url())
+
+        response, queries = self.get_catalogue_queries(self.category.get_absolute_url())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['title'], f'Категория: {self.category.title}')
+        self.assertEqual(self.client.get(reverse('category', kwargs={'slug': 'missing'})).status_code, 404)
+        self.assertEqual(lookup_product_id('product-1-3'), Product.objects.get(slug='product-1-3').pk)
+
+    def test_database_error_degrades_to_database_lookups(self):
+        with mock.patch('store.snapshot.get_fingerprint', side_effect=OperationalError('no such table')), \
+                self.assertLogs('store.snapshot', 'ERROR'):
+            self.assertIsNone(load_snapshot(self.path))
+        self.assertEqual(lookup_product_id('product-1-3'), Product.objects.get(slug='product-1-3').pk)
+
+    def test_stale_snapshot_is_ignored(self):
+        Product.objects.get(slug='product-0-0').save()
+        with self.assertLogs('store.snapshot', 'WARNING'):
+            self.assertIsNone(load_snapshot(self.path))
+
+    def test_catalogue_change_drops_snapshot(self):
+        load_snapshot(self.path)
+        product = self.category.products.first()
+        product.price = 999
+        product.save()
+        response, queries = self.get_catalogue_queries(reverse('product_list'))
+        self.assertNotEqual(queries, [])
+        self.assertContains(response, '999')
+
+    def create_elsewhere(self):
+        # Правки другого процесса: сигналы этого процесса их не видят, версия каталога в кэше прежняя
+        Product.objects.filter(slug='product-0-0').update(title='Переименован', updated_at=timezone.now())
+        Product.objects.bulk_create([Product(title='Новинка', slug='brand-new', price=10, quantity=1,
+                                                 category=self.category)])
+        Category.objects.bulk_create([Category(title='Новая категория', slug='new-category')])
+
+    def test_missing_slug_falls_back_to_database(self):
+        load_snapshot(self.path)
+        self.create_elsewhere()
+        self.assertEqual(lookup_product_id('brand-new'), Product.objects.get(slug='brand-new').pk)
+        self.assertEqual(self.client.get(reverse('category', kwargs={'slug': 'new-category'})).status_code, 200)
+        with self.assertRaises(Product.DoesNotExist):
+            lookup_product_id('missing')
+
+    def test_snapshot_rechecked_against_database(self):
+        load_snapshot(self.path)
+        self.create_elsewhere()
+        with self.settings(STORE_SNAPSHOT_CHECK_INTERVAL=3600):
+            self.assertIsNotNone(get_snapshot())
+        with self.settings(STORE_SNAPSHOT_CHECK_INTERVAL=0):
+            self.assertIsNone(get_snapshot())
+        self.assertContains(self.client.get(reverse('product_list')), 'Переименован')
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        reset_metrics()
+        self.category = create_catalogue(categories=1, products=3)[0]
+        self.user = User.objects.create_user(username='buyer', password='password')
+        self.client.force_login(self.user)
+
+    def get_metrics(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        return {line.rsplit(' ', 1)[0]: float(line.rsplit(' ', 1)[1])
+                for line in response.content.decode().splitlines() if not line.startswith('#')}
+
+    def test_view_histograms(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(self.category.get_absolute_url())
+        queries = len(ctx.captured_queries)
+        self.client.get(reverse('cart'))
+        metrics = self.get_metrics()
+
+        self.assertEqual(metrics['store_view_queries_count{view="category"}'], 1)
+        self.assertEqual(metrics['store_view_queries_sum{view="category"}'], queries)
+        self.assertEqual(metrics['store_view_latency_seconds_bucket{view="category",le="+Inf"}'], 1)
+        self.assertGreater(metrics['store_view_template_seconds_sum{view="category"}'], 0)
+        self.assertGreater(metrics['store_view_db_seconds_sum{view="category"}'], 0)
+        # Запросы асинхронного представления идут через sync_to_async и тоже учитываются
+        self.assertGreater(metrics['store_view_queries_sum{view="cart"}'], 0)
+
+    @override_settings(STORE_METRICS_SAMPLE_RATE=1.0, STORE_METRICS_SLOW_QUERIES=3)
+    def test_sampling_logs_slowest_queries_with_origin(self):
+        with self.assertLogs('store.metrics', 'INFO') as logs:
+            self.client.get(self.category.get_absolute_url())
+        output = logs.output[0]
+        self.assertIn('category', output)
+        self.assertEqual(output.count(' ms  '), 3)
+        self.assertIn('store/', output)
+
+    @override_settings(INTERNAL_IPS=[])
+    def test_metrics_are_not_public(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+
+class BenchmarkTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.counts = generate_dataset(categories=2, products=10, images=25, users=3, favourites=20, reviews=7,
+                                       order_lines=12, batch_size=4)
+
+    def test_synthetic_dataset(self):
+        self.assertEqual(self.counts, {'categories': 2, 'products': 10, 'images': 25, 'users': 3, 'favourites': 20,
+                                       'reviews': 7, 'order_lines': 12})
+        pairs = list(FavouriteProducts.objects.values_list('user_id', 'product_id'))
+        self.assertEqual(len(set(pairs)), len(pairs))
+        order = Order.objects.filter(is_completed=True).first()
+        self.assertEqual(order.total_price, sum(line.get_total_price for line in order.orderproduct_set.all()))
+        self.assertEqual(Product.objects.exclude(primary_image='').count(), 10)
+        product = Product.objects.first()
+        self.assertIn(product, search_products(product.title))
+
+        self.assertGreater(delete_dataset(), 0)
+        self.assertFalse(Product.objects.filter(slug__startswith='synthetic-').exists())
+
+    def test_delete_dataset_keeps_other_data(self):
+        keep = create_catalogue(categories=1, products=2)[0].products.first()
+        user = User.objects.create_user(username='buyer')
+        # Настоящие записи с тем же префиксом, но не из записанного прогона
+        namesake = User.objects.create_user(username='synthetic-namesake')
+        Category.objects.create(title='Тёзка', slug='synthetic-namesake', image='categories/test.png')
+        FavouriteProducts.objects.create(user=user, product=Product.objects.filter(slug__startswith='synthetic-')[0])
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertGreater(delete_dataset(), 2 + 10 + 25 + 3 + 21 + 7 + 12)
+        # Пачки по первичному ключу и без сигналов на каждую строку
+        self.assertLess(len(ctx.captured_queries), 60)
+        self.assertEqual(set(Product.objects.all()), set(keep.category.products.all()))
+        self.assertFalse(OrderProduct.objects.exists())
+        self.assertFalse(FavouriteProducts.objects.exists())
+        self.assertFalse(Review.objects.exists())
+        self.assertEqual(set(User.objects.values_list('username', flat=True)), {'buyer', namesake.username})
+        self.assertTrue(Category.objects.filter(slug='synthetic-namesake').exists())
+        self.assertEqual(search_products(keep.title)[0], keep)
+        self.assertEqual(set(CategoryFacet.objects.values_list('category_id', flat=True)), {keep.category_id})
+        self.assertEqual(delete_dataset(), 0)
+
+    def test_command_rejects_empty_sizes(self):
+        for option in ('--products', '--users', '--categories'):
+            with self.assertRaises(CommandError):
+                call_command('generate_synthetic_data', option, '0', stdout=StringIO())
+
+    def test_scenarios_and_baseline(self):
+        cache.set('store:unrelated', 1)
+        results = run_scenarios(repeat=3, warmup=1, cold=True)
+        # Холодные замеры чистят отдельный кэш, а не общий
+        self.assertEqual(cache.get('store:unrelated'), 1)
+        self.assertEqual(list(results['scenarios']), ['home', 'category_sort', 'product_detail', 'cart_add',
+                                                      'checkout'])
+        for result in results['scenarios'].values():
+            self.assertGreater(result['queries'], 0)
+            self.assertLessEqual(result['p50_ms'], result['p95_ms'])
+        # Замер откатывается: корзина и склад не меняются
+        self.assertFalse(Order.objects.filter(is_completed=False).exists())
+        self.assertEqual(set(Product.objects.values_list('quantity', flat=True)), {1000})
+
+        slower = json.loads(json.dumps(results))
+        slower['scenarios']['home']['p95_ms'] *= 2
+        slower['scenarios']['checkout']['queries'] += 1
+        regressions = [(row["scenario"], row["metric"]) for row in compare_results(results, slower)
+                       if row["regression"]]
+        self.assertEqual(regressions, [('home', 'p95_ms'), ('checkout', 'queries')])
+
+        path = f'{tempfile.mkdtemp()}/baseline.json'
+        call_command('bench_store', 'home', repeat=2, warmup=0, output=path, stdout=StringIO())
+        call_command('bench_store', 'home', repeat=2, warmup=0, baseline=path, threshold=100, stdout=StringIO())
+
+
+class RequestStub:
+    def __init__(self, user):
+        self.user = user
+        self.session = {}
+
+
+class CartConcurrencyTest(TransactionTestCase):
+    threads = 8
+    clicks = 5
+
+    def test_stock_never_goes_negative(self):
+        product = create_catalogue(categories=1, products=1)[0].products.get()
+        carts = []
+        for i in range(self.threads):
+            user = User.objects.create_user(username=f'buyer{i}', password='password')
+            cart = CartForAuthenticatedUser(RequestStub(user))
+            order = cart.get_order()
+            cart.get_order = lambda order=order: order
+            carts.append(cart)
+
+        def click(cart):
+            for i in range(self.clicks):
+                while True:
+                    try:
+                        cart.add_or_delete(product.pk, 'add')
+                        break
+                    except OperationalError:
+                        # SQLite блокирует таблицу целиком - повторяем
+                        continue
+            connection.close()
+
+        workers = [threading.Thread(target=click, args=(cart,)) for cart in carts]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        product.refresh_from_db()
+        self.assertEqual(product.quantity, 0)
+        self.assertEqual(sum(OrderProduct.objects.values_list('quantity', flat=True)), 5)
@@ -1,22 +1,107 @@
-from .models import Product, Order, OrderProduct, Customer
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import BadRequest, ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum, Value, Window
+from django.db.models.functions import Cast, Coalesce, RowNumber
+from django.utils import timezone
+
+from .favourites import apply_pending
+from .models import (Category, Product, Gallery, Order, OrderProduct, Customer, FavouriteProducts, Review,
+                     money_field)
+
+SORTERS = [
+    {
+        'title': 'По цене',
+        'sorters': [
+            ['price', 'По возрастанию'],
+            ['-price', 'По убыванию']
+        ]
+    },
+    {
+        'title': 'По цвету/материалу',
+        'sorters': [
+            ['colour', 'От А до Я'],
+            ['-colour', 'От Я до А']
+        ]
+    },
+    {
+        'title': 'По размеру',
+        'sorters': [
+            ['size', 'По возрастанию'],
+            ['-size', 'По убыванию']
+        ]
+    },
+    {
+        'title': 'По названию',
+        'sorters': [
+            ['title', 'От А до Я'],
+            ['-title', 'От Я до А']
+        ]
+    }
+]
+SORT_FIELDS = {sorter[0] for group in SORTERS for sorter in group['sorters']}
+REVIEWS_PER_PAGE = 10
 
 
 class CartForAuthenticatedUser:
+    session_key = 'cart_order_id'
+
     def __init__(self, request, product_id=None, action=None):
         self.user = request.user
+        self.session = request.session
         if product_id and action:
             self.add_or_delete(product_id, action)
 
-    def get_cart_info(self):
+    def get_order(self):
+        # После первого поиска id заказа хранится в сессии и заказ берётся по первичному ключу
+        order_id = self.session.get(self.session_key)
+        if order_id:
+            order = Order.objects.filter(pk=order_id, customer__user=self.user, is_completed=False).first()
+            if order:
+                return order
+
         customer, created = Customer.objects.get_or_create(
             user=self.user,
             name=self.user.username,
             email=self.user.email
         )
         order, created = Order.objects.get_or_create(
-            customer=customer
+            customer=customer,
+            is_completed=False
+        )
+        self.session[self.session_key] = order.pk
+        return order
+
+    async def aget_order(self):
+        # async-версия get_order: сессия читается в потоке, заказ ищется через async ORM
+        order_id = await sync_to_async(self.session.get)(self.session_key)
+        if order_id:
+            order = await Order.objects.filter(pk=order_id, customer__user=self.user, is_completed=False).afirst()
+            if order:
+                return order
+
+        customer, created = await Customer.objects.aget_or_create(
+            user=self.user,
+            name=self.user.username,
+            email=self.user.email
         )
-        order_products = order.orderproduct_set.all()
+        order, created = await Order.objects.aget_or_create(
+            customer=customer,
+            is_completed=False
+        )
+        await sync_to_async(self.session.__setitem__)(self.session_key, order.pk)
+        return order
+
+    def forget_order(self):
+        self.session.pop(self.session_key, None)
+
+    def get_cart_info(self):
+        order = self.get_order()
+        order_products = order.orderproduct_set.select_related('product')
         cart_total_quantity = order.get_cart_total_quantity
         cart_total_price = order.get_cart_total_price
 
@@ -27,30 +112,154 @@ class CartForAuthenticatedUser:
             'products': order_products
         }
 
+    async def aget_cart_info(self):
+        order = await self.aget_order()
+        totals = await order.aget_cart_totals()
+        order_products = [order_product async for order_product in order.orderproduct_set.select_related('product')]
+
+        return {
+            'cart_total_quantity': totals['total_quantity'],
+            'cart_total_price': totals['total_price'],
+            'order': order,
+            'products': order_products
+        }
+
     def add_or_delete(self, product_id, action):
-        order = self.get_cart_info()['order']
-        product = Product.objects.get(pk=product_id)
-        order_product, created = OrderProduct.objects.get_or_create(order=order,
-                                                                    product=product)
-        if action == 'add' and product.quantity > 0:
-            order_product.quantity += 1  # +1 в корзине
-            product.quantity -= 1  # -1 Со склада
+        order = self.get_order()
+        order_products = OrderProduct.objects.filter(order=order, product_id=product_id)
+        # Остатки меняются одним UPDATE с условием, поэтому склад не уходит в минус
+        with transaction.atomic():
+            if action == 'add':
+                if not Product.objects.filter(pk=product_id, quantity__gt=0).update(quantity=F('quantity') - 1):
+                    return False
+                if not order_products.update(quantity=F('quantity') + 1):
+                    try:
+                        with transaction.atomic():
+                            OrderProduct.objects.create(order=order, product_id=product_id, quantity=1)
+                    except IntegrityError:
+                        # Строку этого товара только что вставил параллельный запрос
+                        order_products.update(quantity=F('quantity') + 1)
+            else:
+                if not order_products.filter(quantity__gt=0).update(quantity=F('quantity') - 1):
+                    return False
+                Product.objects.filter(pk=product_id).update(quantity=F('quantity') + 1)
+                order_products.filter(quantity__lte=0).delete()
+        return True
+
+    def clear(self):
+        empty_order(self.get_order())
+        self.forget_order()
+
+    def complete(self):
+        complete_orders([self.get_order().pk])
+        self.forget_order()
+
+
+class CartForAnonymousUser:
+    session_key = 'cart'
+
+    def __init__(self, request, product_id=None, action=None):
+        self.session = request.session
+        self.cart = self.session.get(self.session_key, {})
+        if product_id and action:
+            self.add_or_delete(product_id, action)
+
+    def get_cart_info(self):
+        # Корзина гостя целиком живёт в сессии: {id товара: количество}
+        products = Product.objects.in_bulk([int(pk) for pk in self.cart]) if self.cart else {}
+        order_products = [OrderProduct(product=products[int(pk)], quantity=quantity)
+                          for pk, quantity in self.cart.items() if int(pk) in products]
+        order = Order()
+        order.cart_totals = {
+            'total_quantity': sum(item.quantity for item in order_products),
+            'total_price': sum(item.get_total_price for item in order_products)
+        }
+
+        return {
+            'cart_total_quantity': order.get_cart_total_quantity,
+            'cart_total_price': order.get_cart_total_price,
+            'order': order,
+            'products': order_products
+        }
+
+    def add_or_delete(self, product_id, action):
+        key = str(product_id)
+        quantity = self.cart.get(key, 0)
+        if action == 'add':
+            if not Product.objects.filter(pk=product_id, quantity__gt=quantity).exists():
+                return False
+            self.cart[key] = quantity + 1
         else:
-            order_product.quantity -= 1
-            product.quantity += 1
-        order_product.save()
-        product.save()
+            if not quantity:
+                return False
+            if quantity > 1:
+                self.cart[key] = quantity - 1
+            else:
+                del self.cart[key]
+        self.session[self.session_key] = self.cart
+        return True
+
+    def move_to(self, user_cart):
+        # При входе в аккаунт корзина гостя переносится в заказ пользователя
+        for product_id, quantity in self.cart.items():
+            for i in range(quantity):
+                user_cart.add_or_delete(int(product_id), 'add')
+        self.clear()
 
     def clear(self):
-        order = self.get_cart_info()['order']
-        order_products = order.orderproduct_set.all()
-        for product in order_products:
-            product.delete()
-        order.save()
+        self.cart = {}
+        self.session.pop(self.session_key, None)
+
+
+def empty_order(order):
+    # Резерв возвращается на склад и строки удаляются двумя запросами, без цикла по строкам
+    lines = OrderProduct.objects.filter(order=order, product=OuterRef('pk'))
+    with transaction.atomic():
+        Product.objects.filter(orderproduct__order=order).update(
+            quantity=F('quantity') + Subquery(lines.values('quantity')[:1])
+        )
+        order.orderproduct_set.all().delete()
+
+
+def get_cart_amounts(order_ids):
+    # Сумма открытых корзин в центах по текущим ценам, как её отправляет в Stripe payments.get_params
+    totals = OrderProduct.objects.filter(order_id__in=order_ids, order__is_completed=False, quantity__gt=0).order_by(
+    ).values('order').annotate(total=Sum(F('quantity') * Cast('product__price', money_field()),
+                                         output_field=money_field())).values_list('order', 'total')
+    amounts = {order_id: 0 for order_id in order_ids}
+    amounts.update((order_id, int(total * 100)) for order_id, total in totals)
+    return amounts
+
+
+def complete_orders(order_ids):
+    # Закрытие пачки заказов: пустые строки удаляются, цены строк запоминаются,
+    # итоги сохраняются на заказе. Три запроса в одной транзакции при любом числе заказов и строк
+    with transaction.atomic():
+        lines = OrderProduct.objects.filter(order_id__in=order_ids, order__is_completed=False)
+        lines.filter(quantity__lte=0).delete()
+        lines.update(price=Cast(Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('price')[:1]),
+                                money_field()))
+
+        totals = OrderProduct.objects.filter(order=OuterRef('pk')).order_by().values('order')
+        return Order.objects.filter(pk__in=order_ids, is_completed=False).update(
+            is_completed=True,
+            total_quantity=Coalesce(Subquery(totals.annotate(total=Sum('quantity')).values('total')), 0),
+            total_price=Coalesce(
+                Subquery(totals.annotate(total=Sum(F('quantity') * F('price'), output_field=money_field()))
+                         .values('total')),
+                Value(Decimal('0.00')), output_field=money_field()
+            )
+        )
+
+
+def get_cart(request, product_id=None, action=None):
+    if request.user.is_authenticated:
+        return CartForAuthenticatedUser(request, product_id, action)
+    return CartForAnonymousUser(request, product_id, action)
 
 
 def get_cart_data(request):
-    user_cart = CartForAuthenticatedUser(request)
+    user_cart = get_cart(request)
     cart_info = user_cart.get_cart_info()
 
     return {
@@ -60,3 +269,170 @@ def get_cart_data(request):
         'products': cart_info['products']
     }
 
+
+async def aget_user(request):
+    # В Django 4.2 нет request.auser(): пользователь из сессии загружается в потоке
+    await sync_to_async(lambda: request.user.is_authenticated)()
+    return request.user
+
+
+async def aget_cart_data(request):
+    if (await aget_user(request)).is_authenticated:
+        cart_info = await CartForAuthenticatedUser(request).aget_cart_info()
+    else:
+        # Корзина гостя лежит в сессии, а сессия в Django 4.2 читается только синхронно
+        cart_info = await sync_to_async(lambda: CartForAnonymousUser(request).get_cart_info())()
+
+    return {
+        'cart_total_quantity': cart_info['cart_total_quantity'],
+        'cart_total_price': cart_info['cart_total_price'],
+        'order': cart_info['order'],
+        'products': cart_info['products']
+    }
+
+
+def get_favourite_ids(request):
+    # Один запрос на весь запрос пользователя, карточки проверяют id по set
+    if not hasattr(request, '_favourite_ids'):
+        if request.user.is_authenticated:
+            request._favourite_ids = apply_pending(request.user.pk, set(
+                FavouriteProducts.objects.filter(user=request.user).values_list('product_id', flat=True)
+            ))
+        else:
+            request._favourite_ids = set()
+    return request._favourite_ids
+
+
+def reset_favourite_ids(request):
+    if hasattr(request, '_favourite_ids'):
+        del request._favourite_ids
+
+
+def get_catalogue(products_per_category=4):
+    # Первые N товаров каждой категории - константное число запросов
+    products = Product.objects.annotate(
+        row_number=Window(RowNumber(), partition_by=[F('category_id')], order_by=F('pk').asc())
+    ).filter(row_number__lte=products_per_category).order_by('category_id', 'pk')
+
+    category_products = {}
+    for product in products:
+        category_products.setdefault(product.category_id, []).append(product)
+
+    data = []
+    for category in Category.objects.all():
+        if category.image:
+            image = category.image.url
+        else:
+            image = 'https://экологиякрыма.рф/img/19893719.jpg'
+
+        data.append({
+            'title': category,
+            'products': category_products.get(category.pk, []),
+            'image': image
+        })
+    return data
+
+
+def refresh_primary_images(products=None):
+    # Первое фото из галереи копируется в Product.primary_image одним UPDATE
+    if products is None:
+        products = Product.objects.all()
+    first_photo = Gallery.objects.filter(product=OuterRef('pk')).exclude(photo__isnull=True).exclude(
+        photo='').order_by('pk')
+    return products.update(primary_image=Coalesce(Subquery(first_photo.values('photo')[:1]), Value('')),
+                           has_renditions=Coalesce(Subquery(first_photo.values('has_renditions')[:1]),
+                                                   Value(False)),
+                           updated_at=timezone.now())
+
+
+def encode_cursor(product, field):
+    # Даты пишутся строкой ISO, фильтр по DateTimeField разбирает её обратно
+    value = json.dumps([getattr(product, field), product.pk], default=str)
+    return urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(cursor, field=None):
+    # Значение приводится к типу поля сортировки: подделанный курсор даёт 400, а не ошибку в запросе
+    try:
+        value, pk = json.loads(urlsafe_b64decode(cursor.encode()))
+        if isinstance(value, (str, int, float)):
+            return value if field is None else field.to_python(value), int(pk)
+    except (ValueError, TypeError, ValidationError):
+        pass
+    raise BadRequest('Неверный курсор страницы')
+
+
+def paginate_keyset(queryset, sort=None, after=None, before=None, per_page=12):
+    # Страница ищется по индексу (поле сортировки, id) от курсора, а не через OFFSET
+    if sort and sort not in SORT_FIELDS:
+        raise BadRequest('Неизвестная сортировка')
+    sort = sort or 'pk'
+    field = sort.lstrip('-')
+    descending = sort.startswith('-')
+    ordering = [sort, '-pk' if descending else 'pk'] if field != 'pk' else [sort]
+
+    cursor = before or after
+    backwards = bool(before)
+    if backwards:
+        ordering = [key[1:] if key.startswith('-') else f'-{key}' for key in ordering]
+    if cursor:
+        model_field = queryset.model._meta.pk if field == 'pk' else queryset.model._meta.get_field(field)
+        value, pk = decode_cursor(cursor, model_field)
+        lookup = 'lt' if descending != backwards else 'gt'
+        if field == 'pk':
+            condition = Q(**{f'pk__{lookup}': pk})
+        else:
+            condition = Q(**{f'{field}__{lookup}': value}) | Q(**{field: value, f'pk__{lookup}': pk})
+        queryset = queryset.filter(condition)
+
+    products = list(queryset.order_by(*ordering)[:per_page + 1])
+    has_more = len(products) > per_page
+    products = products[:per_page]
+    if backwards:
+        products.reverse()
+        has_next, has_previous = True, has_more
+    else:
+        has_next, has_previous = has_more, bool(cursor)
+
+    return {
+        'object_list': products,
+        'next_cursor': encode_cursor(products[-1], field) if products and has_next else None,
+        'previous_cursor': encode_cursor(products[0], field) if products and has_previous else None
+    }
+
+
+def get_reviews_page(product_id, after=None, per_page=REVIEWS_PER_PAGE):
+    # От новых к старым по индексу (product, created_at, id), автор - тем же запросом
+    reviews = Review.objects.filter(product_id=product_id).select_related('author').order_by('-created_at', '-pk')
+    if after:
+        # Дата разбирается DateTimeField.to_python (parse_datetime): мусор в курсоре - 400
+        created_at, pk = decode_cursor(after, Review._meta.get_field('created_at'))
+        reviews = reviews.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk))
+    reviews = list(reviews[:per_page + 1])
+    return {
+        'object_list': reviews[:per_page],
+        'next_cursor': encode_cursor(reviews[per_page - 1], 'created_at') if len(reviews) > per_page else None
+    }
+
+
+def add_review(review):
+    # Отзыв и сводка в товаре меняются в одной транзакции, счётчики растут через F() без гонок
+    with transaction.atomic():
+        review.save()
+        Product.objects.filter(pk=review.product_id).update(
+            review_count=F('review_count') + 1,
+            rating_count=F('rating_count') + int(review.rating is not None),
+            rating_sum=F('rating_sum') + (review.rating or 0)
+        )
+
+
+def recount_reviews(products=None):
+    # Полный пересчёт сводки: после массового удаления или загрузки отзывов мимо add_review
+    if products is None:
+        products = Product.objects.all()
+    reviews = Review.objects.filter(product=OuterRef('pk')).order_by().values('product')
+    return products.update(
+        review_count=Coalesce(Subquery(reviews.annotate(count=Count('pk')).values('count')), 0),
+        rating_count=Coalesce(Subquery(reviews.annotate(count=Count('rating')).values('count')), 0),
+        rating_sum=Coalesce(Subquery(reviews.annotate(total=Sum('rating')).values('total')), 0)
+    )
@@ -1,16 +1,41 @@
 from django.shortcuts import render, redirect
-from .models import Category, Product, Review, FavouriteProducts
+from .models import Category, Product, FavouriteProducts
 from django.views.generic import ListView, DetailView
 # Create your views here.
 from django.contrib.auth import login, logout
 from django.contrib import messages
+from django.db.models import Max
 from django.urls import reverse
+from django.conf import settings
+from asgiref.sync import sync_to_async
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.http import Http404, HttpResponse, JsonResponse
+from django.template.loader import render_to_string
+from django.utils.http import urlencode
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from .cache import bump_versions, cache_anonymous_page
+from .favourites import set_favourite, toggle_favourite
+from .facets import filter_products, get_facets, get_selected
+from .metrics import format_metrics
 from .forms import RegistrationForm, LoginForm, ReviewForm, CustomerForm, ShippingForm
-from .utils import CartForAuthenticatedUser, get_cart_data
-from shop import settings
+from .payments import get_gateway
+from .recommendations import get_recommended_products
+from .search import search_products
+from .snapshot import lookup_catalogue, lookup_category, lookup_product_id
+from .webhooks import enqueue_event
+from .utils import (CartForAuthenticatedUser, CartForAnonymousUser, add_review, aget_cart_data, aget_user, get_cart,
+                    get_favourite_ids, get_reviews_page, reset_favourite_ids, paginate_keyset)
 import stripe
 
 
+def last_modified(products):
+    return products.aggregate(last_modified=Max('updated_at'))['last_modified'] or timezone.now()
+
+
+@method_decorator(cache_anonymous_page(lambda: ['catalogue'],
+                                       lambda: last_modified(Product.objects.all())), name='dispatch')
 class ProductList(ListView):
     model = Product
     extra_context = {
@@ -20,65 +45,74 @@ class ProductList(ListView):
     context_object_name = 'categories'
 
     def get_queryset(self):
-        categories = Category.objects.all()
-        data = []
-        for category in categories:
-            products = category.products.all()[:4]
-
-            if category.image:
-                image = category.image.url
-            else:
-                image = 'https://экологиякрыма.рф/img/19893719.jpg'
-
-            data.append({
-                'title': category,
-                'products': products,
-                'image': image
-            })
-        return data
+        return lookup_catalogue()
 
+@method_decorator(cache_anonymous_page(lambda slug: [f'category-page:{slug}'],
+                                       lambda slug: last_modified(Product.objects.filter(category__slug=slug))),
+                  name='dispatch')
 class ProductListByCategory(ListView):
     model = Product
     context_object_name = 'products'
     template_name = 'store/category_detail.html'
 
     def get_queryset(self):
-        sort_field = self.request.GET.get('sort')
-        category = Category.objects.get(slug=self.kwargs['slug'])
-        products = category.products.all()
-        if sort_field:
-            products = products.order_by(sort_field)
-        return products
+        self.category = lookup_category(self.kwargs['slug'])
+        self.selected = get_selected(self.request.GET)
+        products = filter_products(self.category.products.all(), self.selected)
+        self.page = paginate_keyset(products, self.request.GET.get('sort'),
+                                    after=self.request.GET.get('after'), before=self.request.GET.get('before'))
+        return self.page['object_list']
+
+    def get_page_url(self, **params):
+        # Сортировка и фильтры переходят на соседние страницы вместе с курсором
+        query = self.request.GET.copy()
+        for key in ('after', 'before'):
+            query.pop(key, None)
+        query.update(params)
+        return f'?{query.urlencode()}'
 
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super().get_context_data()
-        category = Category.objects.get(slug=self.kwargs['slug'])
-        context['title'] = f'Категория: {category.title}'
+        context['title'] = f'Категория: {self.category.title}'
+        context['facets'] = get_facets(self.category, self.selected)
+        context['first_page_url'] = self.get_page_url()
+        if self.page['next_cursor']:
+            context['next_page_url'] = self.get_page_url(after=self.page['next_cursor'])
+        if self.page['previous_cursor']:
+            context['previous_page_url'] = self.get_page_url(before=self.page['previous_cursor'])
         return context
 
 
+@method_decorator(cache_anonymous_page(lambda slug: [f'product-page:{slug}'],
+                                       lambda slug: last_modified(Product.objects.filter(slug=slug))),
+                  name='dispatch')
 class ProductDetail(DetailView):  # product_detail.html
     model = Product
     context_object_name = 'product'
+    queryset = Product.objects.select_related('category', 'related')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data()
-        product = Product.objects.get(slug=self.kwargs['slug'])
+        product = self.object
         context['title'] = f'Товар - {product.title}'
-        products = Product.objects.all()
-        data = []
-        for i in range(4):
-            from random import randint
-            random_index = randint(0, len(products) - 1)
-            product = products[random_index]
-            if product not in data:
-                data.append(product)
-        context['products'] = data
-        context['reviews'] = Review.objects.filter(product__slug=self.kwargs['slug'])
+        context['products'] = get_recommended_products(product)
+        page = get_reviews_page(product.pk)
+        context['reviews'] = page['object_list']
+        if page['next_cursor']:
+            context['reviews_next_url'] = get_reviews_url(product.slug, page['next_cursor'])
         if self.request.user.is_authenticated:
             context['review_form'] = ReviewForm()
         return context
 
+def search(request):
+    query = request.GET.get('q', '').strip()
+    context = {
+        'title': f'Поиск: {query}' if query else 'Поиск',
+        'query': query,
+        'products': search_products(query)
+    }
+    return render(request, 'store/search.html', context)
+
 def login_registration(request):
     context = {
         'title': 'Войти или зарегестрироваться',
@@ -91,7 +125,9 @@ def user_login(request):
     form = LoginForm(data=request.POST)
     if form.is_valid():
         user = form.get_user()
+        guest_cart = CartForAnonymousUser(request)
         login(request, user)
+        guest_cart.move_to(CartForAuthenticatedUser(request))
         return redirect('product_list')
     else:
         messages.error(request, 'Не верное имя пользователя или пароль')
@@ -119,58 +155,91 @@ def save_review(request, product_slug):
     if form.is_valid():
         review = form.save(commit=False)
         review.author = request.user
-        product = Product.objects.get(slug=product_slug)
-        review.product = product
-        review.save()
+        try:
+            review.product_id = lookup_product_id(product_slug)
+        except Product.DoesNotExist:
+            raise Http404('Товар не найден')
+        add_review(review)
+        bump_versions(f'product-page:{product_slug}')
     return redirect('product', product_slug)
 
 
+def get_reviews_url(slug, cursor):
+    return f'{reverse("product_reviews", kwargs={"slug": slug})}?{urlencode({"after": cursor})}'
+
+
+def product_reviews(request, slug):
+    # «Показать ещё»: следующая пачка отзывов готовым HTML и ссылка на следующую
+    try:
+        product_id = lookup_product_id(slug)
+    except Product.DoesNotExist:
+        raise Http404('Товар не найден')
+    page = get_reviews_page(product_id, after=request.GET.get('after'))
+    return JsonResponse({
+        'html': render_to_string('store/components/_review_list.html', {'reviews': page['object_list']}),
+        'next_url': get_reviews_url(slug, page['next_cursor']) if page['next_cursor'] else None
+    })
+
+
 def save_or_delete_fav(request, product__slug):
-    user = request.user if request.user.is_authenticated else None
-    product = Product.objects.get(slug=product__slug)
-    if user:
-        favs = FavouriteProducts.objects.filter(user=user)
-        if product in [i.product for i in favs]:
-            fav_product = FavouriteProducts.objects.get(user=user, product=product)
-            fav_product.delete()
-        else:
-            FavouriteProducts.objects.create(user=user, product=product)
+    if request.user.is_authenticated:
+        try:
+            toggle_favourite(request.user.pk, lookup_product_id(product__slug))
+        except Product.DoesNotExist:
+            raise Http404('Товар не найден')
+        reset_favourite_ids(request)
     next_page = request.META.get('HTTP_REFERER', 'product_list')
     return redirect(next_page)
 
 
+@require_POST
+def favourite_api(request, product__slug):
+    # Сердечко на карточке переключается без перезагрузки; favourite=true/false - нужное состояние
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Требуется вход'}, status=403)
+    try:
+        product_id = lookup_product_id(product__slug)
+    except Product.DoesNotExist:
+        raise Http404('Товар не найден')
+    state = request.POST.get('favourite')
+    if state in ('true', 'false'):
+        favourite = set_favourite(request.user.pk, product_id, state == 'true')
+    else:
+        favourite = toggle_favourite(request.user.pk, product_id)
+    reset_favourite_ids(request)
+    return JsonResponse({'product': product__slug, 'favourite': favourite})
+
+
 class FavouriteProductsView(ListView):
     model = FavouriteProducts
     context_object_name = 'products'
     template_name = 'store/favourite_products.html'
 
     def get_queryset(self):
-        user = self.request.user
-        favs = FavouriteProducts.objects.filter(user=user)
-        products = [i.product for i in favs]
-        return products
+        # Товары одним запросом по id избранного, с учётом ещё не записанных кликов
+        return Product.objects.filter(pk__in=get_favourite_ids(self.request)).order_by('pk')
 
 
-def cart(request):
-    cart_info = get_cart_data(request)
+async def cart(request):
+    cart_info = await aget_cart_data(request)
     context = {
         'cart_total_quantity': cart_info['cart_total_quantity'],
         'order': cart_info['order'],
         'products': cart_info['products']
     }
-    return render(request, 'store/cart.html', context)
+    # Шаблон обращается к базе через теги меню и избранного, поэтому рендерится в потоке
+    return await sync_to_async(render)(request, 'store/cart.html', context)
 
 
 def to_cart(request, product_id, action):
-    if request.user.is_authenticated:
-        user_cart = CartForAuthenticatedUser(request, product_id, action)
-        return redirect('cart')
-    else:
-        return redirect('login_registration')
+    get_cart(request, product_id, action)
+    return redirect('cart')
 
 
-def checkout(request):
-    cart_info = get_cart_data(request)
+async def checkout(request):
+    if not (await aget_user(request)).is_authenticated:
+        return redirect('login_registration')
+    cart_info = await aget_cart_data(request)
     context = {
         'cart_total_quantity': cart_info['cart_total_quantity'],
         'order': cart_info['order'],
@@ -179,39 +248,55 @@ def checkout(request):
         'customer_form': CustomerForm(),
         'shipping_form': ShippingForm()
     }
-    return render(request, 'store/checkout.html', context)
-
-
-
-def create_checkout_session(request):
-    stripe.api_key = settings.STRIPE_SECRET_KEY
-    if request.method == 'POST':
-        user_cart = CartForAuthenticatedUser(request)
-        cart_info = user_cart.get_cart_info()
-        total_price = cart_info['cart_total_price']
-        total_quantity = cart_info['cart_total_quantity']
-        session = stripe.checkout.Session.create(
-            line_items=[
-                {
-                    'price_data': {
-                        'currency': 'usd',
-                        'product_data': {
-                            'name': 'Товары с TOTEMBO'
-                        },
-                        'unit_amount': int(total_price * 100)
-                    },
-                    'quantity': total_quantity
-                }
-            ],
-            mode='payment',
+    return await sync_to_async(render)(request, 'store/checkout.html', context)
+
+
+
+async def create_checkout_session(request):
+    if not (await aget_user(request)).is_authenticated:
+        return redirect('login_registration')
+    if request.method != 'POST':
+        return redirect('checkout')
+
+    user_cart = CartForAuthenticatedUser(request)
+    cart_info = await user_cart.aget_cart_info()
+    if not cart_info['cart_total_quantity']:
+        messages.error(request, 'Корзина пуста')
+        return redirect('cart')
+    # Запрос к Stripe не держит поток воркера: под ASGI процесс тем временем обслуживает другие оплаты
+    try:
+        session = await get_gateway().acreate_checkout_session(
+            cart_info['order'], cart_info,
             success_url=request.build_absolute_uri(reverse('successPayment')),
-            cancel_url=request.build_absolute_uri(reverse('successPayment'))
+            cancel_url=request.build_absolute_uri(reverse('checkout'))
         )
-        return redirect(session.url, 303)
+    except stripe.StripeError:
+        messages.error(request, 'Платёжный сервис не отвечает, попробуйте ещё раз')
+        return redirect('checkout')
+    # redirect() не принимает код ответа, Stripe ждёт 303 See Other
+    response = redirect(session['url'])
+    response.status_code = 303
+    return response
 
 
 def successPayment(request):
-    user_cart = CartForAuthenticatedUser(request)
-    user_cart.clear()
+    # Заказ закрывается по событию от Stripe (stripe_webhook), а не по переходу на эту страницу
     messages.success(request, 'Оплата прошла успешно!')
-    return render(request, 'store/success.html')
\ No newline at end of file
+    return render(request, 'store/success.html')
+
+
+@csrf_exempt
+@require_POST
+def stripe_webhook(request):
+    try:
+        enqueue_event(request.body, request.META.get('HTTP_STRIPE_SIGNATURE', ''))
+    except (ValueError, stripe.SignatureVerificationError):
+        return HttpResponse(status=400)
+    return HttpResponse()
+
+
+def metrics(request):
+    # Для сборщика Prometheus с внутренних адресов и для персонала
+    if not (request.user.is_staff or request.META.get('REMOTE_ADDR') in settings.INTERNAL_IPS):
+        return HttpResponse(status=403)
+    return HttpResponse(format_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,68 @@
+import json
+import logging
+
+import stripe
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Order, PaymentEvent
+from .utils import complete_orders, get_cart_amounts
+
+PAID_EVENTS = {'checkout.session.completed', 'checkout.session.async_payment_succeeded'}
+AMOUNT_MISMATCH = 'Сумма оплаты не совпадает с корзиной заказа'
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_event(payload, signature):
+    # Проверка подписи и одна вставка: под наплывом оплат вебхук не трогает заказы
+    event = stripe.Webhook.construct_event(payload, signature, settings.STRIPE_WEBHOOK_SECRET)
+    PaymentEvent.objects.bulk_create(
+        [PaymentEvent(stripe_id=event['id'], type=event['type'], payload=json.loads(payload))],
+        ignore_conflicts=True
+    )
+
+
+def get_paid_order_id(event):
+    if event.type not in PAID_EVENTS:
+        return None
+    session = event.payload['data']['object']
+    # Оплата банковским переводом приходит отдельным событием async_payment_succeeded
+    if event.type == 'checkout.session.completed' and session.get('payment_status') != 'paid':
+        return None
+    order_id = session.get('client_reference_id')
+    return int(order_id) if order_id and order_id.isdigit() else None
+
+
+def process_events(batch_size=500):
+    # Пачка событий закрывает все свои заказы разом в одной транзакции.
+    # Товары списаны со склада ещё при добавлении в корзину, а закрытый заказ перестаёт быть корзиной
+    with transaction.atomic():
+        events = list(PaymentEvent.objects.select_for_update(skip_locked=True).filter(
+            processed_at__isnull=True).order_by('pk')[:batch_size])
+        if not events:
+            return 0, 0
+        paid = {event.pk: get_paid_order_id(event) for event in events}
+        # Повтор completed или async_payment_succeeded после completed застаёт заказ уже закрытым -
+        # такие события просто помечаются обработанными, суммы сверяются только у открытых корзин
+        open_ids = set(Order.objects.filter(pk__in=[order_id for order_id in paid.values() if order_id is not None],
+                                            is_completed=False).values_list('pk', flat=True))
+        paid = {pk: order_id for pk, order_id in paid.items() if order_id in open_ids}
+
+        # Корзина остаётся открытой после создания сессии: если в неё добавили товары после оплаты,
+        # заказ не закрывается, а событие помечается для ручного разбора
+        amounts = get_cart_amounts(set(paid.values()))
+        flagged = [event for event in events if event.pk in paid
+                   and event.payload['data']['object'].get('amount_total') != amounts[paid[event.pk]]]
+        for event in flagged:
+            logger.warning('Событие %s, заказ %s: %s', event.stripe_id, paid[event.pk], AMOUNT_MISMATCH)
+        completed = complete_orders(set(paid.values()) - {paid[event.pk] for event in flagged})
+
+        now = timezone.now()
+        if flagged:
+            PaymentEvent.objects.filter(pk__in=[event.pk for event in flagged]).update(processed_at=now,
+                                                                                         error=AMOUNT_MISMATCH)
+        PaymentEvent.objects.filter(pk__in=[event.pk for event in events if event not in flagged]).update(
+            processed_at=now)
+    return len(events), completed